@@ -0,0 +1,94 @@
+"""
+Word batching between speech recognition and G-code compilation.
+
+Recognized text is collected in a WordBatcher until it is worth a job.  How
+many words that is depends on the backlog downstream (jobs compiling,
+queued or plotting): with the plotter idle a short batch goes out at once so
+drawing starts quickly, and while jobs are waiting the batch grows, so the
+per-job overhead (header, pen lift, move to start, UGS launch) is paid less
+often.
+"""
+import collections
+import threading
+import time
+
+
+class BatchSample:
+    """One flushed batch, for watching batch size and backlog over time"""
+
+    def __init__(self, timestamp, words, backlog, threshold, reason):
+        self.timestamp = timestamp  # time.monotonic() of the flush
+        self.words = words
+        self.backlog = backlog  # Jobs downstream when the batch was flushed
+        self.threshold = threshold  # Batch size the backlog called for
+        self.reason = reason  # "threshold", "silence" or "shutdown"
+
+    def __repr__(self):
+        return (f"BatchSample(words={self.words}, backlog={self.backlog}, "
+                f"threshold={self.threshold}, reason={self.reason!r})")
+
+
+class WordBatcher:
+    """
+    Thread-safe word buffer.  add() keeps a running word count, so checking
+    the batch size costs nothing however long the batch gets.
+    """
+
+    def __init__(self, min_words=5, words_per_job=20, max_words=80, history=1000, on_flush=None):
+        self.min_words = min_words  # Batch size with nothing queued
+        self.words_per_job = words_per_job  # Extra words per job in the backlog
+        self.max_words = max_words
+        self._words = []
+        self._lock = threading.Lock()
+        self.samples = collections.deque(maxlen=history)
+        self.on_flush = on_flush  # Called with every BatchSample as it is recorded
+
+    def __len__(self):
+        return len(self._words)
+
+    def threshold(self, backlog):
+        """Words to collect before flushing, given the number of jobs downstream"""
+        return min(self.max_words, max(self.min_words, backlog * self.words_per_job))
+
+    def add(self, text, backlog=0):
+        """
+        Add recognized text.  Returns the batch if it has reached the size
+        the backlog calls for, else None.
+        """
+        words = text.split()
+        with self._lock:
+            self._words.extend(words)
+            threshold = self.threshold(backlog)
+            if len(self._words) < threshold:
+                return None
+            return self._take(backlog, threshold, "threshold")
+
+    def flush(self, backlog=0, reason="silence"):
+        """Return whatever has been collected (None if nothing)"""
+        with self._lock:
+            if not self._words:
+                return None
+            return self._take(backlog, self.threshold(backlog), reason)
+
+    def _take(self, backlog, threshold, reason):
+        text = " ".join(self._words)
+        sample = BatchSample(time.monotonic(), len(self._words), backlog, threshold, reason)
+        self.samples.append(sample)
+        if self.on_flush is not None:
+            self.on_flush(sample)
+        self._words = []
+        return text
+
+    def summary(self):
+        """Batch count, mean and latest batch size and backlog over the recorded history"""
+        samples = list(self.samples)
+        if not samples:
+            return {"batches": 0}
+        return {
+            "batches": len(samples),
+            "mean_words": sum(sample.words for sample in samples) / len(samples),
+            "mean_backlog": sum(sample.backlog for sample in samples) / len(samples),
+            "max_backlog": max(sample.backlog for sample in samples),
+            "last_words": samples[-1].words,
+            "last_backlog": samples[-1].backlog,
+        }
@@ -0,0 +1,304 @@
+"""
+Benchmarks for the compile and estimate hot paths.
+
+Runs headless: finalpro only imports speech_recognition and pyautogui when
+it listens or drives UGS, so no microphone, display or network is needed.
+
+    python bench.py                       # run, compare with bench_baseline.json
+    python bench.py --quick               # skip the 100-page document
+    python bench.py --save-baseline       # store this run as the new baseline
+    python bench.py --output results.json --threshold 0.1
+
+Every case reports the best time of several repeats, throughput, G-code size
+per character of text and the peak memory traced while compiling.  Times are
+also divided by the time of a fixed calibration workload run just before each
+case, and those relative times are what is compared, so a baseline recorded
+on one machine still holds on another (or on a busy one).  Results are written as JSON; a case more
+than threshold (default 20%) slower, bigger or hungrier than in the baseline
+is reported as a regression and makes the exit status 1.  So does a case in
+SPEEDUPS that is no longer that many times faster than its reference in the
+same run, such as the compile against the per-point loop it replaced.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+# Text on one A4 page: 30 characters a line (180 mm between the margins at
+# 6 mm a character), 18 lines of 15 mm from the top line to the bottom margin
+PAGE_CHARS = 30 * 18
+
+WORDS = ("the quick brown fox jumps over lazy dog speech plotter pen paper line "
+         "write draw letter word sentence robot arm motor servo grbl gcode "
+         "hello world one two three four five six seven eight nine zero").split()
+
+
+def corpus(chars, seed=0):
+    """Deterministic text of about chars characters"""
+    rng = random.Random(seed)
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:max(chars, 1)]
+
+
+CASES = [
+    ("word", 5),
+    ("sentence", 120),
+    ("paragraph", 600),
+    ("page", PAGE_CHARS),
+    ("10 pages", 10 * PAGE_CHARS),
+    ("100 pages", 100 * PAGE_CHARS),
+]
+
+
+def _best_of(function, repeats):
+    best = float("inf")
+    result = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def _compile(processor_class, text, **options):
+    """Compile text with a fresh processor, counting lines and bytes"""
+    processor = processor_class()
+    lines = size = 0
+    for block in processor.iter_gcode_blocks(text, **options):
+        lines += block.count("\n")
+        size += len(block)
+    return lines, size
+
+
+def _per_point_compile(processor_class, text):
+    """
+    The character-by-character, point-by-point loop that compiled text before
+    the layout was vectorized (char wrapping, one f-string per move), as the
+    reference the vectorized compile has to beat
+    """
+    from glyphs import scaled_font
+
+    processor = processor_class()
+    font = scaled_font(processor.char_width, processor.char_height)
+    advance = processor.char_width * 1.2
+    x0, y0 = processor.current_x, processor.current_y
+    lines = ["; G-code generated from text", "G21 ; Set units to millimeters", "G90 ; Set absolute positioning",
+             "M03 S90 ; Pen up", f"G0 X{x0} Y{y0} F500 ; Move to starting position"]
+    pen_is_down = False
+    for line in text.split("\n"):
+        for char in line:
+            if x0 + advance > processor.max_line_width:
+                x0, y0 = processor.start_x, y0 - processor.line_spacing
+            for x_offset, y_offset, pen_down in font.get(char, font[" "]):
+                x, y = x0 + x_offset, y0 + y_offset
+                if pen_down != pen_is_down:
+                    lines.append("M05 ; Pen down" if pen_down else "M03 S90 ; Pen up")
+                    pen_is_down = pen_down
+                if pen_down:
+                    lines.append(f"G1 X{x} Y{y} F500 ; Draw line")
+                else:
+                    lines.append(f"G0 X{x} Y{y} F500 ; Move without drawing")
+            x0 += advance
+    lines += ["M03 S90 ; Pen up", "M2 ; End program"]
+    gcode = "\n".join(lines)
+    return len(lines), len(gcode) + 1
+
+
+def _calibration(repeats=3):
+    """Best seconds of a fixed mix of NumPy and pure-Python work, the unit of relative times"""
+    import numpy as np
+
+    values = np.random.default_rng(0).random(200_000)
+
+    def workload():
+        np.sort(values)
+        np.unique(np.round(values * 1000))
+        total = 0
+        for number in range(200_000):
+            total += number * number
+        return " ".join(map(str, range(20_000)))
+
+    return _best_of(workload, repeats)[0]
+
+
+def _peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(quick=False, repeats=3):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from finalpro import SpeechToGCodeProcessor
+
+    results = {}
+    variants = [
+        ("compile", {}),
+        ("compile optimize", {"optimize": True}),
+        ("compile compact", {"emitter": "compact"}),
+        ("compile per-point", None),
+    ]
+    big_gcode = None
+    for case, chars in CASES:
+        if quick and chars > 10 * PAGE_CHARS:
+            continue
+        text = corpus(chars)
+        # Small cases are noisy, so they run more often; 100 pages only once
+        case_repeats = 1 if chars > 10 * PAGE_CHARS else repeats if chars >= PAGE_CHARS else repeats * 5
+        for variant, options in variants:
+            if options is None:
+                def compile_text():
+                    return _per_point_compile(SpeechToGCodeProcessor, text)
+            else:
+                def compile_text():
+                    return _compile(SpeechToGCodeProcessor, text, **options)
+            calibration = _calibration()
+            seconds, (lines, size) = _best_of(compile_text, case_repeats)
+            peak = _peak_memory(compile_text)
+            results[f"{variant}: {case}"] = {
+                "chars": len(text),
+                "seconds": seconds,
+                "relative": seconds / calibration,
+                "chars_per_second": len(text) / seconds,
+                "lines": lines,
+                "bytes": size,
+                "bytes_per_char": size / len(text),
+                "peak_memory": peak,
+            }
+        if chars == 10 * PAGE_CHARS:
+            big_gcode = SpeechToGCodeProcessor().text_to_gcode(text)
+
+    # Estimators on a large program
+    processor = SpeechToGCodeProcessor()
+    lines = big_gcode.split("\n")
+
+    def streaming():
+        estimate = processor.time_estimator().streaming()
+        estimate.feed_lines(lines)
+        return estimate.finish()
+
+    estimators = [
+        ("estimate", lambda: processor.estimate_plotting_time(big_gcode)),
+        ("estimate streaming", streaming),
+        ("calculate_plotting_time", lambda: processor.calculate_plotting_time(big_gcode)),
+    ]
+    program = SpeechToGCodeProcessor().text_to_strokes(corpus(10 * PAGE_CHARS))
+    estimators.append(("estimate strokes", lambda: processor.estimate_plotting_time(program)))
+    calibrations = []
+    for name, function in estimators:
+        calibration = _calibration()
+        calibrations.append(calibration)
+        seconds, _ = _best_of(function, repeats)
+        results[f"{name}: 10 pages"] = {
+            "lines": len(lines),
+            "seconds": seconds,
+            "relative": seconds / calibration,
+            "lines_per_second": len(lines) / seconds,
+            "peak_memory": _peak_memory(function),
+        }
+
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": sys.modules["numpy"].__version__,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "calibration": min(calibrations),  # Best seconds of the calibration workload
+        },
+        "results": results,
+    }
+
+
+# Lower is better for these; the others (absolute seconds among them) are informational
+COMPARED = ("relative", "bytes_per_char", "peak_memory")
+
+# Cases that must stay this many times faster than a reference in the same run
+# (not the 100-page cases: they run once, too few to compare two timings)
+SPEEDUPS = [
+    ("compile: 10 pages", "compile per-point: 10 pages", 1.5),
+]
+
+
+def check_speedups(report):
+    """Messages for every case in SPEEDUPS that lost its lead over the reference"""
+    results = report["results"]
+    failures = []
+    for name, reference, factor in SPEEDUPS:
+        if name in results and reference in results:
+            speedup = results[reference]["seconds"] / results[name]["seconds"]
+            if speedup < factor:
+                failures.append(f"{name}: {speedup:.2f}x faster than {reference}, expected {factor:.1f}x")
+    return failures
+
+
+def compare(report, baseline, threshold):
+    """Messages for every compared metric worse than the baseline by more than threshold"""
+    regressions = []
+    for name, metrics in report["results"].items():
+        before = baseline.get("results", {}).get(name)
+        if not before:
+            continue
+        for metric in COMPARED:
+            if metric in metrics and before.get(metric) and metrics[metric] > before[metric] * (1 + threshold):
+                regressions.append(f"{name}: {metric} {before[metric]:.4g} -> {metrics[metric]:.4g} "
+                                   f"({metrics[metric] / before[metric] - 1:+.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark G-code compilation and plot time estimation")
+    parser.add_argument("--quick", action="store_true", help="Skip the 100-page document")
+    parser.add_argument("--repeats", type=int, default=3, help="Runs per case; the best time counts")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline results to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative slowdown or growth reported as a regression")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the baseline")
+    args = parser.parse_args(argv)
+
+    report = run(quick=args.quick, repeats=args.repeats)
+    for name, metrics in report["results"].items():
+        rate = metrics.get("chars_per_second") or metrics.get("lines_per_second")
+        extra = f"{metrics['bytes_per_char']:6.1f} B/char" if "bytes_per_char" in metrics else " " * 13
+        print(f"{name:36} {metrics['seconds'] * 1000:10.2f} ms {rate:12.0f}/s {extra} "
+              f"{metrics['peak_memory'] / 1e6:8.1f} MB")
+    too_slow = check_speedups(report)
+    for message in too_slow:
+        print(f"TOO SLOW {message}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return 1 if too_slow else 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return 1 if too_slow else 0
+    with open(args.baseline) as f:
+        regressions = compare(report, json.load(f), args.threshold)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (threshold {args.threshold:.0%})")
+    return 1 if regressions or too_slow else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
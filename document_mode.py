@@ -0,0 +1,170 @@
+"""
+Compile a whole text document to G-code on all cores.
+
+    python document_mode.py book.txt -o book.gcode
+    cat notes.txt | python document_mode.py - -o notes.gcode --workers 8
+
+One sequential pass lays the document out (the vectorized layout is cheap)
+and fixes the position of every line and the page it is on.  Lines are optimized with
+anchor_lines, so no line depends on where the previous one ended, and the
+pages are then optimized (and simplified) in a process pool.  Once every
+line's end point is known, the state the emitter is in at the start of each
+page follows (after the paper-change stop where a new sheet starts), and the
+pages are formatted in the pool as well.  The chunks
+are joined in order with the header and footer from the parent.
+
+The 2-opt search runs for a fixed number of passes instead of a time budget,
+so the result does not depend on timing: the output is byte-identical to
+text_to_gcode with the same settings, which --verify checks.
+"""
+import argparse
+import copy
+import logging
+import math
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from geometry import simplify_program
+from layout import WRAPS
+from stroke_optimizer import optimize_program
+from strokes import StrokeProgram
+
+logger = logging.getLogger(__name__)
+
+
+def _optimize_page(rows, optimize, time_budget, simplify, tolerance, arc_tolerance):
+    """Worker: a StrokeProgram per (x, y, pen) row, as SpeechToGCodeProcessor.iter_strokes builds them"""
+    programs = []
+    for x, y, pen in rows:
+        program = StrokeProgram.from_points(x, y, pen, (x[0], y[0]) if len(x) else (0.0, 0.0))
+        if optimize:
+            program = optimize_program(program, time_budget=time_budget)
+        if simplify:
+            program, _ = simplify_program(program, tolerance, arc_tolerance)
+        programs.append(program)
+    return programs
+
+
+def _emit_page(emitter, head, programs):
+    """Worker: head and the G-code lines for programs, with emitter in the state they start in"""
+    lines = list(head)
+    for program in programs:
+        lines.extend(emitter.strokes(program))
+    return lines
+
+
+def lines_per_page(processor):
+    return processor.page_geometry().lines or max(1, int(processor.page_height // processor.line_spacing))
+
+
+def compile_document(processor, text, workers=None, page_lines=None):
+    """
+    G-code for text as a list of lines, compiled by a pool of workers (None:
+    one per core), one page or page_lines lines on the paper at a time.  The
+    processor's cursor advances as for text_to_gcode.
+    """
+    processor.anchor_lines = True
+    processor.optimize_time_budget = math.inf  # Passes only, so the result is reproducible
+    page_lines = page_lines or lines_per_page(processor)
+    emitter = processor.make_emitter()
+
+    header = emitter.begin((processor.current_x, processor.current_y),
+                           first_batch=not processor.position_initialized)
+    processor.position_initialized = True
+    start = (processor.current_x, processor.current_y)
+    page = processor.current_page
+    # The sequential pass: every line's vertices at its place on the paper,
+    # split into tasks that never span two pages
+    tasks = []
+    for x, y, pen, row_page in processor._layout_rows(text, processor.char_width, processor.char_height,
+                                                      processor.line_spacing):
+        if not tasks or tasks[-1][0] != row_page or len(tasks[-1][1]) == page_lines:
+            tasks.append((row_page, []))
+        tasks[-1][1].append((x, y, pen))
+    pages = [rows for _, rows in tasks]
+    logger.info(f"{sum(map(len, pages))} lines on {len({row_page for row_page, _ in tasks})} pages")
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        options = (processor.optimize_travel, processor.optimize_time_budget, processor.simplify_geometry,
+                   processor.simplify_tolerance, processor.arc_tolerance)
+        page_programs = list(pool.map(_optimize_page, pages, *[[option] * len(pages) for option in options]))
+
+        # Chain the lines and note the emitter's state where each page starts
+        states = []
+        heads = []
+        position = start
+        for (task_page, _), programs in zip(tasks, page_programs):
+            heads.append(processor.page_break(emitter, task_page) if task_page != page else [])
+            page = task_page
+            states.append(copy.deepcopy(emitter))
+            for program in programs:
+                program.start = position
+                position = program.end
+                emitter.skip(program)
+        chunks = pool.map(_emit_page, states, heads, page_programs)
+        body = [line for chunk in chunks for line in chunk]
+    return header + body + emitter.end()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a text document to G-code in parallel")
+    parser.add_argument("input", help="Text file, or - for stdin")
+    parser.add_argument("-o", "--output", help="G-code file (default: stdout)")
+    parser.add_argument("--workers", type=int, help="Worker processes (default: one per core)")
+    parser.add_argument("--page-lines", type=int, help="Lines compiled per task (default: one page)")
+    parser.add_argument("--emitter", default="grbl", help="Output format (grbl or compact)")
+    parser.add_argument("--no-optimize", action="store_true", help="Keep the strokes in font order")
+    parser.add_argument("--simplify", action="store_true", help="Simplify strokes and draw curves as arcs")
+    parser.add_argument("--font", help="Font compiled by font_compiler.py (default: the built-in glyphs)")
+    parser.add_argument("--wrap", choices=WRAPS, default="greedy",
+                        help="Break lines between words (greedy or balanced) or at any character (char)")
+    parser.add_argument("--verify", action="store_true",
+                        help="Also compile serially and check that the output is identical")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stderr)
+
+    from finalpro import SpeechToGCodeProcessor
+
+    def make_processor():
+        processor = SpeechToGCodeProcessor()
+        processor.emitter = args.emitter
+        processor.optimize_travel = not args.no_optimize
+        processor.simplify_geometry = args.simplify
+        processor.font = args.font
+        processor.wrap = args.wrap
+        return processor
+
+    if args.input == "-":
+        text = sys.stdin.read()
+    else:
+        with open(args.input, encoding="utf-8") as f:
+            text = f.read()
+
+    started = time.perf_counter()
+    gcode = "\n".join(compile_document(make_processor(), text, args.workers, args.page_lines))
+    elapsed = time.perf_counter() - started
+    logger.info(f"Compiled {len(text)} characters in {elapsed:.2f} s")
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(gcode + "\n")
+    else:
+        sys.stdout.write(gcode + "\n")
+
+    if args.verify:
+        serial = make_processor()
+        serial.anchor_lines = True
+        serial.optimize_time_budget = math.inf
+        started = time.perf_counter()
+        expected = serial.text_to_gcode(text)
+        serial_elapsed = time.perf_counter() - started
+        if expected != gcode:
+            logger.error("Parallel output differs from the serial compile")
+            return 1
+        logger.info(f"Identical to the serial compile, which took {serial_elapsed:.2f} s "
+                    f"({serial_elapsed / elapsed:.1f}x)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
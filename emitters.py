@@ -0,0 +1,487 @@
+"""
+Output back ends for StrokePrograms.
+
+Every emitter takes the same three calls, so a job can be produced in pieces
+(one line of text at a time) without the emitter seeing the whole job:
+
+    lines = emitter.begin(position, first_batch)
+    lines += emitter.strokes(program)   # as often as needed
+    lines += emitter.end()
+
+strokes() also takes the feed of every pen-down move, as planned by
+feed_planner.FeedPlanner; without them everything is drawn at drawing_speed.
+strokes_text() returns the same lines as one string, each line ending in a
+newline, which is cheaper to write or join than a list of lines.
+
+In a continuous session the emitter lives as long as the session: every batch
+is emitted as strokes() followed by pause(), which lifts the pen but does not
+end the program, and end() is only called when the session closes.
+
+skip(program) leaves the emitter in the state strokes(program) would, for
+output formatted by copies of it elsewhere (document_mode emits pages in
+parallel from the state each page starts in).
+
+translate(lines, offset) moves a G-code emitter's finished output by
+offset, for a job compiled once and reused at another place on the paper.
+
+Between two pages of text, page_break(page) lifts the pen and stops the
+program (M0) until the paper has been changed and the cycle is resumed.
+
+GcodeEmitter writes the standard GRBL program this project has always sent,
+CompactGcodeEmitter writes the same moves in as few bytes as possible, and
+SvgEmitter draws a preview of the page.
+"""
+import re
+
+import numpy as np
+
+from strokes import LINE, CLOCKWISE, COUNTERCLOCKWISE
+
+TRAVEL = 0  # Motion code of pen-up moves in the emitters' templates
+ARC_PRECISION = 3  # Fewest decimals of CompactGcodeEmitter's arc centers; GRBL checks radii to 0.005 mm
+
+_AXIS_WORD = re.compile(r"([XY])(-?\d*\.?\d+(?:e[-+]?\d+)?)")
+_DISTANCE_MODE = re.compile(r"\bG9([01])\b")
+
+
+def _coordinates(values, before="", after="", formatted=None):
+    """
+    repr of every value with before and after around it, formatting each
+    distinct value once.  Laid-out text reuses a few hundred distinct
+    coordinates, so formatted (a dict) can keep the text of each value for
+    later calls.  Zeros are always formatted afresh, as 0.0 and -0.0 are
+    equal keys but print differently.
+    """
+    unique, inverse = np.unique(values, return_inverse=True)
+    if formatted is None:
+        return np.array([before + repr(value) + after for value in unique.tolist()], dtype=object)[inverse]
+    if len(formatted) > 100_000:
+        formatted.clear()
+    texts = []
+    for value in unique.tolist():
+        text = formatted.get(value)
+        if text is None:
+            text = before + repr(value) + after
+            if value:
+                formatted[value] = text
+        texts.append(text)
+    return np.array(texts, dtype=object)[inverse]
+
+
+def _fixed(values, precision):
+    """
+    Format integers counted in units of 10**-precision mm as the shortest
+    decimals ("12.5", "-0.05", "3"), each distinct value once
+    """
+    unique, inverse = np.unique(values, return_inverse=True)
+    scale = 10 ** precision
+    text = []
+    for value in unique.tolist():
+        whole, fraction = divmod(abs(value), scale)
+        digits = f"{whole}.{fraction:0{precision}d}".rstrip("0").rstrip(".") if precision else str(whole)
+        text.append("-" + digits if value < 0 else digits)
+    return np.array(text, dtype=object)[inverse]
+
+
+class GcodeEmitter:
+    """Absolute G-code with the feed on every move and optional comments"""
+
+    def __init__(self, travel_speed=500, drawing_speed=500, pen_up_cmd="M03 S90", pen_down_cmd="M05",
+                 comments=True):
+        self.travel_speed = travel_speed
+        self.drawing_speed = drawing_speed
+        self.pen_up_cmd = pen_up_cmd
+        self.pen_down_cmd = pen_down_cmd
+        self.comments = comments
+        self.pen_is_down = False
+        self.motion = TRAVEL  # Modal motion of the last move written
+        self.position = (0.0, 0.0)
+        self._formatted = {}  # (motion, column, planned, dtype kind) -> {value: text} for _coordinates
+
+    def annotate(self, command, comment):
+        return f"{command} ; {comment}" if self.comments else command
+
+    def begin(self, position, first_batch=True):
+        """Program header: units, positioning, pen up and the move to position"""
+        lines = []
+        if self.comments:
+            lines.append("; G-code generated from text")
+        lines.append(self.annotate("G21", "Set units to millimeters"))
+        lines.append(self.annotate("G90", "Set absolute positioning"))
+        # The pen state is unknown when a program starts, so always lift it here
+        lines.append(self.annotate(self.pen_up_cmd, "Pen up"))
+        self.pen_is_down = False
+        self.motion = TRAVEL
+        self.position = position
+        comment = "Move to starting position" if first_batch else "Continue from previous position"
+        lines.append(self.annotate(f"G0 X{position[0]} Y{position[1]} F{self.travel_speed}", comment))
+        return lines
+
+    def _templates(self, planned=False):
+        """
+        Line templates by motion code.  Arc templates take X, Y, I and J, and
+        with planned feeds drawing templates take F.
+        """
+        feed = "{}" if planned else self.drawing_speed
+        move = self.annotate(f"G0 X{{}} Y{{}} F{self.travel_speed}", "Move without drawing")
+        draw = self.annotate(f"G1 X{{}} Y{{}} F{feed}", "Draw line")
+        clockwise = self.annotate(f"G2 X{{}} Y{{}} I{{}} J{{}} F{feed}", "Draw clockwise arc")
+        counterclockwise = self.annotate(f"G3 X{{}} Y{{}} I{{}} J{{}} F{feed}", "Draw counterclockwise arc")
+        return {
+            TRAVEL: move,
+            LINE: draw,
+            CLOCKWISE: clockwise,
+            COUNTERCLOCKWISE: counterclockwise,
+        }
+
+    def strokes(self, program, feeds=None):
+        """The lines of strokes_text(program, feeds) as a list"""
+        return self.strokes_text(program, feeds).split("\n")[:-1]
+
+    def strokes_text(self, program, feeds=None):
+        """
+        Format a program's moves in bulk, inserting pen commands only where
+        the pen state changes.  feeds, if given, are the mm/min of every
+        move of program.to_points() (only pen-down moves use them).
+        """
+        x, y, pen = program.to_points()
+        count = len(pen)
+        if not count:
+            return ""
+        motions, centers = program.point_motions()
+        changes = pen != np.concatenate([[self.pen_is_down], pen[:-1]])
+        slots = np.arange(count) + np.cumsum(changes)
+        values = {TRAVEL: [x, y], LINE: [x, y]}
+        arcs = (motions == CLOCKWISE) | (motions == COUNTERCLOCKWISE)
+        if arcs.any():
+            # Arc centers relative to the point each arc starts from
+            previous_x = np.concatenate([[self.position[0]], x[:-1]])
+            previous_y = np.concatenate([[self.position[1]], y[:-1]])
+            values[CLOCKWISE] = values[COUNTERCLOCKWISE] = [
+                x, y, np.round(np.where(arcs, centers[:, 0] - previous_x, 0.0), 4),
+                np.round(np.where(arcs, centers[:, 1] - previous_y, 0.0), 4)]
+        if feeds is not None:
+            for motion in values:
+                if motion != TRAVEL:
+                    values[motion] = values[motion] + [np.asarray(feeds)]
+        # A move is written as one piece per value: the value with the
+        # template's text after it (and before it, for the first value).
+        # Every distinct piece is formatted once and all pieces are joined at
+        # once, which is much faster than formatting line by line.
+        templates = {motion: template.split("{}") for motion, template in self._templates(feeds is not None).items()}
+        sizes = np.ones(count + int(changes.sum()), dtype=np.int64)  # Pen commands are one piece
+        for motion, columns in values.items():
+            sizes[slots[motions == motion]] = len(columns)
+        starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+        pieces = np.empty(int(sizes.sum()), dtype=object)
+        for motion, columns in values.items():
+            selected = motions == motion
+            if not selected.any():
+                continue
+            texts = templates[motion]
+            first = starts[slots[selected]]
+            for index, column in enumerate(columns):
+                before = texts[0] if index == 0 else ""
+                after = texts[index + 1] + ("\n" if index == len(columns) - 1 else "")
+                cache = self._formatted.setdefault((motion, index, feeds is not None, column.dtype.kind), {})
+                pieces[first + index] = _coordinates(column[selected], before, after, cache)
+        pieces[starts[slots[changes & pen] - 1]] = self.annotate(self.pen_down_cmd, "Pen down") + "\n"
+        pieces[starts[slots[changes & ~pen] - 1]] = self.annotate(self.pen_up_cmd, "Pen up") + "\n"
+        self.pen_is_down = bool(pen[-1])
+        self.motion = int(motions[-1])
+        self.position = (float(x[-1]), float(y[-1]))
+        return "".join(pieces.tolist())
+
+    def skip(self, program, feeds=None):
+        """
+        Leave the emitter in the state strokes(program, feeds) would, without
+        formatting anything (for output formatted elsewhere, as by
+        document_mode)
+        """
+        x, y, pen = program.to_points()
+        if not len(pen):
+            return
+        motions, _ = program.point_motions()
+        self.pen_is_down = bool(pen[-1])
+        self.motion = int(motions[-1])
+        self.position = (float(x[-1]), float(y[-1]))
+
+    def pause(self):
+        """End a segment of a continuous stream: lift the pen but keep the program running"""
+        if not self.pen_is_down:
+            return []
+        self.pen_is_down = False
+        return [self.annotate(self.pen_up_cmd, "Pen up")]
+
+    def page_break(self, page):
+        """Lift the pen and pause the program until the sheet for page (counted from 0) is in"""
+        return self.pause() + [self.annotate("M0", f"Page {page + 1}: change the paper, then resume")]
+
+    def end(self):
+        return self.pause() + [self.annotate("M2", "End program")]
+
+    def emit(self, program, first_batch=True):
+        """The whole program for one StrokeProgram"""
+        return self.begin(program.start, first_batch) + self.strokes(program) + self.end()
+
+    def translate(self, lines, offset):
+        """
+        Yield lines written by this emitter moved by offset (dx, dy): the X
+        and Y words of absolute (G90) moves shift, relative (G91) moves,
+        arc centre offsets and comments stay as they are
+        """
+        shifts = {"X": offset[0], "Y": offset[1]}
+
+        def shift(match):
+            return match.group(1) + self._coordinate(float(match.group(2)) + shifts[match.group(1)])
+
+        absolute = True
+        for line in lines:
+            code, separator, comment = line.partition(";")
+            mode = _DISTANCE_MODE.search(code)
+            if mode:
+                absolute = mode.group(1) == "0"
+            if absolute:
+                code = _AXIS_WORD.sub(shift, code)
+            yield code + separator + comment
+
+    def _coordinate(self, value):
+        return repr(value)
+
+
+class CompactGcodeEmitter(GcodeEmitter):
+    """
+    The same moves in as few bytes as possible, for slow serial links: no
+    comments, coordinates rounded to precision decimals with trailing zeros
+    dropped, the motion mode (G0/G1/G2/G3) written only when it changes, an
+    axis written only when it moves, and the drawing feed written only when
+    it changes.  Travel moves are G0, which runs at the machine's maximum
+    rate and takes no feed.
+
+    Positions are rounded to whole units of 10**-precision mm before anything
+    is written, so with relative=True (G91) the deltas add up exactly to the
+    rounded absolute positions and never drift.  Arc centers are fitted to
+    the rounded ends and written with at least ARC_PRECISION decimals (see
+    _arc_offsets), so GRBL accepts the arcs at any precision.  The output is
+    the same for the same input, byte for byte.
+
+    With compare=True the same moves are also formatted by GcodeEmitter,
+    and bytes and reference_bytes count the output of both.
+    """
+
+    def __init__(self, travel_speed=500, drawing_speed=500, pen_up_cmd="M03 S90", pen_down_cmd="M05",
+                 comments=False, precision=3, relative=False, compare=False):
+        # Comments are never written, whatever the caller asks for
+        super().__init__(travel_speed, drawing_speed, pen_up_cmd, pen_down_cmd, comments=False)
+        self.precision = precision
+        self.relative = relative
+        self.reference = GcodeEmitter(travel_speed, drawing_speed, pen_up_cmd, pen_down_cmd) if compare else None
+        self.bytes = 0  # Bytes written, counting a newline per line
+        self.reference_bytes = 0  # What GcodeEmitter wrote for the same moves
+        self._units = (0, 0)  # Position in units of 10**-precision mm
+        self._feed = drawing_speed  # Modal feed of the drawing moves
+
+    def _count(self, lines, reference_lines):
+        self.bytes += sum(map(len, lines)) + len(lines)
+        if self.reference is not None:
+            self.reference_bytes += sum(map(len, reference_lines)) + len(reference_lines)
+        return lines
+
+    def _to_units(self, values):
+        return np.rint(np.asarray(values, dtype=float) * 10 ** self.precision).astype(np.int64)
+
+    def _arc_offsets(self, centers, start_x, start_y, end_x, end_y, precision):
+        """
+        I and J of arcs between the start and end units, in units of
+        10**-precision mm, and a mask of the arcs that can be drawn.  GRBL
+        stops with error:33 when the start and end are over 0.005 mm apart in
+        their distance from the center, which ends rounded to 0.1 mm easily
+        are, so the center is moved onto the line halfway between the rounded
+        ends.  An arc whose ends round to the same point would be drawn as a
+        full circle, so it is left out of the mask and drawn as a line.
+        """
+        unit = 10.0 ** -self.precision
+        start = np.column_stack([start_x, start_y]) * unit
+        chord = np.column_stack([end_x - start_x, end_y - start_y]) * unit
+        length = np.hypot(chord[:, 0], chord[:, 1])
+        kept = length > 0
+        normal = np.column_stack([-chord[:, 1], chord[:, 0]]) / np.where(kept, length, 1.0)[:, None]
+        middle = start + chord / 2
+        along = np.sum((np.nan_to_num(centers) - middle) * normal, axis=1)
+        units = np.rint((middle + normal * along[:, None] - start) * 10 ** precision).astype(np.int64)
+        return units[:, 0], units[:, 1], kept
+
+    def _coordinate(self, value):
+        return _fixed(self._to_units([value]), self.precision)[0]
+
+    def begin(self, position, first_batch=True):
+        self.pen_is_down = False
+        self.motion = TRAVEL
+        self.position = position
+        units = self._to_units(position)
+        self._units = (int(units[0]), int(units[1]))
+        self._feed = self.drawing_speed
+        x, y = _fixed(units, self.precision).tolist()
+        # The start is absolute either way; relative moves follow it
+        lines = ["G21", "G90", self.pen_up_cmd, f"G0 X{x} Y{y}", f"F{self.drawing_speed}"]
+        if self.relative:
+            lines.append("G91")
+        return self._count(lines, self.reference.begin(position, first_batch) if self.reference else ())
+
+    def strokes(self, program, feeds=None):
+        reference_lines = self.reference.strokes(program, feeds) if self.reference else ()
+        x, y, pen = program.to_points()
+        count = len(pen)
+        if not count:
+            return []
+        motions, centers = program.point_motions()
+        units_x, units_y = self._to_units(x), self._to_units(y)
+        previous_x = np.concatenate([[self._units[0]], units_x[:-1]])
+        previous_y = np.concatenate([[self._units[1]], units_y[:-1]])
+        moved_x = units_x != previous_x
+        moved_y = units_y != previous_y
+        moved_x |= ~moved_y  # A move that rounds to nothing still needs a word
+        values_x = units_x - previous_x if self.relative else units_x
+        values_y = units_y - previous_y if self.relative else units_y
+
+        arcs = (motions == CLOCKWISE) | (motions == COUNTERCLOCKWISE)
+        if arcs.any():
+            arc_precision = max(self.precision, ARC_PRECISION)
+            offsets_i, offsets_j, kept = self._arc_offsets(centers, previous_x, previous_y, units_x, units_y,
+                                                           arc_precision)
+            motions = np.where(arcs & ~kept, LINE, motions)
+            arcs &= kept
+
+        empty = np.full(count, "", dtype=object)
+        codes = np.array(["G0 ", "G1 ", "G2 ", "G3 "], dtype=object)
+        first = motions != np.concatenate([[self.motion], motions[:-1]])
+        words = np.where(first, codes[motions], empty)
+        words = words + np.where(moved_x, "X" + _fixed(values_x, self.precision), empty)
+        words = words + np.where(moved_x & moved_y, " ", empty)
+        words = words + np.where(moved_y, "Y" + _fixed(values_y, self.precision), empty)
+        if arcs.any():
+            words = words + np.where(arcs, " I" + _fixed(offsets_i, arc_precision) + " J"
+                                     + _fixed(offsets_j, arc_precision), empty)
+        if feeds is not None:
+            # F is modal and G0 ignores it, so compare each drawing move's
+            # feed with the previous drawing move's
+            drawing = np.flatnonzero(motions != TRAVEL)
+            drawn = np.asarray(feeds)[drawing]
+            changed = np.zeros(count, dtype=bool)
+            changed[drawing] = drawn != np.concatenate([[self._feed], drawn[:-1]])
+            words = words + np.where(changed, " F" + _fixed(np.asarray(feeds, dtype=np.int64), 0), empty)
+            if len(drawn):
+                self._feed = drawn[-1].item()
+
+        changes = pen != np.concatenate([[self.pen_is_down], pen[:-1]])
+        slots = np.arange(count) + np.cumsum(changes)
+        lines = np.empty(count + int(changes.sum()), dtype=object)
+        lines[slots] = words
+        lines[slots[changes & pen] - 1] = self.pen_down_cmd
+        lines[slots[changes & ~pen] - 1] = self.pen_up_cmd
+        self.pen_is_down = bool(pen[-1])
+        self.motion = int(motions[-1])
+        self.position = (float(x[-1]), float(y[-1]))
+        self._units = (int(units_x[-1]), int(units_y[-1]))
+        return self._count(lines.tolist(), reference_lines)
+
+    def strokes_text(self, program, feeds=None):
+        return "".join(line + "\n" for line in self.strokes(program, feeds))
+
+    def skip(self, program, feeds=None):
+        if self.reference is not None:
+            self.reference.skip(program, feeds)
+        x, y, pen = program.to_points()
+        if not len(pen):
+            return
+        super().skip(program, feeds)
+        units = self._to_units([x[-1], y[-1]])
+        self._units = (int(units[0]), int(units[1]))
+        if feeds is not None:
+            motions, _ = program.point_motions()
+            drawn = np.asarray(feeds)[motions != TRAVEL]
+            if len(drawn):
+                self._feed = drawn[-1].item()
+
+    def pause(self):
+        reference_lines = self.reference.pause() if self.reference else ()
+        return self._count(super().pause(), reference_lines)
+
+    def page_break(self, page):
+        lines = self.pause()
+        reference_lines = self.reference.page_break(page) if self.reference else ()
+        return lines + self._count(["M0"], reference_lines)
+
+    def end(self):
+        lines = self.pause()
+        reference_lines = self.reference.end() if self.reference else ()
+        return lines + self._count(["M2"], reference_lines)
+
+
+class SvgEmitter:
+    """
+    SVG preview of the page in millimetres: strokes in black, pen-up travel
+    as dashed red lines (show_travel=False leaves it out)
+    """
+
+    def __init__(self, page_width=210, page_height=297, show_travel=True, stroke_width=0.3, **_):
+        self.page_width = page_width
+        self.page_height = page_height
+        self.show_travel = show_travel
+        self.stroke_width = stroke_width
+        self.position = (0.0, 0.0)
+
+    def _point(self, x, y):
+        # G-code Y grows up the page, SVG Y grows down
+        return f"{x:.3f},{self.page_height - y:.3f}"
+
+    def begin(self, position, first_batch=True):
+        self.position = position
+        return [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.page_width}mm" '
+            f'height="{self.page_height}mm" viewBox="0 0 {self.page_width} {self.page_height}">',
+            f'<g fill="none" stroke-linecap="round" stroke-linejoin="round" stroke-width="{self.stroke_width}">',
+        ]
+
+    def strokes(self, program, feeds=None):
+        lines = []
+        position = self.position
+        for stroke in program.flattened(tolerance=0.05).strokes():
+            start = (float(stroke[0, 0]), float(stroke[0, 1]))
+            if self.show_travel and start != position:
+                lines.append(f'<line class="travel" stroke="red" stroke-dasharray="1,1" '
+                             f'x1="{position[0]:.3f}" y1="{self.page_height - position[1]:.3f}" '
+                             f'x2="{start[0]:.3f}" y2="{self.page_height - start[1]:.3f}"/>')
+            points = " ".join(self._point(x, y) for x, y in stroke.tolist())
+            lines.append(f'<polyline class="stroke" stroke="black" points="{points}"/>')
+            position = (float(stroke[-1, 0]), float(stroke[-1, 1]))
+        self.position = position
+        return lines
+
+    def strokes_text(self, program, feeds=None):
+        return "".join(line + "\n" for line in self.strokes(program, feeds))
+
+    def skip(self, program, feeds=None):
+        if len(program):
+            self.position = program.end
+
+    def pause(self):
+        return []
+
+    def page_break(self, page):
+        # The preview shows every page on the one sheet
+        return []
+
+    def end(self):
+        return ["</g>", "</svg>"]
+
+    def emit(self, program, first_batch=True):
+        return self.begin(program.start, first_batch) + self.strokes(program) + self.end()
+
+
+# Emitters by name, for settings and the command line
+EMITTERS = {
+    "grbl": GcodeEmitter,
+    "compact": CompactGcodeEmitter,
+    "svg": SvgEmitter,
+}
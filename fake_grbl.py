@@ -0,0 +1,160 @@
+"""
+Pure-Python stand-in for a GRBL 1.1 controller on a pseudo-terminal.
+
+Lets the serial streamer be exercised on a headless Linux box without a
+plotter attached:
+
+    python fake_grbl.py            # prints the port to connect to
+
+The fake keeps a 128-byte RX buffer and a small planner queue like the real
+firmware, answers every line with "ok" or "error:N", and handles the
+real-time commands (?, !, ~ and Ctrl-X).  A program pause (M0/M1) waits for
+the moves before it, holds, and is only answered after cycle start (~), as
+on the real firmware.  It records whether its RX buffer was ever overrun,
+which is what character-counting flow control must prevent.
+"""
+import collections
+import os
+import re
+import select
+import threading
+import time
+import tty
+
+BANNER = b"\r\nGrbl 1.1h ['$' for help]\r\n"
+
+_WORD = re.compile(r"([A-Z])(-?\d*\.?\d+)")
+_PAUSE = re.compile(r"M0*[01]$")
+
+
+class FakeGrbl:
+    def __init__(self, rx_buffer_size=128, planner_blocks=15, block_time=0.0):
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_blocks = planner_blocks
+        self.block_time = block_time  # Seconds each motion block takes to "execute"
+        self.received = []  # Every line taken out of the RX buffer
+        self.overflowed = False  # Set if the host ever overran the RX buffer
+        self.max_rx_used = 0
+        self.position = [0.0, 0.0, 0.0]
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._rx = bytearray()
+        self._planner = collections.deque()
+        self._hold = False
+        self._pausing = False  # A program pause has been read; its "ok" waits for cycle start
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=1)
+        os.close(self._master)
+        os.close(self._slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _reply(self, data):
+        if data:
+            os.write(self._master, data)
+
+    def _state(self):
+        if self._hold:
+            return "Hold:0"
+        return "Run" if self._planner else "Idle"
+
+    def _status_report(self):
+        x, y, z = self.position
+        return f"<{self._state()}|MPos:{x:.3f},{y:.3f},{z:.3f}|FS:0,0>\r\n".encode("ascii")
+
+    def _reset(self):
+        self._rx.clear()
+        self._planner.clear()
+        self._hold = False
+        self._pausing = False
+        self._reply(BANNER)
+
+    def _receive(self, data):
+        for byte in data:
+            char = bytes((byte,))
+            if char == b"?":
+                self._reply(self._status_report())
+            elif char == b"!":
+                self._hold = True
+            elif char == b"~":
+                if self._pausing and self._hold:
+                    self._pausing = False
+                    self._reply(b"ok\r\n")
+                self._hold = False
+            elif char == b"\x18":
+                self._reset()
+            else:
+                self._rx.append(byte)
+        self.max_rx_used = max(self.max_rx_used, len(self._rx))
+        if len(self._rx) > self.rx_buffer_size:
+            self.overflowed = True
+
+    def _execute(self, line):
+        """Check one line and queue it; returns GRBL's answer, or None if it is held back"""
+        line = line.strip().upper()
+        self.received.append(line)
+        if not line or line.startswith("$"):
+            return b"ok\r\n"
+        if _PAUSE.match(line.replace(" ", "")):
+            self._pausing = True
+            return None
+        words = _WORD.findall(line)
+        if "".join(letter + value for letter, value in words) != line.replace(" ", ""):
+            return b"error:1\r\n"  # Expected command letter
+        for letter, value in words:
+            if letter in "XYZ":
+                self.position["XYZ".index(letter)] = float(value)
+        self._planner.append(line)
+        return b"ok\r\n"
+
+    def _run(self):
+        block_done = time.monotonic()
+        while self._running:
+            readable, _, _ = select.select([self._master], [], [], 0.005)
+            if readable:
+                try:
+                    self._receive(os.read(self._master, 1024))
+                except OSError:
+                    break
+
+            # Finish motion blocks at block_time each, unless on feed hold
+            now = time.monotonic()
+            if self._planner and not self._hold and now >= block_done:
+                self._planner.popleft()
+                block_done = now + self.block_time
+            if self._pausing and not self._planner:
+                self._hold = True  # The moves before the pause are done
+
+            # GRBL only takes a line out of the RX buffer (and answers it)
+            # once the planner has room for it, and none during a pause
+            while b"\n" in self._rx and len(self._planner) < self.planner_blocks and not self._pausing:
+                index = self._rx.index(b"\n")
+                line = self._rx[:index].decode("ascii", "replace")
+                del self._rx[:index + 1]
+                self._reply(self._execute(line))
+
+
+if __name__ == "__main__":
+    grbl = FakeGrbl(block_time=0.01).start()
+    print(f"Fake GRBL listening on {grbl.port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        grbl.stop()
@@ -0,0 +1,114 @@
+"""
+Feed rates planned move by move instead of one drawing feed for a whole job.
+
+Every pen-down move starts from drawing_speed and is raised towards
+max_drawing_speed (at most the machine's max_rate) as far as the move can
+use it: by how straight the pen runs on into the next move, interpolated on
+the cosine of the turn, and by the speed it can reach over its length from
+drawing_speed.  Feeds are rounded down to steps of step mm/min, so runs of
+similar moves share one F word.  GRBL already brakes into corners by itself
+(junction deviation), so a feed is only lowered towards corner_speed into
+sharp corners when a PlotTimeEstimator shows the job getting faster for it.
+Pen-up moves are G0, which GRBL always runs at its maximum rate, so they need
+no planning.
+
+The feeds line up with StrokeProgram.to_points and are passed to an
+emitter's strokes().  estimate() compares the planned feeds with the single
+drawing feed, for the time saved per job.
+"""
+import numpy as np
+
+
+class FeedPlanner:
+    def __init__(self, drawing_speed=500, max_drawing_speed=500, corner_speed=250, max_rate=500,
+                 acceleration=10.0, step=50):
+        self.drawing_speed = min(drawing_speed, max_rate)  # The one feed used without planning
+        self.max_drawing_speed = max(min(max_drawing_speed, max_rate), self.drawing_speed)  # Long straight strokes
+        self.corner_speed = min(corner_speed, self.drawing_speed)  # Feed into a 90 degree corner, if it pays
+        self.max_rate = max_rate  # Machine maximum in mm/min (GRBL $110); G0 runs at this
+        self.acceleration = acceleration  # mm/s^2 (GRBL $120)
+        self.step = step  # Feeds are multiples of this many mm/min
+
+    def plan(self, program, estimator=None):
+        """
+        (n,) feeds in mm/min for the moves of program.to_points(); max_rate
+        for pen-up moves.  The feeds into sharp corners are only lowered if
+        estimator (a PlotTimeEstimator) times the program faster that way.
+        """
+        return self._plan(program, estimator)[0]
+
+    def _plan(self, program, estimator):
+        """plan() and the seconds estimator times the planned moves at (None without estimator)"""
+        x, y, pen = program.to_points()
+        count = len(pen)
+        feeds = np.full(count, self.max_rate, dtype=np.int64)
+        if not count:
+            return feeds, 0.0
+        deltas = np.column_stack([np.diff(np.concatenate([[program.start[0]], x])),
+                                  np.diff(np.concatenate([[program.start[1]], y]))])
+        lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+        units = deltas / np.where(lengths > 0, lengths, 1.0)[:, None]
+
+        # Cosine of the turn into the next move; the pen stops anyway before
+        # it is lifted, so the last move of a stroke counts as straight
+        turns = np.ones(count)
+        following = pen[:-1] & pen[1:]
+        turns[:-1][following] = (units[:-1] * units[1:]).sum(axis=1)[following]
+        straight = np.clip(turns, 0.0, 1.0)
+
+        # Accelerating from the drawing speed over half the move and braking
+        # over the other half reaches v^2 = v_drawing^2 + a * length
+        reachable = np.sqrt((self.drawing_speed / 60) ** 2 + self.acceleration * lengths) * 60
+        by_angle = self.drawing_speed + (self.max_drawing_speed - self.drawing_speed) * straight
+        raised = self._steps(np.minimum(by_angle, reachable), self.drawing_speed)
+        feeds[pen] = raised[pen]
+        if estimator is None:
+            return feeds, None
+        seconds = self._time(program, estimator, feeds)
+        if self.corner_speed >= self.drawing_speed:
+            return feeds, seconds
+
+        # Slower into sharp corners, kept only where the estimate gains by it
+        into_corner = self.corner_speed + (self.drawing_speed - self.corner_speed) * straight
+        lowered = feeds.copy()
+        slowed = pen & (into_corner < self.drawing_speed)
+        lowered[slowed] = self._steps(into_corner, self.corner_speed)[slowed]
+        if slowed.any():
+            slowed_seconds = self._time(program, estimator, lowered)
+            if slowed_seconds < seconds:
+                return lowered, slowed_seconds
+        return feeds, seconds
+
+    def _steps(self, feeds, floor):
+        """feeds rounded down to whole steps, but no lower than floor"""
+        return np.maximum(np.floor(feeds / self.step) * self.step, floor).astype(np.int64)
+
+    def _time(self, program, estimator, feeds):
+        x, y, pen = program.to_points()
+        rapid = float(estimator.max_rate)
+        stops = pen != np.concatenate([[False], pen[:-1]])
+        return estimator.estimate_moves(program.start, np.column_stack([x, y]),
+                                        np.where(pen, np.minimum(feeds, rapid), rapid), stops).total_time
+
+    def estimate(self, program, estimator, feeds=None):
+        """
+        (seconds with drawing_speed everywhere, seconds with the planned
+        feeds) for program's moves, timed by estimator (a PlotTimeEstimator).
+        Pen dwells are the same either way and left out.
+        """
+        if feeds is None:
+            return self.plan_and_estimate(program, estimator)[1:]
+        return self._seconds(program, estimator, feeds, self._time(program, estimator, feeds))
+
+    def plan_and_estimate(self, program, estimator):
+        """(plan(program, estimator), *estimate(program, estimator)) for the price of one"""
+        feeds, seconds = self._plan(program, estimator)
+        return (feeds,) + self._seconds(program, estimator, feeds, seconds)
+
+    def _seconds(self, program, estimator, feeds, seconds):
+        x, y, pen = program.to_points()
+        if not len(pen):
+            return 0.0, 0.0
+        if (feeds[pen] == self.drawing_speed).all():
+            return seconds, seconds  # Nothing planned differs from the single feed
+        return self._time(program, estimator, np.full(len(pen), self.drawing_speed)), seconds
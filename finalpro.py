@@ -1,37 +1,150 @@
 import sys
+import argparse
+import collections
+import copy
+import itertools
+import logging
 import time
 import numpy as np
-import speech_recognition as sr
-import queue
 import threading
 import os
+import shutil
 import subprocess
 from datetime import datetime
-import pyautogui
 import math
+from layout import WRAPS, PageGeometry, glyph_arrays, layout_text, text_blocks
+from strokes import StrokeProgram
+from emitters import EMITTERS
+from stroke_optimizer import optimize_program
+from geometry import GeometryReport, arc_length, simplify_program
+from grbl_streamer import GrblStreamer, GrblError
+from plot_estimator import PlotTimeEstimator
+from feed_planner import FeedPlanner
+from pipeline import BoundedQueue, Job, QueueClosed
+from batching import WordBatcher
+from speech_capture import RECOGNIZERS, MicrophoneSource, SpeechCapture, WavReplaySource
+from instrumentation import Instrumentation, configure_logging
+from preview import Preview
+from fleet import FleetScheduler, GrblDevice, SimulatedDevice
+from gcode_cache import FragmentCache, JobCache, place_fragments
+from font_compiler import open_font
+from spool import Spool
+
+logger = logging.getLogger(__name__)
 
 class SpeechToGCodeProcessor:
-     def __init__(self, ugs_path=None):
-        self.text_queue = queue.Queue()
+     def __init__(self, ugs_path=None, serial_port=None, baudrate=115200):
+        # Pipeline stages hand work on through bounded queues, so a slow
+        # plotter holds back compiling and compiling holds back transcription
+        self.text_queue = BoundedQueue(maxsize=4)  # Text batches waiting to be compiled
+        self.job_queue = BoundedQueue(maxsize=2)  # Compiled Jobs waiting to be sent
         self.is_running = True
-        self.ugs_path = ugs_path or self._find_ugs_path()
-        self.batch_text = ""
-        self.batch_threshold = 20
+        self.stopped = threading.Event()  # Set when the converter should shut down
+        self.capture = None  # SpeechCapture of the transcription thread, stopped on shutdown
+        # With a serial port, G-code is streamed straight to GRBL instead of through UGS
+        self.serial_port = serial_port
+        self.baudrate = baudrate
+        self.streamer = None
+        self.fleet = None  # FleetScheduler spreading jobs over several plotters instead
+        # Stream the whole session as one program: batches become segments
+        # without header or M2, and the plotter never waits between them
+        self.continuous = False
+        self.session_emitter = None  # Emitter of the continuous session, carried from batch to batch
+        self.ugs_path = ugs_path  # Looked for on disk when the first job goes to UGS
+        # Recognized words wait here until they make a batch; the batch size
+        # grows with the number of jobs between here and the plotter.  Every
+        # flush goes to the instrumentation under the id its job will get
+        self.batcher = WordBatcher(min_words=5, words_per_job=20, max_words=80,
+                                   on_flush=lambda sample: self.instrumentation.record_batch(sample,
+                                                                                          self.next_batch_id))
+        self.jobs_in_flight = 0  # Batches queued, compiling, waiting or plotting
+        self.jobs_lock = threading.Lock()
+        self.next_batch_id = 1
+        self.batch_opened = None  # When the first utterance of the current batch was captured
+        self.speech_end = None  # When the last utterance was captured
+        # Stage timings from end of speech to pen on paper; see instrumentation.py
+        self.instrumentation = Instrumentation()
+        self.latency_baseline = None  # JSON file to compare stage latencies with on shutdown
+        self.save_latency_baseline = False  # Write this run's latencies to latency_baseline instead
+        # Speech recognition: backend name from speech_capture.RECOGNIZERS and
+        # its options, WAV files to replay instead of the microphone, and how
+        # many utterances are recognized at once
+        self.recognizer_backend = "google"
+        self.recognizer_options = {}
+        self.replay_files = None
+        self.recognition_workers = 4
+        self.calibration_file = "mic_calibration.json"  # Saved energy thresholds by microphone; None is off
+        self.recalibrate = False  # Listen to the room on start even if a threshold is saved
         self.processing_lock = threading.Lock()  # Lock for thread safety
         # Default starting positions and spacing
         self.start_x = 10
-        self.start_y = 10
+        self.start_y = 277  # Baseline of a page's first line, a margin and a line of text below the top
         self.char_width = 5
         self.char_height = 10
         self.line_spacing = 15
+        self.font = None  # Compiled font file (see font_compiler.py); None draws glyphs.GLYPHS
         self.current_x = self.start_x
         self.current_y = self.start_y
+        self.current_page = 0  # Pages filled before the one the cursor is on
         self.max_line_width = 190# For A4 paper (210mm minus margins)
+        self.bottom_margin = 10  # Lowest baseline on a page; None lets text run on down the paper
+        self.wrap = "greedy"  # Line breaking rule, one of layout.WRAPS
+        # At a page break, stop the plotter (M0) until the paper is changed.
+        # When a plotter streamed to stops there, on_page_break(page) is
+        # called and the plot resumes once it returns; None asks on the console
+        self.page_break_pause = True
+        self.on_page_break = None
+        self.last_page_breaks = []  # Pages whose sheet each stop in the last batch's G-code starts
+        self._paper_lock = threading.Lock()  # One paper change asked for at a time
+        self.page_width = 210  # Paper size in mm, for previews
+        self.page_height = 297
         self.travel_speed = 500    # Fast movement when not drawing
         self.drawing_speed = 500    # Slower movement when drawing
         self.pen_lift_speed = 100   # Slower movement when lifting or lowering pen
         self.pen_z_up = 5.0         # Z position when pen is up
         self.pen_z_down = 0.0
+        # Machine model used for plot time estimates (GRBL $110, $120 and $11)
+        self.max_rate = 500         # Maximum speed in mm/min
+        self.acceleration = 10.0    # mm/s^2
+        self.junction_deviation = 0.01  # mm
+        self.servo_dwell = 0.5      # Seconds for each pen up/down
+        # Plan a feed per move (see feed_planner) instead of drawing_speed everywhere
+        self.adaptive_feeds = False
+        self.max_drawing_speed = 500  # Feed for long straight strokes
+        self.corner_speed = 250     # Feed into a right-angle corner
+        self.last_feed_report = None  # (seconds before, after) of the last batch with adaptive feeds
+        self.gcode_comments = True  # Annotate each G-code line with a comment
+        self.emitter = "grbl"  # Output format, a key of emitters.EMITTERS
+        # Extra emitter arguments by emitter name, e.g. {"compact": {"precision": 2, "relative": True}}
+        self.emitter_options = {}
+        # Reorder strokes to minimize pen-up travel; off by default because it
+        # makes compiling many times slower
+        self.optimize_travel = False
+        self.optimize_time_budget = 0.05  # Seconds of 2-opt per line of text
+        # Optimize each line as if the pen started at its first character, so
+        # lines do not depend on each other (document_mode compiles them in parallel)
+        self.anchor_lines = False
+        self.last_travel_report = None  # (pen-up mm before, after) of the last optimized batch
+        # Optional geometry pass: merge collinear points, Douglas-Peucker at
+        # simplify_tolerance and arcs (G2/G3) within arc_tolerance, in mm
+        self.simplify_geometry = False
+        self.simplify_tolerance = 0.05
+        self.arc_tolerance = 0.5
+        self.last_geometry_report = None  # GeometryReport of the last simplified batch
+        # Render every job before sending it and reject jobs that leave the
+        # paper; previews are saved as PNG in preview_dir if set
+        self.preview_jobs = False
+        self.preview_dir = None
+        # Reuse finished job files (a gcode_cache.JobCache) and words already
+        # laid out and optimized (a gcode_cache.FragmentCache); None is off
+        self.job_cache = None
+        self.fragment_cache = None
+        # Journal batches and plot progress (a spool.Spool) so the next run
+        # picks up what a crash left unfinished; None is off
+        self.spool = None
+        self.checkpoint_lines = 50  # Acknowledged lines between spool checkpoints
+        self.recovered_jobs = []  # From the spool: compiled jobs the last run did not finish plotting
+        self.recovered_batches = []  # From the spool: batches the last run did not compile
         self.is_connected = False  # Track connection state
         self.position_initialized = False  # Flag to track if position has been initialized
 
@@ -47,39 +160,107 @@ class SpeechToGCodeProcessor:
                 return path
         return None
 
+     def audio_source(self):
+        """Where utterances come from: the replay files if set, else the microphone"""
+        if self.replay_files:
+            return WavReplaySource(self.replay_files)
+        return MicrophoneSource(calibration_file=self.calibration_file, recalibrate=self.recalibrate)
+
      def real_time_transcription(self):
-        recognizer = sr.Recognizer()
+        """
+        Transcribe stage: capture speech continuously and recognize utterances
+        in parallel, collecting the text in order into batches for the
+        compile stage.  When a replayed source runs out the converter shuts
+        down once the last batch is plotted.
+        """
+        import speech_recognition as sr
+
         try:
-            with sr.Microphone() as source:
-                recognizer.adjust_for_ambient_noise(source, duration=2)
-                print("Listening...")
-                while self.is_running:
-                    try:
-                        audio = recognizer.listen(source, timeout=5)
-                        text = recognizer.recognize_google(audio).strip()
-                        if text:
-                            self.batch_text += " " + text
-                            print(f"Recognized: {text}")
-                            if len(self.batch_text.split()) >= self.batch_threshold:
-                                self.text_queue.put(self.batch_text.strip())
-                                self.batch_text = ""
-                    except sr.WaitTimeoutError:
-                        if self.batch_text:
-                            self.text_queue.put(self.batch_text.strip())
-                            self.batch_text = ""
-                    except sr.UnknownValueError:
-                        print("Could not understand audio")
-                    except sr.RequestError as e:
-                        print(f"Speech recognition error: {e}")
+            recognizer = RECOGNIZERS[self.recognizer_backend](**self.recognizer_options)
+            with SpeechCapture(self.audio_source(), recognizer, workers=self.recognition_workers) as capture:
+                self.capture = capture
+                for utterance in capture:
+                    if not self.is_running:
+                        break
+                    if utterance.silence:
+                        # A pause ends the batch, unless the plotter is busy
+                        # anyway and the words can wait for more
+                        if not self.jobs_in_flight:
+                            self.queue_batch(self.batcher.flush())
+                        continue
+                    self.instrumentation.record("recognize", utterance.latency, self.next_batch_id)
+                    if isinstance(utterance.error, sr.UnknownValueError):
+                        logger.info("Could not understand audio")
+                    elif isinstance(utterance.error, sr.RequestError):
+                        logger.warning(f"Speech recognition error: {utterance.error}")
+                    elif utterance.error:
+                        raise utterance.error
+                    elif utterance.text:
+                        logger.info(f"Recognized: {utterance.text}")
+                        if self.batch_opened is None:
+                            self.batch_opened = utterance.captured
+                        self.speech_end = utterance.captured
+                        self.queue_batch(self.batcher.add(utterance.text, self.jobs_in_flight))
         except Exception as e:
-            print(f"Error in transcription: {e}")
+            logger.exception(f"Error in transcription: {e}")
             self.is_running = False
+        self.stopped.set()
+
+     def queue_batch(self, text):
+        """
+        Hand a batch from the batcher to the compile stage (None is ignored).
+        Blocks while the pipeline is backed up; returns False once it has
+        shut down.
+        """
+        if not text:
+            return True
+        with self.jobs_lock:
+            job = Job(self.next_batch_id, text, self.speech_end)
+            self.next_batch_id += 1
+            self.jobs_in_flight += 1
+        if self.batch_opened is not None:
+            # Time spent collecting words for this batch
+            self.instrumentation.record("batch", job.queued - self.batch_opened, job.batch_id,
+                                        words=len(text.split()))
+        self.batch_opened = None
+        if self.spool is not None:
+            self.spool.record_batch(job)
+        try:
+            return self.text_queue.put(job)
+        except QueueClosed:
+            self.job_done()
+            return False
 
+     def job_done(self):
+        with self.jobs_lock:
+            self.jobs_in_flight -= 1
+
+     def time_estimator(self):
+        """PlotTimeEstimator for this processor's machine settings"""
+        return PlotTimeEstimator(acceleration=self.acceleration, max_rate=self.max_rate,
+                                 junction_deviation=self.junction_deviation,
+                                 servo_dwell=self.servo_dwell)
+
+     def estimate_plotting_time(self, gcode):
+        """
+        Estimate the time the plotter needs for the GCode, modelling GRBL's
+        acceleration and cornering with this processor's machine settings.
+        gcode may also be a StrokeProgram, which is timed without producing
+        any G-code.  Returns a PlotEstimate with the total and per-move times.
+        """
+        if isinstance(gcode, StrokeProgram):
+            return self.time_estimator().estimate_strokes(gcode, self.drawing_speed)
+        return self.time_estimator().estimate(gcode)
 
      def calculate_plotting_time(self, gcode):
         """
         Calculate approximate time needed for the plotter to complete the GCode
+        (constant speed plus a 20% buffer; see estimate_plotting_time).
+        gcode may also be a StrokeProgram.
         """
+        if isinstance(gcode, StrokeProgram):
+            return self._calculate_stroke_time(gcode)
+
         total_time = 0
         current_x, current_y = 0, 0
         is_pen_down = False
@@ -98,9 +279,10 @@ class SpeechToGCodeProcessor:
                 is_pen_down = True
                 
             # Movement operations
-            if "G0" in line or "G1" in line:
+            if "G0" in line or "G1" in line or "G2" in line or "G3" in line:
                 parts = line.split()
                 new_x, new_y = current_x, current_y
+                offset_i = offset_j = 0.0
                 speed = self.travel_speed  # Default to travel speed
                 
                 for part in parts:
@@ -108,11 +290,19 @@ class SpeechToGCodeProcessor:
                         new_x = float(part[1:])
                     elif part.startswith('Y'):
                         new_y = float(part[1:])
+                    elif part.startswith('I'):
+                        offset_i = float(part[1:])
+                    elif part.startswith('J'):
+                        offset_j = float(part[1:])
                     elif part.startswith('F'):
                         speed = float(part[1:])
                 
                 # Calculate distance
-                distance = math.sqrt((new_x - current_x)**2 + (new_y - current_y)**2)
+                if parts[0] in ("G2", "G3"):
+                    distance = arc_length((current_x, current_y), (new_x, new_y),
+                                          (current_x + offset_i, current_y + offset_j), parts[0] == "G2")
+                else:
+                    distance = math.sqrt((new_x - current_x)**2 + (new_y - current_y)**2)
                 
                 # Calculate time for this movement (distance / speed in mm per minute)
                 if distance > 0:
@@ -127,405 +317,384 @@ class SpeechToGCodeProcessor:
         total_time *= 1.2
         return total_time
 
-     def text_to_gcode(self, text, char_width=None, char_height=None, line_spacing=None):
+     def _calculate_stroke_time(self, program):
+        """calculate_plotting_time for the G-code a StrokeProgram emits"""
+        x, y, pen = program.flattened().to_points()
+        # Pen up at the start, a command at every pen change and a final
+        # pen up if the program ends drawing
+        changes = pen != np.concatenate([[False], pen[:-1]])
+        pen_moves = 1 + int(changes.sum()) + int(bool(len(pen)) and pen[-1])
+        # Rapid from the origin to the start, then every move
+        points = np.column_stack([np.concatenate([[0.0, program.start[0]], x]),
+                                  np.concatenate([[0.0, program.start[1]], y])])
+        distances = np.sqrt((np.diff(points, axis=0) ** 2).sum(axis=1))
+        speeds = np.where(np.concatenate([[False], pen]), self.drawing_speed, self.travel_speed) / 60
+        total_time = pen_moves * 0.5 + float((distances / speeds).sum())
+        return total_time * 1.2
+
+     def page_geometry(self, line_spacing=None):
+        """Where the layout writes: from start_x to max_line_width, baselines from start_y down to bottom_margin"""
+        return PageGeometry(self.start_x, self.max_line_width, self.start_y, self.bottom_margin,
+                            line_spacing or self.line_spacing)
+
+     def _layout_blocks(self, text, char_width, char_height, line_spacing, block_size=8192):
         """
-        Convert text to G-code for CNC machines using M03/M05 for pen control
+        Lay out text with the vectorized layout engine, yielding a TextLayout
+        per block of text.  text may be a string or an iterable of strings
+        (e.g. an open file); long input is laid out in blocks so memory use
+        stays bounded.  The text is a new word after whatever is already on
+        the line, as the next batch of dictation is.
+        """
+        glyphs = glyph_arrays(char_width, char_height, self.font)
+        page = self.page_geometry(line_spacing)
+        for number, block in enumerate(text_blocks(text, block_size)):
+            layout = layout_text(block, glyphs, self.current_x, self.current_y, page, char_width * 1.2,
+                                 self.wrap, self.current_page, new_word=number == 0)
+            self.current_x, self.current_y, self.current_page = layout.cursor_x, layout.cursor_y, layout.cursor_page
+            yield layout
+
+     def _layout_rows(self, text, char_width, char_height, line_spacing):
+        """Yield (x, y, pen, page) for one line on the paper at a time: its vertex arrays and its page"""
+        pending = None  # Last line of the previous block, which may continue
+        for layout in self._layout_blocks(text, char_width, char_height, line_spacing):
+            rows = [(x, y, pen, page) for (x, y, pen), page in zip(layout.rows(), layout.row_pages.tolist())]
+            if not rows:
+                continue  # Only whitespace, which draws nothing
+            if pending is not None:
+                rows[0] = tuple(np.concatenate(parts) for parts in zip(pending[:3], rows[0][:3])) + rows[0][3:]
+            yield from rows[:-1]
+            pending = rows[-1]
+        if pending is not None:
+            yield pending
+
+     def iter_strokes(self, text, char_width=None, char_height=None, line_spacing=None, optimize=None,
+                      simplify=None, pages=False):
+        """
+        Lay out text as StrokePrograms, one per line on the paper when the
+        strokes are optimized and one per block of text and page otherwise.
+        The layout cursor (current_x/current_y/current_page) advances as the
+        generator is consumed.  With pages=True (page, program) pairs are
+        yielded instead, so page breaks can be acted on.
+
+        With optimize (default self.optimize_travel) the strokes of each line
+        are reordered to cut pen-up travel, and the pen-up distance before and
+        after is stored in self.last_travel_report.  With simplify (default
+        self.simplify_geometry) the geometry pass runs on the result and its
+        report goes to self.last_geometry_report.
         """
-        # Use provided values or default class values
         char_width = char_width or self.char_width
         char_height = char_height or self.char_height
         line_spacing = line_spacing or self.line_spacing
-        
-        gcode = []
-        
-        # Define machine parameters
-        travel_speed = 500   # Fast movement when not drawing
-        drawing_speed = 500   # Slower movement when drawing
-        
-        # Initial setup
-        gcode.append("; G-code generated from text")
-        gcode.append("G21 ; Set units to millimeters")
-        gcode.append("G90 ; Set absolute positioning")
-        
+        optimize = self.optimize_travel if optimize is None else optimize
+        simplify = self.simplify_geometry if simplify is None else simplify
+
+        position = (self.current_x, self.current_y)
+        if optimize and self.fragment_cache is not None:
+            programs = self._fragment_rows(text, char_width, char_height, line_spacing, position)
+        elif optimize:
+            programs = self._optimized_rows(text, char_width, char_height, line_spacing, position)
+        else:
+            programs = ((page, StrokeProgram.from_points(x, y, pen))
+                        for layout in self._layout_blocks(text, char_width, char_height, line_spacing)
+                        for page, x, y, pen in layout.pages())
+
+        report = GeometryReport()
+        estimator = self.time_estimator()
+        for page, program in programs:
+            program.start = position
+            if simplify:
+                simplified, row_report = simplify_program(program, self.simplify_tolerance, self.arc_tolerance)
+                row_report.time_before = estimator.estimate_strokes(program, self.drawing_speed, position).total_time
+                row_report.time_after = estimator.estimate_strokes(simplified, self.drawing_speed,
+                                                                   position).total_time
+                report += row_report
+                program = simplified
+            position = program.end
+            yield (page, program) if pages else program
+        if simplify:
+            self.last_geometry_report = report
+
+     def _optimized_rows(self, text, char_width, char_height, line_spacing, position):
+        """(page, StrokeProgram) per line on the paper with the strokes reordered"""
+        travel_before = travel_after = 0
+        for x, y, pen, page in self._layout_rows(text, char_width, char_height, line_spacing):
+            anchor = (x[0], y[0]) if self.anchor_lines and len(x) else position
+            program = StrokeProgram.from_points(x, y, pen, anchor)
+            optimized = optimize_program(program, time_budget=self.optimize_time_budget)
+            program.start = optimized.start = position
+            travel_before += program.travel_length()
+            travel_after += optimized.travel_length()
+            position = optimized.end
+            yield page, optimized
+        self.last_travel_report = (travel_before, travel_after)
+
+     def _fragment_rows(self, text, char_width, char_height, line_spacing, position):
+        """
+        (page, StrokeProgram) per line on the paper put together from compiled words:
+        each word's strokes are optimized once, relative to the word's origin,
+        kept in fragment_cache and moved into place.  A line is written right
+        to left when the pen is nearer its right end, with the words
+        optimized for entering from the right.
+        """
+        travel_before = travel_after = 0
+        advance = char_width * 1.2
+        for layout in self._layout_blocks(text, char_width, char_height, line_spacing):
+            words = collections.defaultdict(list)
+            for row, word, x, y, first, end in layout.words():
+                words[row].append((word, x, y, first, end))
+            for row, (x, y, pen) in enumerate(layout.rows()):
+                if row not in words:
+                    continue
+                entries = words[row]
+                left = (entries[0][1], entries[0][2])
+                right = (entries[-1][1] + len(entries[-1][0]) * advance, entries[-1][2])
+                reverse = math.dist(position, right) < math.dist(position, left)
+                if reverse:
+                    entries = entries[::-1]
+                fragments = [self.fragment_cache.fragment(
+                    (word, char_width, char_height, advance, reverse, self.font),
+                    lambda: self._compile_word(layout, word_x, word_y, first, end,
+                                               len(word) * advance if reverse else 0.0))
+                    for word, word_x, word_y, first, end in entries]
+                program = place_fragments(fragments, [(word_x, word_y) for _, word_x, word_y, _, _ in entries],
+                                          position)
+                travel_before += StrokeProgram.from_points(x, y, pen, position).travel_length()
+                travel_after += program.travel_length()
+                position = program.end
+                yield int(layout.row_pages[row]), program
+        self.last_travel_report = (travel_before, travel_after)
+
+     def _compile_word(self, layout, x, y, first, end, entry_x=0.0):
+        """
+        Strokes of the laid-out vertices first:end relative to (x, y),
+        optimized for a pen coming from (entry_x, 0)
+        """
+        program = StrokeProgram.from_points(layout.x[first:end] - x, layout.y[first:end] - y,
+                                            layout.pen[first:end], (entry_x, 0.0))
+        return optimize_program(program, time_budget=self.optimize_time_budget)
+
+     def text_to_strokes(self, text, char_width=None, char_height=None, line_spacing=None, optimize=None,
+                         simplify=None):
+        """Lay out text as a single StrokeProgram; see iter_strokes"""
+        start = (self.current_x, self.current_y)
+        return StrokeProgram.concatenate(
+            self.iter_strokes(text, char_width, char_height, line_spacing, optimize, simplify), start)
+
+     def layout_shape(self, text):
+        """
+        Where text lands relative to the layout cursor, for JobCache keys: the
+        characters on each line, where the first one starts and whether the
+        cursor is at the start of a line.  None if the G-code for text at
+        another cursor would not be the same program moved, because the text
+        runs onto a new page or wraps from the middle of a line.
+        """
+        page = self.page_geometry()
+        glyphs = glyph_arrays(self.char_width, self.char_height, self.font)
+        layout = layout_text(text, glyphs, self.current_x, self.current_y, page, self.char_width * 1.2, self.wrap,
+                             self.current_page, new_word=True)
+        fresh = self.current_x <= page.left
+        if layout.codes is None:
+            return {"rows": [], "fresh": fresh}  # Nothing to draw
+        rows = np.bincount(layout.char_rows).tolist()
+        if layout.cursor_page != self.current_page or (len(rows) > 1 and not fresh):
+            return None
+        origin = [round(float(layout.char_x[0]) - self.current_x, 6),
+                  round(float(layout.char_y[0]) - self.current_y, 6)]
+        return {"rows": rows, "fresh": fresh, "origin": origin}
+
+     def compile_settings(self, text, shape=None):
+        """
+        Everything the G-code and estimate for text depend on, for JobCache
+        keys; shape (see layout_shape) stands in for the cursor, so the same
+        text at another place on the paper has the same key
+        """
+        emitter = self.make_emitter()
+        return {
+            "text": text,
+            "shape": shape,
+            "first_batch": not self.position_initialized,
+            "layout": [self.char_width, self.char_height, self.line_spacing, self.start_x, self.max_line_width,
+                       self.start_y, self.bottom_margin, self.wrap],
+            "pages": [self.page_break_pause],
+            "font": open_font(self.font).digest if self.font else None,
+            "emitter": [self.emitter, self.gcode_comments, self.emitter_options] + [getattr(emitter, name, None) for name in
+                                                              ("travel_speed", "drawing_speed", "pen_up_cmd",
+                                                               "pen_down_cmd")],
+            "machine": [self.max_rate, self.acceleration, self.junction_deviation, self.servo_dwell],
+            "feeds": [self.adaptive_feeds, self.max_drawing_speed, self.corner_speed],
+            "optimize": [self.optimize_travel, self.fragment_cache is not None],
+            "simplify": [self.simplify_geometry, self.simplify_tolerance, self.arc_tolerance],
+            "preview": [self.preview_jobs, self.page_width, self.page_height],
+        }
+
+     def make_emitter(self, emitter=None, comments=None):
+        """Create an emitter by name (default self.emitter) with this processor's settings"""
         # Standard format M03/M05 commands
         pen_up_cmd = "M03 S90"  # Standard spindle on (pen up in this case)
         pen_down_cmd = "M05"    # Standard spindle off (pen down in this case)
-        
-        # Initial pen up and move to start - only if this is the first batch
-        if not hasattr(self, 'position_initialized') or not self.position_initialized:
-            gcode.append(f"{pen_up_cmd} ; Pen up")
-            gcode.append(f"G0 X{self.current_x} Y{self.current_y} F{travel_speed} ; Move to starting position")
+
+        comments = self.gcode_comments if comments is None else comments
+        name = emitter or self.emitter
+        return EMITTERS[name](travel_speed=self.travel_speed, drawing_speed=self.drawing_speed,
+                              pen_up_cmd=pen_up_cmd, pen_down_cmd=pen_down_cmd, comments=comments,
+                              **self.emitter_options.get(name, {}))
+
+     def feed_planner(self):
+        """FeedPlanner for this processor's speeds and machine settings"""
+        return FeedPlanner(drawing_speed=self.drawing_speed, max_drawing_speed=self.max_drawing_speed,
+                           corner_speed=self.corner_speed, max_rate=self.max_rate, acceleration=self.acceleration)
+
+     def iter_gcode(self, text, char_width=None, char_height=None, line_spacing=None, comments=None,
+                    optimize=None, emitter=None, simplify=None, preview=None, segment=False):
+        """
+        Generate G-code for text line by line, using M03/M05 for pen control.
+        Lines are produced as the layout proceeds, so memory use does not grow
+        with the length of the text.  The layout cursor (current_x/current_y)
+        advances as the generator is consumed.
+
+        The pen state is tracked so M03/M05 are only sent when it changes;
+        pass comments=False to leave the per-line comments out.  emitter
+        selects the output format by name (default self.emitter) or is an
+        emitter object; see emitters.EMITTERS.  Travel optimization is as
+        for iter_strokes, and so is the geometry pass (simplify), which
+        lets round letters be drawn with G2/G3 arcs.  The strokes are also
+        added to preview (a preview.Preview) if one is given.
+
+        With segment=True only the strokes are generated, ending with the
+        pen up but without header or M2, for an emitter that carries on
+        from the previous batch in a continuous session.
+
+        With adaptive_feeds every pen-down move gets its own feed, and the
+        estimated seconds with one feed and with the planned ones go to
+        self.last_feed_report.
+
+        Where the layout moves on to a new page, the lines from page_break()
+        come between the pages, and with page_break_pause the new page is
+        added to self.last_page_breaks.
+        """
+        for block in self.iter_gcode_blocks(text, char_width, char_height, line_spacing, comments, optimize,
+                                            emitter, simplify, preview, segment):
+            yield from block.split("\n")[:-1]
+
+     def iter_gcode_blocks(self, text, char_width=None, char_height=None, line_spacing=None, comments=None,
+                           optimize=None, emitter=None, simplify=None, preview=None, segment=False):
+        """
+        iter_gcode's lines in strings as the emitter formats them (a block of
+        text or a line of it, a page break, the header or the end), every
+        line ending in a newline.  Writing or joining these is much faster
+        than going line by line.
+        """
+        def joined(lines):
+            return "".join(line + "\n" for line in lines)
+
+        if emitter is None or isinstance(emitter, str):
+            emitter = self.make_emitter(emitter, comments)
+
+        if not segment:
+            # Initial pen up and move to start; later batches continue from
+            # where the previous one stopped
+            yield joined(emitter.begin((self.current_x, self.current_y), first_batch=not self.position_initialized))
             self.position_initialized = True
-        else:
-            # For subsequent batches, we're already at the correct position
-            gcode.append(f"{pen_up_cmd} ; Pen up")
-            gcode.append(f"G0 X{self.current_x} Y{self.current_y} F{travel_speed} ; Continue from previous position")
-        
-        # Comprehensive font dictionary for all uppercase letters, numbers, and common punctuation
-        font = {
-            'A': [(0, 0, False), (0, char_height, True), (char_width, char_height, True), 
-                 (char_width, 0, True), (char_width, char_height/2, False), (0, char_height/2, True)],
-            
-            'B': [(0, 0, False), (0, char_height, True), (char_width*0.8, char_height, True), 
-                 (char_width, char_height*0.8, True), (char_width, char_height*0.6, True),
-                 (char_width*0.8, char_height*0.5, True), (0, char_height*0.5, True), (char_width*0.8, char_height*0.5, False),
-                 (char_width, char_height*0.4, True), (char_width, char_height*0.2, True),
-                 (char_width*0.8, 0, True), (0, 0, True)],
-            
-            'C': [(char_width, char_height*0.8, False), (char_width*0.8, char_height, True),
-                 (char_width*0.2, char_height, True), (0, char_height*0.8, True),
-                 (0, char_height*0.2, True), (char_width*0.2, 0, True),
-                 (char_width*0.8, 0, True), (char_width, char_height*0.2, True)],
-            
-            'D': [(0, 0, False), (0, char_height, True), (char_width*0.8, char_height, True), 
-                 (char_width, char_height*0.8, True), (char_width, char_height*0.2, True),
-                 (char_width*0.8, 0, True), (0, 0, True)],
-            
-            'E': [(char_width, 0, False), (0, 0, True), (0, char_height, True), 
-                 (char_width, char_height, True), (0, char_height, False),
-                 (0, char_height/2, True), (char_width*0.8, char_height/2, True)],
-            
-            'F': [(0, 0, False), (0, char_height, True), (char_width, char_height, True),
-                 (0, char_height, False), (0, char_height/2, True), (char_width*0.8, char_height/2, True)],
-            
-            'G': [(char_width, char_height*0.8, False), (char_width*0.8, char_height, True),
-                 (char_width*0.2, char_height, True), (0, char_height*0.8, True),
-                 (0, char_height*0.2, True), (char_width*0.2, 0, True),
-                 (char_width*0.8, 0, True), (char_width, char_height*0.2, True),
-                 (char_width, char_height*0.5, True), (char_width*0.5, char_height*0.5, True)],
-            
-            'H': [(0, 0, False), (0, char_height, True), (0, char_height/2, False),
-                 (char_width, char_height/2, True), (char_width, char_height, False),
-                 (char_width, 0, True)],
-            
-            'I': [(char_width*0.2, 0, False), (char_width*0.8, 0, True),
-                 (char_width/2, 0, False), (char_width/2, char_height, True),
-                 (char_width*0.2, char_height, False), (char_width*0.8, char_height, True)],
-            
-            'J': [(char_width*0.8, char_height, False), (char_width*0.8, char_height*0.2, True),
-                 (char_width*0.6, 0, True), (char_width*0.2, 0, True),
-                 (0, char_height*0.2, True)],
-            
-            'K': [(0, 0, False), (0, char_height, True), (0, char_height/2, False),
-                 (char_width, char_height, True), (0, char_height/2, False),
-                 (char_width, 0, True)],
-            
-            'L': [(0, char_height, False), (0, 0, True), (char_width, 0, True)],
-            
-            'M': [(0, 0, False), (0, char_height, True), (char_width/2, char_height*0.6, True),
-                 (char_width, char_height, True), (char_width, 0, True)],
-            
-            'N': [(0, 0, False), (0, char_height, True), (char_width, 0, True),
-                 (char_width, char_height, True)],
-            
-            'O': [(0, char_height*0.2, False), (0, char_height*0.8, True),
-                 (char_width*0.2, char_height, True), (char_width*0.8, char_height, True),
-                 (char_width, char_height*0.8, True), (char_width, char_height*0.2, True),
-                 (char_width*0.8, 0, True), (char_width*0.2, 0, True),
-                 (0, char_height*0.2, True)],
-            
-            'P': [(0, 0, False), (0, char_height, True), (char_width*0.8, char_height, True),
-                 (char_width, char_height*0.8, True), (char_width, char_height*0.6, True),
-                 (char_width*0.8, char_height*0.5, True), (0, char_height*0.5, True)],
-            
-            'Q': [(0, char_height*0.2, False), (0, char_height*0.8, True),
-                 (char_width*0.2, char_height, True), (char_width*0.8, char_height, True),
-                 (char_width, char_height*0.8, True), (char_width, char_height*0.2, True),
-                 (char_width*0.8, 0, True), (char_width*0.2, 0, True),
-                 (0, char_height*0.2, True), (char_width*0.5, char_height*0.3, False),
-                 (char_width, 0, True)],
-            
-            'R': [(0, 0, False), (0, char_height, True), (char_width*0.8, char_height, True),
-                 (char_width, char_height*0.8, True), (char_width, char_height*0.6, True),
-                 (char_width*0.8, char_height*0.5, True), (0, char_height*0.5, True),
-                 (char_width*0.4, char_height*0.5, False), (char_width, 0, True)],
-            
-            'S': [(char_width, char_height*0.8, False), (char_width*0.8, char_height, True),
-                 (char_width*0.2, char_height, True), (0, char_height*0.8, True),
-                 (0, char_height*0.6, True), (char_width*0.2, char_height*0.5, True),
-                 (char_width*0.8, char_height*0.5, True), (char_width, char_height*0.4, True),
-                 (char_width, char_height*0.2, True), (char_width*0.8, 0, True),
-                 (char_width*0.2, 0, True), (0, char_height*0.2, True)],
-            
-            'T': [(0, char_height, False), (char_width, char_height, True),
-                 (char_width/2, char_height, False), (char_width/2, 0, True)],
-            
-            'U': [(0, char_height, False), (0, char_height*0.2, True),
-                 (char_width*0.2, 0, True), (char_width*0.8, 0, True),
-                 (char_width, char_height*0.2, True), (char_width, char_height, True)],
-            
-            'V': [(0, char_height, False), (char_width/2, 0, True), (char_width, char_height, True)],
-            
-            'W': [(0, char_height, False), (char_width*0.2, 0, True),
-                 (char_width*0.5, char_height*0.4, True), (char_width*0.8, 0, True),
-                 (char_width, char_height, True)],
-            
-            'X': [(0, char_height, False), (char_width, 0, True),
-                 (char_width/2, char_height/2, False), (0, 0, True),
-                 (char_width, char_height, True)],
-            
-            'Y': [(0, char_height, False), (char_width/2, char_height/2, True),
-                 (char_width, char_height, True), (char_width/2, char_height/2, False),
-                 (char_width/2, 0, True)],
-            
-            'Z': [(0, char_height, False), (char_width, char_height, True),
-                 (0, 0, True), (char_width, 0, True)],
-
-            # Add these lowercase letters to your font dictionary
-            'a': [(char_width, char_height*0.3, False), (char_width, 0, True),
-                  (char_width*0.2, 0, True), (0, char_height*0.2, True),
-                  (0, char_height*0.5, True), (char_width*0.2, char_height*0.7, True),
-                  (char_width, char_height*0.7, True)],
-            
-            'b': [(0, 0, False), (0, char_height, True), 
-                  (0, char_height*0.4, False), (char_width*0.8, char_height*0.4, True),
-                  (char_width, char_height*0.3, True), (char_width, char_height*0.1, True),
-                  (char_width*0.8, 0, True), (0, 0, True)],
-            
-            'c': [(char_width, char_height*0.6, False), (char_width*0.8, char_height*0.7, True),
-                  (char_width*0.2, char_height*0.7, True), (0, char_height*0.5, True),
-                  (0, char_height*0.2, True), (char_width*0.2, 0, True),
-                  (char_width*0.8, 0, True), (char_width, char_height*0.1, True)],
-            
-            'd': [(char_width, 0, False), (char_width, char_height, True),
-                  (char_width, char_height*0.4, False), (char_width*0.2, char_height*0.4, True),
-                  (0, char_height*0.3, True), (0, char_height*0.1, True),
-                  (char_width*0.2, 0, True), (char_width, 0, True)],
-            
-            'e': [(0, char_height*0.3, False), (char_width, char_height*0.3, True),
-                  (char_width, char_height*0.5, True), (char_width*0.2, char_height*0.7, True),
-                  (0, char_height*0.5, True), (0, char_height*0.2, True),
-                  (char_width*0.2, 0, True), (char_width*0.8, 0, True)],
-            
-            'f': [(char_width, char_height, False), (char_width*0.5, char_height, True),
-                  (char_width*0.3, char_height*0.9, True), (char_width*0.3, 0, True),
-                  (char_width*0.3, char_height*0.5, False), (0, char_height*0.5, True)],
-            
-            'g': [(char_width, char_height*0.7, False), (char_width, -char_height*0.2, True),
-                  (char_width*0.7, -char_height*0.3, True), (char_width*0.2, -char_height*0.3, True),
-                  (0, -char_height*0.2, True), (char_width, -char_height*0.2, False),
-                  (char_width, char_height*0.7, True), (char_width*0.2, char_height*0.7, True),
-                  (0, char_height*0.5, True), (0, char_height*0.2, True),
-                  (char_width*0.2, 0, True), (char_width, 0, True)],
-            
-            'h': [(0, 0, False), (0, char_height, True),
-                  (0, char_height*0.5, False), (char_width*0.7, char_height*0.5, True),
-                  (char_width, char_height*0.3, True), (char_width, 0, True)],
-            
-            'i': [(char_width*0.5, char_height*0.7, False), (char_width*0.5, 0, True),
-                  (char_width*0.5, char_height*0.9, False), (char_width*0.5, char_height, True)],
-            
-            'j': [(char_width*0.7, char_height*0.7, False), (char_width*0.7, -char_height*0.2, True),
-                  (char_width*0.5, -char_height*0.3, True), (char_width*0.2, -char_height*0.3, True),
-                  (0, -char_height*0.2, True), (char_width*0.7, char_height*0.9, False),
-                  (char_width*0.7, char_height, True)],
-            
-            'k': [(0, 0, False), (0, char_height, True),
-                  (0, char_height*0.3, False), (char_width, char_height*0.7, True),
-                  (0, char_height*0.3, False), (char_width, 0, True)],
-            
-            'l': [(char_width*0.3, char_height, False), (char_width*0.3, 0, True),
-                  (char_width*0.7, 0, True)],
-            
-            'm': [(0, 0, False), (0, char_height*0.7, True),
-                  (char_width*0.3, char_height*0.7, True), (char_width*0.5, char_height*0.5, True),
-                  (char_width*0.5, 0, True), (char_width*0.5, char_height*0.5, False),
-                  (char_width*0.7, char_height*0.7, True), (char_width, char_height*0.5, True),
-                  (char_width, 0, True)],
-            
-            'n': [(0, 0, False), (0, char_height*0.7, True),
-                  (char_width*0.7, char_height*0.7, True), (char_width, char_height*0.5, True),
-                  (char_width, 0, True)],
-            
-            'o': [(0, char_height*0.2, False), (0, char_height*0.5, True),
-                  (char_width*0.2, char_height*0.7, True), (char_width*0.8, char_height*0.7, True),
-                  (char_width, char_height*0.5, True), (char_width, char_height*0.2, True),
-                  (char_width*0.8, 0, True), (char_width*0.2, 0, True),
-                  (0, char_height*0.2, True)],
-            
-            'p': [(0, -char_height*0.3, False), (0, char_height*0.7, True),
-                  (char_width*0.8, char_height*0.7, True), (char_width, char_height*0.5, True),
-                  (char_width, char_height*0.2, True), (char_width*0.8, 0, True),
-                  (0, 0, True)],
-            
-            'q': [(char_width, -char_height*0.3, False), (char_width, char_height*0.7, True),
-                  (char_width*0.2, char_height*0.7, True), (0, char_height*0.5, True),
-                  (0, char_height*0.2, True), (char_width*0.2, 0, True),
-                  (char_width, 0, True)],
-            
-            'r': [(0, 0, False), (0, char_height*0.7, True),
-                  (char_width*0.2, char_height*0.7, True), (char_width*0.8, char_height*0.5, True),
-                  (char_width, char_height*0.7, True)],
-            
-            's': [(char_width, char_height*0.6, False), (char_width*0.8, char_height*0.7, True),
-                  (char_width*0.2, char_height*0.7, True), (0, char_height*0.6, True),
-                  (char_width*0.2, char_height*0.4, True), (char_width*0.8, char_height*0.3, True),
-                  (char_width, char_height*0.1, True), (char_width*0.8, 0, True),
-                  (char_width*0.2, 0, True), (0, char_height*0.1, True)],
-            
-            't': [(char_width*0.3, char_height, False), (char_width*0.3, char_height*0.1, True),
-                  (char_width*0.5, 0, True), (char_width*0.8, 0, True),
-                  (char_width*0.3, char_height*0.7, False), (0, char_height*0.7, True),
-                  (char_width*0.7, char_height*0.7, True)],
-            
-            'u': [(0, char_height*0.7, False), (0, char_height*0.1, True),
-                  (char_width*0.2, 0, True), (char_width*0.8, 0, True),
-                  (char_width, char_height*0.1, True), (char_width, char_height*0.7, True)],
-            
-            'v': [(0, char_height*0.7, False), (char_width*0.5, 0, True),
-                  (char_width, char_height*0.7, True)],
-            
-            'w': [(0, char_height*0.7, False), (char_width*0.2, 0, True),
-                  (char_width*0.5, char_height*0.4, True), (char_width*0.8, 0, True),
-                  (char_width, char_height*0.7, True)],
-            
-            'x': [(0, char_height*0.7, False), (char_width, 0, True),
-                  (char_width*0.5, char_height*0.35, False), (0, 0, True),
-                  (char_width, char_height*0.7, True)],
-            
-            'y': [(0, char_height*0.7, False), (0, char_height*0.3, True),
-                  (char_width*0.5, 0, True), (char_width, char_height*0.3, True),
-                  (char_width, char_height*0.7, True), (char_width, -char_height*0.2, True),
-                  (char_width*0.8, -char_height*0.3, True), (char_width*0.2, -char_height*0.3, True),
-                  (0, -char_height*0.2, True)],
-            
-            'z': [(0, char_height*0.7, False), (char_width, char_height*0.7, True),
-                  (0, 0, True), (char_width, 0, True)],
-            
-            '0': [(0, char_height*0.2, False), (0, char_height*0.8, True),
-                 (char_width*0.2, char_height, True), (char_width*0.8, char_height, True),
-                 (char_width, char_height*0.8, True), (char_width, char_height*0.2, True),
-                 (char_width*0.8, 0, True), (char_width*0.2, 0, True),
-                 (0, char_height*0.2, True)],
-            
-            '1': [(char_width*0.2, char_height*0.8, False), (char_width*0.5, char_height, True),
-                 (char_width*0.5, 0, True)],
-            
-            '2': [(0, char_height*0.8, False), (char_width*0.2, char_height, True),
-                 (char_width*0.8, char_height, True), (char_width, char_height*0.8, True),
-                 (char_width, char_height*0.6, True), (0, 0, True),
-                 (char_width, 0, True)],
-            
-            '3': [(0, char_height*0.8, False), (char_width*0.2, char_height, True),
-                 (char_width*0.8, char_height, True), (char_width, char_height*0.8, True),
-                 (char_width, char_height*0.6, True), (char_width*0.2, char_height*0.5, True),
-                 (char_width, char_height*0.4, True), (char_width, char_height*0.2, True),
-                 (char_width*0.8, 0, True), (char_width*0.2, 0, True),
-                 (0, char_height*0.2, True)],
-            
-            '4': [(char_width*0.8, 0, False), (char_width*0.8, char_height, True),
-                 (0, char_height*0.4, True), (char_width, char_height*0.4, True)],
-            
-            '5': [(char_width, char_height, False), (0, char_height, True),
-                 (0, char_height*0.5, True), (char_width*0.8, char_height*0.5, True),
-                 (char_width, char_height*0.4, True), (char_width, char_height*0.1, True),
-                 (char_width*0.2, 0, True), (0, char_height*0.1, True)],
-            
-            '6': [(char_width, char_height*0.8, False), (char_width*0.8, char_height, True),
-                 (char_width*0.2, char_height, True), (0, char_height*0.8, True),
-                 (0, char_height*0.2, True), (char_width*0.2, 0, True),
-                 (char_width*0.8, 0, True), (char_width, char_height*0.2, True),
-                 (char_width, char_height*0.4, True), (char_width*0.8, char_height*0.5, True),
-                 (0, char_height*0.5, True)],
-            
-            '7': [(0, char_height, False), (char_width, char_height, True),
-                 (char_width*0.5, 0, True)],
-            
-            '8': [(char_width*0.2, char_height*0.5, False), (0, char_height*0.7, True),
-                 (0, char_height*0.8, True), (char_width*0.2, char_height, True),
-                 (char_width*0.8, char_height, True), (char_width, char_height*0.8, True),
-                 (char_width, char_height*0.7, True), (char_width*0.8, char_height*0.5, True),
-                 (char_width*0.2, char_height*0.5, True), (0, char_height*0.3, True),
-                 (0, char_height*0.2, True), (char_width*0.2, 0, True),
-                 (char_width*0.8, 0, True), (char_width, char_height*0.2, True),
-                 (char_width, char_height*0.3, True), (char_width*0.8, char_height*0.5, True)],
-            
-            '9': [(0, char_height*0.2, False), (char_width*0.2, 0, True),
-                 (char_width*0.8, 0, True), (char_width, char_height*0.2, True),
-                 (char_width, char_height*0.8, True), (char_width*0.8, char_height, True),
-                 (char_width*0.2, char_height, True), (0, char_height*0.8, True),
-                 (0, char_height*0.6, True), (char_width*0.2, char_height*0.5, True),
-                 (char_width, char_height*0.5, True)],
-            
-            '.': [(char_width*0.4, 0, False), (char_width*0.6, 0, True),
-                 (char_width*0.6, char_height*0.2, True), (char_width*0.4, char_height*0.2, True),
-                 (char_width*0.4, 0, True)],
-            
-            ',': [(char_width*0.6, 0, False), (char_width*0.4, -char_height*0.2, True),
-                 (char_width*0.4, 0, True), (char_width*0.6, 0, True),
-                 (char_width*0.6, char_height*0.2, True), (char_width*0.4, char_height*0.2, True),
-                 (char_width*0.4, 0, True)],
-            
-            '!': [(char_width*0.5, char_height, False), (char_width*0.5, char_height*0.2, True),
-                 (char_width*0.5, 0, False), (char_width*0.3, 0, True),
-                 (char_width*0.3, char_height*0.1, True), (char_width*0.7, char_height*0.1, True),
-                 (char_width*0.7, 0, True), (char_width*0.5, 0, True)],
-            
-            '?': [(0, char_height*0.8, False), (char_width*0.2, char_height, True),
-                 (char_width*0.8, char_height, True), (char_width, char_height*0.8, True),
-                 (char_width, char_height*0.6, True), (char_width*0.5, char_height*0.4, True),
-                 (char_width*0.5, char_height*0.2, True), (char_width*0.5, 0, False),
-                 (char_width*0.3, 0, True), (char_width*0.3, char_height*0.1, True),
-                 (char_width*0.7, char_height*0.1, True), (char_width*0.7, 0, True),
-                 (char_width*0.5, 0, True)],
-            
-            ' ': [(0, 0, False)]  # Space
-        }
-        
-        # Process text
-        for line in text.split('\n'):
-            for char in line:  # Convert to uppercase for simplicity
-                if char not in font:
-                    char = ' '  # Default to space for undefined characters
-                
-                # Check if we need to start a new line (wrap)
-                if self.current_x + char_width * 1.2 > self.max_line_width:
-                    self.current_x = self.start_x
-                    self.current_y -= line_spacing
-                
-                # Get character path
-                path = font[char]
-                
-                # Draw character
-                for point in path:
-                    x_offset, y_offset, pen_down = point
-                    x = self.current_x + x_offset
-                    y = self.current_y + y_offset
-                    
-                    if pen_down:
-                        # Put pen down and draw
-                        gcode.append(f"{pen_down_cmd} ; Pen down")
-                        gcode.append(f"G1 X{x} Y{y} F{drawing_speed} ; Draw line")
-                    else:
-                        # Lift pen and move
-                        gcode.append(f"{pen_up_cmd} ; Pen up")
-                        gcode.append(f"G0 X{x} Y{y} F{travel_speed} ; Move without drawing")
-                
-                # Move to next character position
-                self.current_x += char_width * 1.2
-        
-        # Important: Don't reset position at the end of lines anymore
-        # Remove these lines:
-        # self.current_x = self.start_x
-        # self.current_y -= line_spacing
-        
+
+        planner = self.feed_planner() if self.adaptive_feeds else None
+        if planner is not None:
+            estimator = self.time_estimator()
+            self.last_feed_report = (0.0, 0.0)
+        page = self.current_page
+        self.last_page_breaks = []
+        for program_page, program in self.iter_strokes(text, char_width, char_height, line_spacing, optimize,
+                                                       simplify, pages=True):
+            if program_page != page:
+                page = program_page
+                if self.page_break_pause:
+                    self.last_page_breaks.append(page)
+                yield joined(self.page_break(emitter, page))
+            if preview is not None:
+                preview.add_program(program)
+            if planner is None:
+                yield emitter.strokes_text(program)
+                continue
+            feeds, before, after = planner.plan_and_estimate(program, estimator)
+            self.last_feed_report = (self.last_feed_report[0] + before, self.last_feed_report[1] + after)
+            yield emitter.strokes_text(program, feeds)
+
         # End G-code - don't return to origin
-        gcode.append(f"{pen_up_cmd} ; Pen up")
-        # Removed: gcode.append(f"G0 X0 Y0 F{travel_speed} ; Return to origin")
-        gcode.append("M2 ; End program")
-        
-        return '\n'.join(gcode)
+        yield joined(emitter.pause() if segment else emitter.end())
+
+     def page_break(self, emitter, page):
+        """
+        Lines between the G-code of two pages: with page_break_pause the
+        emitter lifts the pen and stops the program until the paper has been
+        changed (see paper_change).
+        """
+        logger.info(f"Page {page + 1} starts" + ("; the plotter will stop for a paper change"
+                                                 if self.page_break_pause else ""))
+        return emitter.page_break(page) if self.page_break_pause else []
+
+     def paper_change(self, page, plotter=None):
+        """
+        The send stage's side of a page break: the plotter has stopped for
+        the sheet of page (None if not known).  Returns once the new sheet is
+        in: on_page_break(page) if set, else when Enter is pressed.
+        """
+        sheet = f"page {page + 1}" if page is not None else "the next page"
+        where = f"{plotter}: " if plotter else ""
+        logger.info(f"{where}Plotter stopped for {sheet}; change the paper")
+        with self._paper_lock:
+            if self.on_page_break is not None:
+                self.on_page_break(page)
+                return
+            try:
+                input(f"{where}Put in the sheet for {sheet}, then press Enter to resume... ")
+            except EOFError:
+                pass
+
+     def pause_handler(self, job=None, plotter=None):
+        """on_pause for GrblStreamer.stream: a paper change for each of job's page breaks in turn"""
+        pauses = itertools.count()
+
+        def on_pause(line):
+            # Looked up as the plotter gets there: a resumed job drops the pages it has passed
+            index, pages = next(pauses), job.page_breaks if job is not None else []
+            self.paper_change(pages[index] if index < len(pages) else None, plotter)
+        return on_pause
+
+     def iter_gcode_chunks(self, text, chunk_size=4096, **kwargs):
+        """
+        Generate the G-code for text as newline-terminated ASCII bytes in
+        chunks of exactly chunk_size bytes (the last chunk may be shorter)
+        """
+        buffer = bytearray()
+        for block in self.iter_gcode_blocks(text, **kwargs):
+            buffer += block.encode('ascii')
+            while len(buffer) >= chunk_size:
+                yield bytes(buffer[:chunk_size])
+                del buffer[:chunk_size]
+        if buffer:
+            yield bytes(buffer)
+
+     def text_to_gcode(self, text, char_width=None, char_height=None, line_spacing=None, comments=None,
+                       optimize=None, emitter=None, simplify=None):
+        """
+        Convert text to G-code for CNC machines using M03/M05 for pen control.
+        Returns the whole program as one string; see iter_gcode for the options
+        and for generating long jobs line by line.
+        """
+        return ''.join(self.iter_gcode_blocks(text, char_width, char_height, line_spacing, comments, optimize,
+                                              emitter, simplify))[:-1]
 
      def send_to_ugs(self, gcode_file):
          if not self.ugs_path:
-             print("UGS not found.")
+             self.ugs_path = self._find_ugs_path()
+         if not self.ugs_path:
+             logger.warning("UGS not found.")
              return False
          
          try:
              # Get absolute path to G-code file
              gcode_absolute_path = os.path.abspath(gcode_file)
              if not os.path.exists(gcode_absolute_path):
-                 print(f"Error: G-code file {gcode_absolute_path} not found")
+                 logger.error(f"Error: G-code file {gcode_absolute_path} not found")
                  return False
              
              # Launch UGS with the G-code file
@@ -534,145 +703,562 @@ class SpeechToGCodeProcessor:
              else:
                  subprocess.Popen([self.ugs_path, "--open", gcode_absolute_path, "--console", "new"])
                  
-             print(f"Sent G-code to UGS: {gcode_absolute_path}")
+             logger.info(f"Sent G-code to UGS: {gcode_absolute_path}")
              
              # Wait for UGS to start
              time.sleep(60)
              
              return True
          except Exception as e:
-             print(f"Error sending to UGS: {e}")
+             logger.error(f"Error sending to UGS: {e}")
              return False
      
+     def stream_to_grbl(self, gcode_file, preamble=None, wait=True, job=None):
+        """
+        Stream a G-code file to GRBL over the serial connection, which is opened
+        once and kept for later jobs.  Returns when the plotter has finished,
+        or with wait=False as soon as GRBL has taken the last line, while
+        the moves are still being drawn.  preamble is sent first whenever
+        the connection is new.  At job's page breaks the stream waits for the
+        paper change (see paper_change).  With a spool, job's progress is
+        checkpointed and a job recovered from a crash resumes where it stopped.
+        """
+        try:
+            errors = []
+            if self.streamer is None or not self.streamer.is_connected:
+                logger.info(f"Connecting to GRBL on {self.serial_port}...")
+                self.streamer = GrblStreamer(self.serial_port, self.baudrate).connect()
+                self.is_connected = True
+                if preamble:
+                    errors += self.streamer.stream(preamble)
+
+            on_pause = self.pause_handler(job)
+            if self.spool is not None and job is not None:
+                errors += self.streamer.stream(self.spool.stream_lines(job, self.streamer, self.checkpoint_lines),
+                                               on_pause=on_pause)
+            else:
+                errors += self.streamer.stream_file(gcode_file, on_pause=on_pause)
+            for line, error in errors:
+                logger.error(f"GRBL rejected '{line}': {error}")
+            if wait:
+                self.streamer.wait_until_idle()
+            return True
+        except (GrblError, OSError) as e:
+            logger.error(f"Error streaming to GRBL: {e}")
+            if self.streamer:
+                self.streamer.close()
+            self.streamer = None
+            self.is_connected = False
+            return False
+
      def connect_to_machine(self):
         """Connect to the machine if not already connected"""
         try:
+            import pyautogui  # Slow to import, and needs a display
+
             # Find and click connect button
-            print("Looking for connect button...")
+            logger.info("Looking for connect button...")
             connect_button_path = "connect_button.png"
             connect_location = pyautogui.locateOnScreen(connect_button_path, confidence=0.6)
             if connect_location:
                 center = pyautogui.center(connect_location)
                 pyautogui.click(center)
-                print("Clicked connect button!")
+                logger.info("Clicked connect button!")
                 
                 # Wait for connection to establish
                 time.sleep(10)
                 return True
             else:
-                print("Connect button not found, might already be connected")
+                logger.warning("Connect button not found, might already be connected")
                 return True  # Assume connected if button not found
                 
         except Exception as e:
-            print(f"Error clicking connect button: {e}")
+            logger.error(f"Error clicking connect button: {e}")
         return False
 
      def run_gcode_file(self):
         """Start running the loaded G-code file"""
         try:
+            import pyautogui
+
             # Find and click start button
-            print("Looking for start button...")
+            logger.info("Looking for start button...")
             start_button_path = "start_button.png"
             start_location = pyautogui.locateOnScreen(start_button_path, confidence=0.6)
             if start_location:
                 center = pyautogui.center(start_location)
                 pyautogui.click(center)
-                print("Clicked start button!")
+                logger.info("Clicked start button!")
                 return True
             else:
-                print("Start button not found")
+                logger.warning("Start button not found")
                 
         except Exception as e:
-            print(f"Error clicking start button: {e}")
+            logger.error(f"Error clicking start button: {e}")
         
         return False
              
          
 
-     def process_queue(self):
-        gcode_files_queue = []  # Queue to store generated G-code files
+     def compile_job(self, job):
+        """
+        Compile and estimate stages: write the G-code for a job's text to a
+        file, estimating the plotting time as the G-code is generated without
+        holding the whole job in memory.  Sets job.gcode_file and
+        job.plotting_time.  With preview_jobs, raises ValueError for a job
+        that leaves the paper, so it is never sent.  With a job_cache, a job
+        compiled before with the same settings and layout shape is not
+        compiled again: the earlier G-code is moved to the cursor and
+        written as the job's own file.  With a spool, the file is written into it and
+        the job journaled as compiled.
+        """
+        text = job.text
+        with self.processing_lock:  # Ensure only one batch is processed at a time
+            logger.info(f"Processing batch {job.batch_id}: {text}")
+            cache_key = None
+            # A session segment depends on the emitter state left by the batches
+            # before it, so segments are not cached
+            # Microseconds keep files apart now that the next job compiles while
+            # the previous one is still being sent
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+            gcode_file = self.spool.job_path(job.batch_id) if self.spool is not None else f"output_{timestamp}.gcode"
+            if self.job_cache is not None and not self.continuous:
+                shape = self.layout_shape(text)
+                if shape is not None:
+                    cache_key = self.job_cache.key(self.compile_settings(text, shape))
+                    cached = self.job_cache.lookup(cache_key)
+                    if cached is not None and self._reuse_cached(job, cached, gcode_file):
+                        return
+            start = [self.current_x, self.current_y]
+            preview = Preview(self.page_width, self.page_height) if self.preview_jobs else None
+            if self.continuous:
+                first = self.session_emitter is None
+                emitter, job.preamble = self._session_preamble()
+                estimate = self.time_estimator().streaming((0.0, 0.0) if first else emitter.position)
+                for line in job.preamble:
+                    # Only the first preamble is always sent; later ones just set the modal state
+                    if first or not line.startswith(emitter.pen_up_cmd):
+                        estimate.feed(line)
+            else:
+                emitter = self.make_emitter()
+                estimate = self.time_estimator().streaming()
+            with open(gcode_file, "w") as f:
+                for block in self.iter_gcode_blocks(text, emitter=emitter, preview=preview, segment=self.continuous):
+                    f.write(block)
+                    estimate.feed_lines(block.split("\n")[:-1])
+
+            if preview is not None:
+                if self.preview_dir:
+                    preview_file = os.path.join(self.preview_dir, os.path.splitext(os.path.basename(gcode_file))[0] + ".png")
+                    preview.save(preview_file)
+                    logger.info(f"Preview saved to {preview_file}")
+                problems = preview.problems()
+                if problems:
+                    raise ValueError(f"Batch {job.batch_id} not sent: " + "; ".join(problems))
+            if self.last_travel_report:
+                travel_before, travel_after = self.last_travel_report
+                logger.info(f"Pen-up travel: {travel_before:.1f} mm -> {travel_after:.1f} mm")
+            if self.adaptive_feeds and self.last_feed_report:
+                time_before, time_after = self.last_feed_report
+                logger.info(f"Adaptive feeds: about {time_before:.1f} s -> {time_after:.1f} s of moves "
+                            f"({time_before - time_after:.1f} s saved)")
+            if self.simplify_geometry and self.last_geometry_report:
+                report = self.last_geometry_report
+                logger.info(f"Geometry: {report.vertices_before} -> {report.vertices_after} moves "
+                      f"({report.arcs} arcs), about {report.time_before:.1f} s -> {report.time_after:.1f} s")
+
+            plotting_time = estimate.finish()
+            if cache_key is not None:
+                self.job_cache.store(cache_key, gcode_file, start=start, cursor=[self.current_x, self.current_y],
+                                     plotting_time=plotting_time)
+            logger.info(f"G-code saved to {gcode_file}")
+            if getattr(emitter, "reference_bytes", 0):
+                logger.info(f"Compact G-code: {emitter.bytes} bytes instead of {emitter.reference_bytes} "
+                            f"({1 - emitter.bytes / emitter.reference_bytes:.0%} fewer)")
+            logger.info(f"Estimated plotting time: {plotting_time:.2f} seconds")
+            job.gcode_file, job.plotting_time = gcode_file, plotting_time
+            job.page_breaks = self.last_page_breaks
+            if self.spool is not None:
+                self.spool.record_compiled(job, [self.current_x, self.current_y, self.current_page])
+
+     def _reuse_cached(self, job, cached, gcode_file):
+        """
+        Write a JobCache entry, moved from where it was compiled to the
+        layout cursor, to gcode_file as job's G-code.  Returns False if the
+        cached file could not be read.
+        """
+        offset = (self.current_x - cached["start"][0], self.current_y - cached["start"][1])
+        plotting_time = cached["plotting_time"]
+        try:
+            if offset == (0.0, 0.0):
+                shutil.copyfile(cached["path"], gcode_file)
+            else:
+                with open(cached["path"]) as source:
+                    lines = source.read().splitlines()
+                emitter = self.make_emitter()
+                moved = list(emitter.translate(lines, offset))
+                with open(gcode_file, "w") as f:
+                    f.write("\n".join(moved) + "\n")
+                # Only the travel to the first stroke changes length, and the
+                # machine stops for the pen to come down after it
+                head = next((index + 1 for index, line in enumerate(lines)
+                             if line.startswith(emitter.pen_down_cmd)), len(lines))
+                for sign, part in ((-1, lines[:head]), (1, moved[:head])):
+                    estimate = self.time_estimator().streaming()
+                    estimate.feed_lines(part)
+                    plotting_time += sign * estimate.finish()
+        except OSError as e:
+            logger.warning(f"Could not reuse cached {cached['path']}: {e}")
+            return False
+        self.current_x, self.current_y = cached["cursor"][0] + offset[0], cached["cursor"][1] + offset[1]
+        self.position_initialized = True
+        self.last_page_breaks = []
+        job.gcode_file, job.plotting_time, job.page_breaks = gcode_file, plotting_time, []
+        logger.info(f"Reused {cached['path']} for {gcode_file}; estimated plotting time: "
+                    f"{job.plotting_time:.2f} seconds")
+        if self.spool is not None:
+            self.spool.record_compiled(job, [self.current_x, self.current_y, self.current_page])
+        return True
+
+     def _session_preamble(self):
+        """
+        The continuous session's emitter and the lines that set a fresh GRBL
+        connection up for the next segment: the program header for the first
+        batch, and afterwards a header that resumes where the previous
+        segment stopped
+        """
+        emitter = self.session_emitter
+        if emitter is None:
+            emitter = self.session_emitter = self.make_emitter()
+            preamble = emitter.begin((self.current_x, self.current_y), first_batch=not self.position_initialized)
+            self.position_initialized = True
+            return emitter, preamble
+        # A deep copy, so the session's own state (and byte counts) are left
+        # alone, including the compact emitter's reference
+        return emitter, copy.deepcopy(emitter).begin(emitter.position, first_batch=False)
+
+     def _end_session(self):
+        """Close the continuous session's program and wait for the plotter to finish"""
+        if self.session_emitter is None or self.streamer is None:
+            return
+        try:
+            for line, error in self.streamer.stream(self.session_emitter.end()):
+                logger.error(f"GRBL rejected '{line}': {error}")
+            self.streamer.wait_until_idle()
+            logger.info("Session complete.")
+        except (GrblError, OSError) as e:
+            logger.error(f"Error ending the session: {e}")
+
+     def send_jobs(self):
+        """
+        Send stage: plot the compiled jobs one at a time until job_queue is
+        closed and empty.  In a continuous session each segment is handed to
+        GRBL without waiting for the plotter, so the next one follows with
+        no pause, and the program is ended once the queue is done.
+        """
         connected = False  # Track connection state
-        
-        while self.is_running:
-            # Process new speech input
-            if not self.text_queue.empty():
-                with self.processing_lock:  # Ensure only one batch is processed at a time
-                    text = self.text_queue.get().strip()
-                    if text:
-                        print(f"Processing: {text}")
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        gcode_file = f"output_{timestamp}.gcode"
-                        gcode = self.text_to_gcode(text)
-                        
-                        # Write to file
-                        with open(gcode_file, "w") as f:
-                            f.write(gcode)
-                        
-                        print(f"G-code saved to {gcode_file}")
-    
-                        # Calculate estimated plotting time
-                        plotting_time = self.calculate_plotting_time(gcode)
-                        print(f"Estimated plotting time: {plotting_time:.2f} seconds")
-                        
-                        # Add the file and its plotting time to the queue
-                        gcode_files_queue.append((gcode_file, plotting_time))
-            
-            # Process the next file in the queue if not currently plotting
-            if gcode_files_queue and not hasattr(self, 'plotting_in_progress'):
-                self.plotting_in_progress = True
-                current_file, plotting_time = gcode_files_queue.pop(0)
-                
-                try:
-                    print(f"Sending file to UGS: {current_file}")
+        instrumentation = self.instrumentation
+        for job in self.job_queue:
+            current_file, plotting_time = job.gcode_file, job.plotting_time
+            instrumentation.record("send_queue", time.monotonic() - job.compiled, job.batch_id)
+            if self.serial_port:
+                # Stream over the open serial connection; returns once plotted
+                logger.info(f"Streaming file to GRBL: {current_file}")
+                self._pen_on_paper(job)
+                with instrumentation.span("plot", job.batch_id, estimated=round(plotting_time, 3)):
+                    success = self.stream_to_grbl(current_file, job.preamble, wait=not self.continuous, job=job)
+                if success:
+                    logger.info("Segment sent; plotter still drawing." if self.continuous
+                                else "Plotting complete. Ready for next file.")
+                    self._plot_finished(job)
+                else:
+                    logger.error("Failed to stream file to GRBL.")
+            else:
+                logger.info(f"Sending file to UGS: {current_file}")
+                with instrumentation.span("launch", job.batch_id):
                     success = self.send_to_ugs(current_file)
-                    
-                    if success:
-                        # Connect only if not already connected
-                        if not connected:
+
+                if success:
+                    # Connect only if not already connected
+                    if not connected:
+                        with instrumentation.span("connect", job.batch_id):
                             connected = self.connect_to_machine()
-                        
-                        # Always run the file
-                        if self.run_gcode_file():
-                            print(f"Waiting {plotting_time:.2f} seconds for plotting to complete...")
+
+                    # Always run the file
+                    if self.run_gcode_file():
+                        self._pen_on_paper(job)
+                        logger.info(f"Waiting {plotting_time:.2f} seconds for plotting to complete...")
+                        with instrumentation.span("plot", job.batch_id, estimated=round(plotting_time, 3)):
                             time.sleep(plotting_time)
-                            print("Plotting complete. Ready for next file.")
-                        else:
-                            print("Failed to start plotting.")
-                            # If running failed, we might need to reconnect next time
-                            connected = False
+                        logger.info("Plotting complete. Ready for next file.")
+                        self._plot_finished(job)
                     else:
-                        print("Failed to send file to UGS.")
-                finally:
-                    # Clear the plotting flag regardless of success
-                    delattr(self, 'plotting_in_progress')
-                    
-            time.sleep(0.1)
-    
-    
+                        logger.error("Failed to start plotting.")
+                        # If running failed, we might need to reconnect next time
+                        connected = False
+                else:
+                    logger.error("Failed to send file to UGS.")
+            self.job_done()
+        if self.continuous:
+            self._end_session()
+
+     def _pen_on_paper(self, job):
+        if job.speech_end is not None:
+            self.instrumentation.record("speech_to_plot", time.monotonic() - job.speech_end, job.batch_id)
+
+     def _plot_finished(self, job):
+        if job.speech_end is not None:
+            self.instrumentation.record("end_to_end", time.monotonic() - job.speech_end, job.batch_id)
+        if self.spool is not None:
+            self.spool.record_done(job)
+
+     def restore_spool(self):
+        """
+        Continue where the last run stopped: take the layout cursor and the
+        batch numbering from the spool, and hand what it left unfinished to
+        process_queue, which sends the compiled jobs (resuming each from its
+        last checkpoint) and compiles the other batches before any new text
+        """
+        recovered = self.spool.recovered
+        if recovered.cursor is not None:
+            self.current_x, self.current_y, self.current_page = recovered.cursor
+            self.position_initialized = True
+        self.next_batch_id = max(self.next_batch_id, recovered.next_batch)
+        self.recovered_jobs, self.recovered_batches = list(recovered.jobs), list(recovered.batches)
+        with self.jobs_lock:
+            self.jobs_in_flight += len(self.recovered_jobs) + len(self.recovered_batches)
+
+     def process_queue(self):
+        """
+        Run the pipeline after transcription: compile each text batch from
+        text_queue and pass the job to the send stage, which runs in its own
+        thread so the next batch compiles while the current one plots.
+        Returns once text_queue is closed and every job has been sent.
+        With a fleet, each batch is compiled for and queued on one of its
+        plotters instead.
+        """
+        if self.fleet is not None:
+            self.fleet.start()
+            try:
+                for job in self.text_queue:
+                    self.instrumentation.record("compile_queue", time.monotonic() - job.queued, job.batch_id)
+                    try:
+                        self.fleet.submit(job)  # Blocks while the plotters are behind
+                    except (OSError, ValueError) as e:
+                        logger.error(f"Error compiling G-code: {e}")
+                        self.job_done()
+            finally:
+                self.fleet.close()
+            return
+        sender = threading.Thread(target=self.send_jobs, daemon=True)
+        sender.start()
+        try:
+            recovered, self.recovered_jobs = self.recovered_jobs, []
+            for job in recovered:
+                job.compiled = time.monotonic()
+                self.job_queue.put(job)
+            recovered, self.recovered_batches = self.recovered_batches, []
+            for job in itertools.chain(recovered, self.text_queue):
+                self.instrumentation.record("compile_queue", time.monotonic() - job.queued, job.batch_id)
+                try:
+                    with self.instrumentation.span("compile", job.batch_id):
+                        self.compile_job(job)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Error compiling G-code: {e}")
+                    if self.spool is not None:
+                        self.spool.record_done(job, error=e)
+                    self.job_done()
+                    continue
+                job.compiled = time.monotonic()
+                self.job_queue.put(job)  # Blocks while the plotter is behind
+        finally:
+            self.job_queue.close()
+            sender.join()
+
+     def shutdown(self, processing, transcription=None):
+        """Stop taking speech, then let the pipeline finish the work already queued"""
+        self.is_running = False
+        logger.info("Shutting down...")
+        # No batch may follow the last one below, or be journaled after the spool closes
+        if self.capture is not None:
+            self.capture.stop()
+        if transcription is not None:
+            transcription.join()
+        self.queue_batch(self.batcher.flush(self.jobs_in_flight, reason="shutdown"))  # Process any remaining text
+        self.text_queue.close()
+        processing.join()
+        if self.streamer:
+            self.streamer.close()
+        if self.spool is not None:
+            self.spool.close()
+        summary = self.batcher.summary()
+        if summary["batches"]:
+            logger.info(f"{summary['batches']} batches, {summary['mean_words']:.1f} words and "
+                        f"{summary['mean_backlog']:.1f} jobs in flight on average")
+        self.report_latencies()
+
+     def latency_settings(self):
+        """Settings that affect stage latencies, stored with a latency baseline"""
+        return {
+            "recognizer": self.recognizer_backend,
+            "recognition_workers": self.recognition_workers,
+            "batch_sizes": [self.batcher.min_words, self.batcher.words_per_job, self.batcher.max_words],
+            "sender": f"fleet of {len(self.fleet.devices)}" if self.fleet else "grbl" if self.serial_port else "ugs",
+            "continuous": self.continuous,
+            "emitter": self.emitter,
+            "optimize_travel": self.optimize_travel,
+            "simplify_geometry": self.simplify_geometry,
+            "max_rate": self.max_rate,
+            "acceleration": self.acceleration,
+        }
+
+     def report_latencies(self):
+        """Log stage percentiles and compare them with (or save) the latency baseline"""
+        self.instrumentation.log_summary()
+        for name, cache in (("Job cache", self.job_cache), ("Word cache", self.fragment_cache)):
+            if cache is not None:
+                stats = cache.stats()
+                logger.info(f"{name}: {stats['hits']} hits, {stats['misses']} misses "
+                            f"({stats['hit_rate']:.0%}), {stats['evictions']} evictions")
+        if self.latency_baseline:
+            if self.save_latency_baseline:
+                self.instrumentation.save_baseline(self.latency_baseline, self.latency_settings())
+                logger.info(f"Latency baseline saved to {self.latency_baseline}")
+            else:
+                for message in self.instrumentation.check_regressions(self.latency_baseline,
+                                                                      self.latency_settings()):
+                    logger.warning(f"Latency regression: {message}")
+        self.instrumentation.close()
+
      def run(self):
+        if self.spool is not None:
+            self.restore_spool()
+        # Start transcription thread
+        transcription = threading.Thread(target=self.real_time_transcription, daemon=True)
+        transcription.start()
+        # Start processing thread
+        processing = threading.Thread(target=self.process_queue, daemon=True)
+        processing.start()
+
+        logger.info("Speech-to-GCode converter running!")
+        logger.info("Press Ctrl+C to stop.")
+
         try:
-            # Start transcription thread
-            threading.Thread(target=self.real_time_transcription, daemon=True).start()
-            # Start processing thread
-            threading.Thread(target=self.process_queue, daemon=True).start()
-            
-            print("Speech-to-GCode converter running!")
-            print("Press Ctrl+C to stop.")
-            
-            while self.is_running:
-                time.sleep(0.1)
+            # Wake up now and then so Ctrl+C gets through on Windows
+            while not self.stopped.wait(0.5):
+                pass
         except KeyboardInterrupt:
-            self.is_running = False
-            if self.batch_text:  # Process any remaining text
-                self.text_queue.put(self.batch_text.strip())
-            print("Shutting down...")
-            time.sleep(2)  # Give time for remaining processing
+            pass
+        self.shutdown(processing, transcription)
 
 if __name__ == "__main__":
-    # Try to find UGS path or use the one provided
-    ugs_path = None
-    if len(sys.argv) > 1:
-        ugs_path = sys.argv[1]
-    
-    processor = SpeechToGCodeProcessor("C:\\Users\\vyshu\\Downloads\\ugs\\ugsplatform-win\\bin\\ugsplatform64.exe")
+    parser = argparse.ArgumentParser(description="Speech-to-GCode converter")
+    parser.add_argument("ugs_path", nargs="?",
+                        default="C:\\Users\\vyshu\\Downloads\\ugs\\ugsplatform-win\\bin\\ugsplatform64.exe",
+                        help="Path to the UGS executable or jar")
+    parser.add_argument("--port", help="Stream directly to GRBL on this serial port instead of using UGS")
+    parser.add_argument("--baud", type=int, default=115200, help="GRBL serial baud rate")
+    parser.add_argument("--fleet", nargs="+", metavar="PORT",
+                        help="Spread the text over GRBL plotters on these serial ports")
+    parser.add_argument("--simulate", type=int, metavar="N",
+                        help="Spread the text over N simulated plotters (a dry run)")
+    parser.add_argument("--spool", metavar="DIR",
+                        help="Journal batches and plot progress here, and resume what a crash left unfinished "
+                             "on the next start (needs --port or UGS, not a fleet)")
+    parser.add_argument("--continuous", action="store_true",
+                        help="Stream the whole session to GRBL as one program, with no pause between batches "
+                             "(needs --port)")
+    parser.add_argument("--recognizer", choices=sorted(RECOGNIZERS), default="google",
+                        help="Speech recognition backend (sphinx and vosk work offline)")
+    parser.add_argument("--vosk-model", help="Path to the Vosk model directory for --recognizer vosk")
+    parser.add_argument("--replay", nargs="+", metavar="WAV",
+                        help="Transcribe these audio files instead of the microphone")
+    parser.add_argument("--workers", type=int, default=4, help="Utterances recognized in parallel")
+    parser.add_argument("--calibration", metavar="FILE", default="mic_calibration.json",
+                        help="Keep the microphone's noise calibration here and reuse it on the next start")
+    parser.add_argument("--recalibrate", action="store_true",
+                        help="Calibrate on the room's noise at start even if a calibration is saved")
+    parser.add_argument("--simplify", action="store_true",
+                        help="Simplify strokes and draw curves as G2/G3 arcs")
+    parser.add_argument("--font", metavar="FILE", help="Draw with a font compiled by font_compiler.py")
+    parser.add_argument("--wrap", choices=WRAPS, default="greedy",
+                        help="Break lines between words (greedy or balanced) or at any character (char)")
+    parser.add_argument("--no-page-pause", action="store_true",
+                        help="Do not stop the plotter for a paper change when a new page starts")
+    parser.add_argument("--adaptive-feeds", action="store_true",
+                        help="Plan a feed per move: up to --max-rate on long straight strokes, and slower "
+                             "into sharp corners only where that saves time")
+    parser.add_argument("--max-rate", type=int, default=500, help="Machine maximum feed in mm/min (GRBL $110)")
+    parser.add_argument("--drawing-speed", type=int, default=500, help="Drawing feed in mm/min")
+    parser.add_argument("--corner-speed", type=int, default=250,
+                        help="Feed into right-angle corners in mm/min, with --adaptive-feeds, if it saves time")
+    parser.add_argument("--preview", action="store_true",
+                        help="Check every job against the paper size and skip jobs that leave it")
+    parser.add_argument("--preview-dir", metavar="DIR", help="Save a PNG preview of every job here (implies --preview)")
+    parser.add_argument("--compact", action="store_true",
+                        help="Send compact G-code (no comments, modal words left out) and log the bytes saved")
+    parser.add_argument("--precision", type=int, default=3, help="Decimals in compact G-code coordinates")
+    parser.add_argument("--relative", action="store_true", help="Use relative moves (G91) in compact G-code")
+    parser.add_argument("--optimize", action="store_true",
+                        help="Reorder strokes to shorten pen-up travel (compiling gets much slower)")
+    parser.add_argument("--cache", metavar="DIR",
+                        help="Keep compiled jobs here and reuse them when the same text comes up again")
+    parser.add_argument("--word-cache", type=int, metavar="WORDS", default=0,
+                        help="Optimize each word once and remember up to WORDS of them (implies --optimize)")
+    parser.add_argument("--log-json", action="store_true", help="Log as JSON lines")
+    parser.add_argument("--metrics", metavar="FILE", help="Append stage timings to this JSON-lines file")
+    parser.add_argument("--latency-baseline", metavar="FILE",
+                        help="Warn on shutdown about stages slower than in this baseline")
+    parser.add_argument("--save-latency-baseline", action="store_true",
+                        help="Save this run's stage latencies as the baseline instead")
+    args = parser.parse_args()
+    if args.recognizer == "vosk" and not args.vosk_model:
+        parser.error("--recognizer vosk needs --vosk-model")
+    if args.continuous and (not args.port or args.fleet or args.simulate):
+        parser.error("--continuous needs --port and cannot be combined with a fleet")
+    if args.spool and (args.fleet or args.simulate):
+        parser.error("--spool cannot be combined with a fleet")
+
+    configure_logging(json_lines=args.log_json)
+    processor = SpeechToGCodeProcessor(args.ugs_path, serial_port=args.port, baudrate=args.baud)
+    if args.metrics:
+        processor.instrumentation = Instrumentation(args.metrics)
+    processor.latency_baseline = args.latency_baseline
+    processor.save_latency_baseline = args.save_latency_baseline
+    processor.recognizer_backend = args.recognizer
+    if args.vosk_model:
+        processor.recognizer_options = {"model_path": args.vosk_model}
+    processor.replay_files = args.replay
+    processor.recognition_workers = args.workers
+    processor.calibration_file = args.calibration
+    processor.recalibrate = args.recalibrate
+    processor.simplify_geometry = args.simplify
+    processor.font = args.font
+    processor.wrap = args.wrap
+    processor.page_break_pause = not args.no_page_pause
+    processor.adaptive_feeds = args.adaptive_feeds
+    processor.max_rate = processor.max_drawing_speed = args.max_rate
+    processor.drawing_speed = args.drawing_speed
+    processor.corner_speed = args.corner_speed
+    processor.continuous = args.continuous
+    processor.optimize_travel = args.optimize or bool(args.word_cache)
+    if args.fleet or args.simulate:
+        devices = [GrblDevice(f"plotter{i + 1}", port, args.baud) for i, port in enumerate(args.fleet or [])]
+        # Nobody changes paper on a dry run, so simulated plotters don't stop for it
+        devices += [SimulatedDevice(f"simulated{i + 1}", pause=False) for i in range(args.simulate or 0)]
+        processor.fleet = FleetScheduler(processor, devices)
+    if args.compact:
+        processor.emitter = "compact"
+        processor.emitter_options["compact"] = {"precision": args.precision, "relative": args.relative,
+                                                "compare": True}
+    if args.cache:
+        processor.job_cache = JobCache(args.cache)
+    if args.spool:
+        processor.spool = Spool(args.spool)
+    if args.word_cache:
+        processor.fragment_cache = FragmentCache(args.word_cache)
+    processor.preview_jobs = args.preview or bool(args.preview_dir)
+    processor.preview_dir = args.preview_dir
+    if args.preview_dir:
+        os.makedirs(args.preview_dir, exist_ok=True)
     processor.run()
\ No newline at end of file
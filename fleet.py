@@ -0,0 +1,370 @@
+"""
+Fan one stream of text batches out over several plotters.
+
+Each device has its own job queue, state (idle, busy or error) and layout
+cursor, so every plotter writes its own pages.  A batch is routed before it
+is compiled, because where the text lands depends on the cursor of the
+device that will draw it:
+
+  * while a device has a page open, the batches that follow go to the same
+    device, so consecutive lines of a page stay together;
+  * a new page goes to the healthy device with the least plotting left,
+    counted from the estimated plot times of its queued jobs.
+
+When a device's page is full (or abandoned), the next batch routed to it
+starts a new sheet: the layout moves on to the next page and the plotter
+stops for the paper change there, as on a single plotter.
+
+When a device fails, its page is abandoned and the job it was plotting and
+everything still queued for it are routed again, in order and ahead of any
+batch submitted meanwhile, to the other devices (recompiled for their
+cursors).  With no healthy device left the
+jobs wait until reset() brings one back.  SimulatedDevice stands in for a
+plotter in tests and dry runs.
+"""
+import collections
+import logging
+import threading
+import time
+
+from grbl_streamer import GrblError, GrblStreamer
+
+logger = logging.getLogger(__name__)
+
+IDLE = "idle"
+BUSY = "busy"
+ERROR = "error"
+
+
+class Device:
+    """A plotter and the jobs queued for it; subclasses implement plot()"""
+
+    def __init__(self, name):
+        self.name = name
+        self.state = IDLE
+        self.error = None  # Exception or message that put the device in ERROR
+        self.jobs = collections.deque()  # Compiled Jobs waiting to be plotted
+        self.current = None  # Job being plotted
+        self.started = None  # time.monotonic() the current job started
+        self.cursor = None  # Layout (x, y, page) for the next batch; set by the scheduler
+        self.position_initialized = False  # The G-code preamble has been sent
+        self.page_lines = 0  # Lines started on the current page
+        self.pages = 0  # Pages started
+        self.plotted = 0  # Jobs finished
+
+    def backlog(self, now=None):
+        """Estimated seconds of plotting queued on this device"""
+        seconds = sum(job.plotting_time or 0.0 for job in self.jobs)
+        if self.current is not None and self.current.plotting_time:
+            elapsed = (now or time.monotonic()) - self.started
+            seconds += max(self.current.plotting_time - elapsed, 0.0)
+        return seconds
+
+    def plot(self, job, on_pause=None):
+        """
+        Plot job.gcode_file and return once done; return False or raise on
+        failure.  on_pause(line) is called where the plotter stops at a page
+        break, and the plot resumes when it returns.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class GrblDevice(Device):
+    """A GRBL plotter on a serial port, streamed with GrblStreamer"""
+
+    def __init__(self, name, port, baudrate=115200):
+        super().__init__(name)
+        self.port = port
+        self.baudrate = baudrate
+        self.streamer = None
+
+    def plot(self, job, on_pause=None):
+        if self.streamer is None or not self.streamer.is_connected:
+            logger.info(f"{self.name}: connecting to GRBL on {self.port}...")
+            self.streamer = GrblStreamer(self.port, self.baudrate).connect()
+        for line, error in self.streamer.stream_file(job.gcode_file, on_pause=on_pause):
+            logger.error(f"{self.name}: GRBL rejected '{line}': {error}")
+        self.streamer.wait_until_idle()
+        return True
+
+    def close(self):
+        if self.streamer:
+            self.streamer.close()
+            self.streamer = None
+
+
+class SimulatedDevice(Device):
+    """
+    Pretends to plot by sleeping for the estimated plotting time divided by
+    speedup, stopping for each of the job's page breaks (with pause false it
+    only logs them, so a dry run never waits for a paper change).  With
+    fail_after it fails on the job after that many have been plotted.
+    Records the Jobs it plotted in self.history.
+    """
+
+    def __init__(self, name, speedup=1.0, fail_after=None, pause=True):
+        super().__init__(name)
+        self.speedup = speedup
+        self.fail_after = fail_after
+        self.pause = pause
+        self.history = []
+
+    def plot(self, job, on_pause=None):
+        if self.fail_after is not None and len(self.history) >= self.fail_after:
+            raise GrblError("Simulated failure")
+        for page in job.page_breaks:
+            if not self.pause:
+                logger.info(f"{self.name}: would stop for the sheet of page {page + 1}")
+            elif on_pause is not None:
+                on_pause("M0")
+        time.sleep((job.plotting_time or 0.0) / self.speedup)
+        self.history.append(job)
+        return True
+
+
+class FleetScheduler:
+    """
+    Compile batches with processor (a SpeechToGCodeProcessor) for the device
+    they are routed to and plot them on a thread per device.  At most
+    max_queued compiled jobs wait on each device; past that submit() blocks.
+    """
+
+    def __init__(self, processor, devices, lines_per_page=None, max_queued=2):
+        if not devices:
+            raise ValueError("A fleet needs at least one device")
+        self.processor = processor
+        self.devices = list(devices)
+        self.start_position = (processor.start_x, processor.start_y)
+        # The layout's lines per page, or a sheet's worth if text runs on down the paper
+        self.lines_per_page = (lines_per_page or processor.page_geometry().lines
+                               or int(processor.page_height // processor.line_spacing))
+        self.max_queued = max_queued
+        for device in self.devices:
+            device.cursor = self.start_position + (0,)
+        self.page_device = None  # Device with the page being written
+        self.unassigned = collections.deque()  # Jobs waiting for a healthy device
+        self.requeued = collections.deque()  # Jobs of a failed device, routed before any new ones
+        self._condition = threading.Condition()
+        self._compile_lock = threading.Lock()
+        self._placing = False  # A job is being compiled for a device; set and cleared under the condition
+        self._threads = []
+        self._closed = False
+
+    def start(self):
+        for device in self.devices:
+            self._start_device(device)
+        return self
+
+    def _start_device(self, device):
+        thread = threading.Thread(target=self._run_device, args=(device,), name=device.name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _finished(self):
+        """Closed, and no device has a job that could still fail and be requeued"""
+        return self._closed and all(device.current is None and not device.jobs for device in self.devices)
+
+    def _healthy(self):
+        return [device for device in self.devices if device.state != ERROR]
+
+    def _route(self):
+        """Device for the next batch, or None if it has to wait for room"""
+        page_device = self.page_device
+        if page_device is not None and page_device.state != ERROR:
+            return page_device if len(page_device.jobs) < self.max_queued else None
+        now = time.monotonic()
+        candidates = [device for device in self._healthy() if len(device.jobs) < self.max_queued]
+        if not candidates:
+            return None
+        device = min(candidates, key=lambda device: device.backlog(now))
+        self.page_device = device
+        return device
+
+    def submit(self, job):
+        """
+        Route, compile and queue a Job.  Returns the device it went to, or
+        None if no device is healthy (the job then waits in unassigned) or
+        the device failed while the job was compiled for it (the job is then
+        routed again after the failed device's jobs).  Raises whatever
+        compiling raises (OSError, ValueError).
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: not self.requeued and not self._placing
+                                     and (self._route() is not None or not self._healthy()))
+            return self._place(job)
+
+    def _place(self, job):
+        """
+        submit() with the condition held, no other job being placed and a
+        device ready to take job (or none healthy).  The condition is
+        released while job compiles, so the devices keep plotting and
+        reporting meanwhile; placing one job at a time keeps a device's jobs
+        in the order their cursors were advanced in.
+        """
+        device = self._route()
+        if device is None:
+            self.unassigned.append(job)
+            logger.warning(f"No healthy plotter; batch {job.batch_id} waits")
+            return None
+        cursor = device.cursor
+        self._placing = True
+        self._condition.release()
+        try:
+            end = self._compile(job, device, cursor, device.position_initialized)
+        finally:
+            self._condition.acquire()
+            self._placing = False
+            self._condition.notify_all()
+        if device.state == ERROR or device.cursor != cursor:
+            # The device failed meanwhile; _fail() is waiting for this
+            # placement to end before it routes the device's jobs again
+            logger.warning(f"{device.name} failed while batch {job.batch_id} was compiled for it")
+            self.requeued.append(job)
+            return None
+        self._advance(job, device, end)
+        device.jobs.append(job)
+        return device
+
+    def _requeue(self, jobs):
+        """Route jobs again, in order and before anything submit() is waiting to route"""
+        with self._condition:
+            self.requeued.extendleft(reversed(jobs))
+            self._condition.notify_all()
+            while True:
+                self._condition.wait_for(lambda: not self.requeued or not self._placing
+                                         and (self._route() is not None or not self._healthy()))
+                if not self.requeued:
+                    return
+                job = self.requeued.popleft()
+                try:
+                    self._place(job)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Error compiling G-code: {e}")
+                    self.processor.job_done()
+                self._condition.notify_all()
+
+    def _compile(self, job, device, cursor, position_initialized):
+        """Compile job for device starting at cursor; returns the cursor after it"""
+        processor = self.processor
+        with self._compile_lock:
+            processor.current_x, processor.current_y, processor.current_page = cursor
+            processor.position_initialized = position_initialized
+            with processor.instrumentation.span("compile", job.batch_id, device=device.name):
+                processor.compile_job(job)
+            job.compiled = time.monotonic()
+            return processor.current_x, processor.current_y, processor.current_page
+
+    def _advance(self, job, device, cursor):
+        """Move device's cursor to cursor, the end of job, with the condition held"""
+        processor = self.processor
+        device.cursor = cursor
+        device.position_initialized = True
+        device.pages = device.cursor[2] + 1
+        device.page_lines = round((self.start_position[1] - device.cursor[1]) / processor.line_spacing) + 1
+        logger.info(f"Batch {job.batch_id} -> {device.name} (page {device.pages}, line {device.page_lines}, "
+                    f"{device.backlog() + (job.plotting_time or 0.0):.1f} s queued)")
+        if device.page_lines >= self.lines_per_page:
+            logger.info(f"{device.name}: page {device.pages} full, next batch starts a new sheet")
+            self._new_page(device)
+
+    def _new_page(self, device):
+        """Close device's page: the next batch routed to it starts a new sheet"""
+        geometry = self.processor.page_geometry()
+        if geometry.lines is None:
+            # Text runs on down the paper, so there are no page breaks to stop at
+            device.cursor = self.start_position + (device.cursor[2] + 1,)
+        else:
+            # The end of the page's last line: the layout takes the next batch
+            # over to a new page and stops for the paper change (see page_break)
+            bottom_line = geometry.top - (geometry.lines - 1) * geometry.line_spacing
+            device.cursor = (geometry.right, bottom_line, device.cursor[2])
+        device.page_lines = 0
+        if self.page_device is device:
+            self.page_device = None
+
+    def _run_device(self, device):
+        processor = self.processor
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: device.jobs or self._finished())
+                if not device.jobs:
+                    return
+                job = device.jobs.popleft()
+                device.current, device.started, device.state = job, time.monotonic(), BUSY
+                self._condition.notify_all()
+            processor.instrumentation.record("send_queue", time.monotonic() - job.compiled, job.batch_id,
+                                             device=device.name)
+            processor._pen_on_paper(job)
+            try:
+                with processor.instrumentation.span("plot", job.batch_id, device=device.name,
+                                                    estimated=round(job.plotting_time or 0.0, 3)):
+                    success = device.plot(job, processor.pause_handler(job, device.name))
+                error = None if success else "plot failed"
+            except (GrblError, OSError) as e:
+                error = e
+            if error is None:
+                processor._plot_finished(job)
+                processor.job_done()
+                with self._condition:
+                    device.current, device.state = None, IDLE
+                    device.plotted += 1
+                    self._condition.notify_all()
+                continue
+            self._fail(device, job, error)
+            return
+
+    def _fail(self, device, job, error):
+        """Take device out of service and route its jobs again"""
+        logger.error(f"{device.name} failed on batch {job.batch_id}: {error}")
+        device.close()
+        with self._condition:
+            device.state, device.error = ERROR, error
+            requeued = [job] + list(device.jobs)
+            device.jobs.clear()
+            self._new_page(device)
+            device.position_initialized = False
+            self._condition.notify_all()
+        logger.warning(f"Requeuing {len(requeued)} batches from {device.name}")
+        self._requeue(requeued)
+        with self._condition:
+            device.current = None  # Only now, so the other devices wait for the requeued jobs
+            self._condition.notify_all()
+
+    def reset(self, device):
+        """Put a failed device back into service and give it any waiting jobs"""
+        with self._condition:
+            device.state, device.error = IDLE, None
+            waiting = list(self.unassigned)
+            self.unassigned.clear()
+            self._condition.notify_all()
+        self._start_device(device)
+        self._requeue(waiting)
+
+    def status(self):
+        """One dict per device for logs and dashboards"""
+        now = time.monotonic()
+        with self._condition:
+            return [{"name": device.name, "state": device.state, "queued": len(device.jobs),
+                     "backlog": round(device.backlog(now), 1), "plotted": device.plotted,
+                     "pages": device.pages, "page_lines": device.page_lines, "error": str(device.error or "")}
+                    for device in self.devices]
+
+    def close(self, wait=True):
+        """Stop taking batches; with wait, return once every queued job is plotted"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        for device in self.devices:
+            device.close()
+        for job in self.unassigned:
+            logger.error(f"Batch {job.batch_id} was never plotted: no healthy plotter")
+            self.processor.job_done()
+        for status in self.status():
+            logger.info(f"{status['name']}: {status['state']}, {status['plotted']} batches on "
+                        f"{status['pages']} pages {status['error']}".rstrip())
@@ -0,0 +1,469 @@
+"""
+Offline font compiler and the compiled font format read at runtime.
+
+    python font_compiler.py -o builtin.font                  # glyphs.GLYPHS
+    python font_compiler.py --hershey futural.jhf -o futural.font
+    python font_compiler.py --svg EMSReadability.svg -o ems.font
+
+Sources are the built-in table, Hershey fonts (.jhf) and SVG fonts with
+single-stroke <glyph> paths.  Every glyph is optimized on its own:
+
+  * segments are split where another stroke touches them and drawn once, so
+    retraced lines (the spine of 'E') are not drawn twice;
+  * the segments are joined into the fewest pen-down runs, one per pair of
+    odd-degree points (an Euler path per connected part), except where
+    drawing a short line again is quicker than lifting the pen;
+  * the runs are ordered and turned round to start near the left of the cell
+    and to keep pen-up moves short.
+
+The shapes stay the same; only the order of drawing changes.  The result is
+written as a binary file of flat arrays (coordinates as int16 in 1/10000 of
+the cell) that open_font() memory-maps: nothing is parsed on load, and a
+glyph is only read from disk when it is used.  Pass the file to
+SpeechToGCodeProcessor.font (or --font) to draw with it.
+"""
+import argparse
+import hashlib
+import heapq
+import math
+import mmap
+import re
+import struct
+import sys
+import xml.etree.ElementTree as ET
+from collections.abc import Mapping
+from functools import lru_cache
+
+import numpy as np
+
+MAGIC = b"SGFN"
+VERSION = 1
+SCALE = 10000  # Stored units per unit of the character cell
+# Lifting and lowering the pen takes two servo dwells (1 s by default), in
+# which a 5 mm cell at 500 mm/min draws about 1.5 cells of line
+LIFT_COST = 1.5
+_HEADER = struct.Struct("<4sHHII")  # magic, version, reserved, glyphs, vertices
+
+
+# Sources: every loader returns {char: [stroke, ...]} with each stroke a list
+# of (x, y) points in unit cell coordinates (x 0..1, y 0..1 from baseline to
+# cap height), the convention of glyphs.GLYPHS
+
+def table_strokes(glyphs):
+    """Strokes of a GLYPHS-style table of (x, y, pen_down) points"""
+    font = {}
+    for char, path in glyphs.items():
+        strokes = []
+        for x, y, pen_down in path:
+            if pen_down and strokes:
+                strokes[-1].append((x, y))
+            else:
+                strokes.append([(x, y)])
+        font[char] = strokes
+    return font
+
+
+def load_hershey(path, first_code=32, baseline=9, cap_height=21, width=None):
+    """
+    A Hershey font in .jhf form, its glyphs numbered from first_code (ASCII
+    space for the usual fonts).  y runs down from cap_height above baseline;
+    each glyph is centred in the cell, width font units wide (default two
+    thirds of the cap height, the cell's aspect ratio).
+    """
+    width = width or cap_height * 2 / 3
+    with open(path) as f:
+        data = f.read().replace("\r", "").replace("\n", "")
+    font = {}
+    position = 0
+    code = first_code
+    while position + 8 <= len(data):
+        count = int(data[position + 5:position + 8])
+        pairs = data[position + 8:position + 8 + 2 * count]
+        position += 8 + 2 * count
+        left, right = ord(pairs[0]) - ord("R"), ord(pairs[1]) - ord("R")
+        center = (left + right) / 2
+        strokes = [[]]
+        for i in range(2, len(pairs), 2):
+            if pairs[i:i + 2] == " R":
+                strokes.append([])
+                continue
+            x, y = ord(pairs[i]) - ord("R"), ord(pairs[i + 1]) - ord("R")
+            strokes[-1].append((0.5 + (x - center) / width, (baseline - y) / cap_height))
+        font[chr(code)] = [stroke for stroke in strokes if stroke]
+        code += 1
+    return font
+
+
+_PATH_TOKEN = re.compile(r"[MmLlHhVvZzCcQq]|[-+]?(?:\d*\.\d+|\d+\.?)(?:[eE][-+]?\d+)?")
+
+
+def _path_strokes(d, curve_steps=8):
+    """Polylines of an SVG path (M, L, H, V, Z, C and Q; curves are cut into curve_steps lines)"""
+    tokens = _PATH_TOKEN.findall(d)
+    strokes = []
+    x = y = 0.0
+    command = None
+    i = 0
+
+    def numbers(n):
+        nonlocal i
+        values = [float(value) for value in tokens[i:i + n]]
+        i += n
+        return values
+
+    while i < len(tokens):
+        if tokens[i].isalpha():
+            command = tokens[i]
+            i += 1
+            if command in "Zz":
+                if strokes and len(strokes[-1]) > 1:
+                    strokes[-1].append(strokes[-1][0])
+                    x, y = strokes[-1][0]
+                continue
+        relative = command.islower()
+        kind = command.upper()
+        if kind == "M":
+            dx, dy = numbers(2)
+            x, y = (x + dx, y + dy) if relative else (dx, dy)
+            strokes.append([(x, y)])
+            command = "l" if relative else "L"  # Further pairs are lines
+            continue
+        if kind == "H":
+            (value,) = numbers(1)
+            x = x + value if relative else value
+            points = [(x, y)]
+        elif kind == "V":
+            (value,) = numbers(1)
+            y = y + value if relative else value
+            points = [(x, y)]
+        elif kind == "L":
+            dx, dy = numbers(2)
+            x, y = (x + dx, y + dy) if relative else (dx, dy)
+            points = [(x, y)]
+        else:
+            values = numbers(6 if kind == "C" else 4)
+            if relative:
+                values = [value + (x if k % 2 == 0 else y) for k, value in enumerate(values)]
+            controls = [(x, y)] + list(zip(values[0::2], values[1::2]))
+            t = np.linspace(0, 1, curve_steps + 1)[1:, None]
+            if kind == "C":
+                p0, p1, p2, p3 = map(np.array, controls)
+                curve = (1 - t) ** 3 * p0 + 3 * (1 - t) ** 2 * t * p1 + 3 * (1 - t) * t ** 2 * p2 + t ** 3 * p3
+            else:
+                p0, p1, p2 = map(np.array, controls)
+                curve = (1 - t) ** 2 * p0 + 2 * (1 - t) * t * p1 + t ** 2 * p2
+            points = [tuple(point) for point in curve.tolist()]
+            x, y = points[-1]
+        if not strokes:
+            strokes.append([(0.0, 0.0)])
+        strokes[-1].extend(points)
+    return strokes
+
+
+def load_svg(path, cap_height=None, width=None):
+    """
+    An SVG font of single-stroke <glyph unicode=... d=...> paths (y up, as
+    in SVG fonts).  cap_height defaults to the font-face's cap-height, or
+    70% of units-per-em; glyphs are centred in the cell like Hershey ones.
+    """
+    root = ET.parse(path).getroot()
+    element = next((node for node in root.iter() if node.tag.rsplit("}", 1)[-1] == "font"), None)
+    if element is None:
+        raise ValueError(f"No <font> in {path}")
+    face = next((node for node in element.iter() if node.tag.rsplit("}", 1)[-1] == "font-face"), None)
+    face = face.attrib if face is not None else {}
+    cap_height = cap_height or float(face.get("cap-height") or 0.7 * float(face.get("units-per-em", 1000)))
+    width = width or cap_height * 2 / 3
+    default_advance = float(element.get("horiz-adv-x", width))
+    font = {}
+    for glyph in element.iter():
+        if glyph.tag.rsplit("}", 1)[-1] != "glyph" or len(glyph.get("unicode", "")) != 1:
+            continue
+        center = float(glyph.get("horiz-adv-x", default_advance)) / 2
+        font[glyph.get("unicode")] = [[(0.5 + (x - center) / width, y / cap_height) for x, y in stroke]
+                                      for stroke in _path_strokes(glyph.get("d", ""))]
+    return font
+
+
+# Per-glyph optimization
+
+def _key(point):
+    return (round(point[0], 6), round(point[1], 6))
+
+
+def _segments(strokes):
+    """Distinct segments between distinct points, split where another point lies on them"""
+    points = {}
+    segments = []
+    for stroke in strokes:
+        for point in stroke:
+            points.setdefault(_key(point), (float(point[0]), float(point[1])))
+        segments.extend((_key(a), _key(b)) for a, b in zip(stroke, stroke[1:]) if _key(a) != _key(b))
+    split = set()
+    for a, b in segments:
+        (ax, ay), (bx, by) = points[a], points[b]
+        length = math.hypot(bx - ax, by - ay)
+        inside = []
+        for key, (px, py) in points.items():
+            if key in (a, b):
+                continue
+            t = ((px - ax) * (bx - ax) + (py - ay) * (by - ay)) / length ** 2
+            if 0 < t < 1 and abs((px - ax) * (by - ay) - (py - ay) * (bx - ax)) / length < 1e-6:
+                inside.append((t, key))
+        chain = [a] + [key for _, key in sorted(inside)] + [b]
+        split.update(tuple(sorted(pair)) for pair in zip(chain, chain[1:]))
+    return points, sorted(split)
+
+
+def _shortest_paths(source, adjacency, points):
+    """Dijkstra along the glyph's lines: {vertex: (distance, previous vertex)}"""
+    best = {source: (0.0, None)}
+    queue = [(0.0, source)]
+    while queue:
+        distance, vertex = heapq.heappop(queue)
+        if distance > best[vertex][0]:
+            continue
+        for following, _ in adjacency[vertex]:
+            candidate = distance + math.dist(points[vertex], points[following])
+            if following not in best or candidate < best[following][0]:
+                best[following] = (candidate, vertex)
+                heapq.heappush(queue, (candidate, following))
+    return best
+
+
+def _euler_runs(vertices, edges, points, entry, lift_cost):
+    """
+    Cover one connected set of edges with few pen-down runs.  Odd points are
+    paired up until an Euler path exists: a pair is joined by drawing the
+    lines between them again when that is shorter than lift_cost, and by a
+    pen-up move otherwise.  The path is cut at the pen-up moves.
+    """
+    adjacency = {vertex: [] for vertex in vertices}
+    for index, (a, b) in enumerate(edges):
+        adjacency[a].append((b, index))
+        adjacency[b].append((a, index))
+    odd = [vertex for vertex in vertices if len(adjacency[vertex]) % 2]
+    pen_up = set()
+    edges = list(edges)
+
+    def add(a, b, lifted):
+        if lifted:
+            pen_up.add(len(edges))
+        adjacency[a].append((b, len(edges)))
+        adjacency[b].append((a, len(edges)))
+        edges.append((a, b))
+
+    if odd:
+        # Keep the odd point nearest the entry as the start of the path
+        odd.sort(key=lambda vertex: math.dist(points[vertex], entry))
+        start, rest = odd[0], odd[1:]
+        while len(rest) > 1:
+            a = rest.pop()
+            paths = _shortest_paths(a, adjacency, points)
+            b = min(rest, key=lambda vertex: min(paths[vertex][0], lift_cost + math.dist(points[a], points[vertex])))
+            rest.remove(b)
+            if paths[b][0] <= lift_cost:
+                vertex = b
+                while vertex != a:
+                    add(paths[vertex][1], vertex, False)
+                    vertex = paths[vertex][1]
+            else:
+                add(a, b, True)
+    else:
+        start = min(vertices, key=lambda vertex: math.dist(points[vertex], entry))
+
+    # Hierholzer's algorithm
+    used = [False] * len(edges)
+    stack = [(start, None)]
+    path = []
+    while stack:
+        vertex, via = stack[-1]
+        while adjacency[vertex] and used[adjacency[vertex][-1][1]]:
+            adjacency[vertex].pop()
+        if adjacency[vertex]:
+            following, index = adjacency[vertex].pop()
+            used[index] = True
+            stack.append((following, index))
+        else:
+            path.append(stack.pop())
+    path.reverse()
+
+    runs = [[path[0][0]]]
+    for vertex, via in path[1:]:
+        if via in pen_up:
+            runs.append([vertex])
+        else:
+            runs[-1].append(vertex)
+    return [run for run in runs if len(run) > 1]
+
+
+def _straighten(run):
+    """Drop points in the middle of straight lines"""
+    kept = [run[0]]
+    for point, following in zip(run[1:-1], run[2:]):
+        ax, ay = kept[-1]
+        cross = (point[0] - ax) * (following[1] - ay) - (point[1] - ay) * (following[0] - ax)
+        dot = (point[0] - ax) * (following[0] - point[0]) + (point[1] - ay) * (following[1] - point[1])
+        if abs(cross) > 1e-9 or dot <= 0:
+            kept.append(point)
+    kept.append(run[-1])
+    return kept
+
+
+def optimize_glyph(strokes, entry=(0.0, 0.5), lift_cost=LIFT_COST):
+    """
+    The same lines as strokes, in as few pen-down runs as pay off (drawing a
+    line twice instead of lifting the pen when that is shorter than
+    lift_cost cells), ordered from the run nearest entry to keep pen-up
+    moves short
+    """
+    points, segments = _segments(strokes)
+    if not segments:
+        return [list(stroke) for stroke in strokes if len(stroke) > 1]
+    # Connected parts
+    parent = {}
+
+    def find(vertex):
+        while parent.setdefault(vertex, vertex) != vertex:
+            parent[vertex] = parent[parent[vertex]]
+            vertex = parent[vertex]
+        return vertex
+
+    for a, b in segments:
+        parent[find(a)] = find(b)
+    parts = {}
+    for a, b in segments:
+        parts.setdefault(find(a), []).append((a, b))
+
+    runs = []
+    for edges in parts.values():
+        vertices = sorted({vertex for edge in edges for vertex in edge})
+        runs.extend(_euler_runs(vertices, edges, points, entry, lift_cost))
+
+    # Nearest run next, entered from whichever end is closer
+    ordered = []
+    position = entry
+    while runs:
+        best = min(((math.dist(position, points[run[end]]), index, end) for index, run in enumerate(runs)
+                    for end in (0, -1)))
+        run = runs.pop(best[1])
+        if best[2] == -1:
+            run = run[::-1]
+        ordered.append(_straighten([points[vertex] for vertex in run]))
+        position = ordered[-1][-1]
+    return ordered
+
+
+def pen_lifts(strokes):
+    return sum(1 for stroke in strokes if len(stroke) > 1)
+
+
+def compile_font(font, optimize=True, lift_cost=LIFT_COST):
+    """{char: [(x, y, pen_down), ...]} ready to write, a space included"""
+    compiled = {}
+    for char, strokes in font.items():
+        if optimize:
+            strokes = optimize_glyph(strokes, lift_cost=lift_cost)
+        path = [(x, y, i > 0) for stroke in strokes if len(stroke) > 1 for i, (x, y) in enumerate(stroke)]
+        compiled[char] = path or [(0, 0, False)]
+    compiled.setdefault(" ", [(0, 0, False)])
+    return compiled
+
+
+def write_font(path, glyphs):
+    """Write {char: [(x, y, pen_down), ...]} as a compiled font file"""
+    chars = sorted(glyphs, key=ord)
+    counts = [len(glyphs[char]) for char in chars]
+    points = [point for char in chars for point in glyphs[char]]
+    coordinates = np.rint(np.array([(x, y) for x, y, _ in points], dtype=float).reshape(-1, 2) * SCALE)
+    if np.abs(coordinates).max(initial=0) > np.iinfo(np.int16).max:
+        raise ValueError("Glyph coordinates must stay within 3.2 cells of the origin")
+    coordinates = coordinates.astype("<i2")
+    with open(path, "wb") as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, 0, len(chars), len(points)))
+        f.write(np.array([ord(char) for char in chars], dtype="<u4").tobytes())
+        f.write(np.concatenate([[0], np.cumsum(counts)]).astype("<u4").tobytes())
+        f.write(coordinates[:, 0].tobytes())
+        f.write(coordinates[:, 1].tobytes())
+        f.write(np.array([pen for _, _, pen in points], dtype=np.uint8).tobytes())
+
+
+class CompiledFont(Mapping):
+    """
+    A compiled font file, memory-mapped.  Maps characters to (x, y,
+    pen_down) tuples like glyphs.GLYPHS; arrays() gives the whole table
+    scaled to a cell for the layout.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, glyphs, vertices = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a compiled font (version {VERSION})")
+        offset = _HEADER.size
+        self.codes = np.frombuffer(self._map, dtype="<u4", count=glyphs, offset=offset)
+        offset += 4 * glyphs
+        self.offsets = np.frombuffer(self._map, dtype="<u4", count=glyphs + 1, offset=offset)
+        offset += 4 * (glyphs + 1)
+        self._x = np.frombuffer(self._map, dtype="<i2", count=vertices, offset=offset)
+        self._y = np.frombuffer(self._map, dtype="<i2", count=vertices, offset=offset + 2 * vertices)
+        self._pen = np.frombuffer(self._map, dtype=np.uint8, count=vertices, offset=offset + 4 * vertices)
+        self.digest = hashlib.sha256(self._map).hexdigest()  # Identifies the font in cache keys
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __iter__(self):
+        return map(chr, self.codes.tolist())
+
+    def __getitem__(self, char):
+        index = int(np.searchsorted(self.codes, ord(char)))
+        if index == len(self.codes) or self.codes[index] != ord(char):
+            raise KeyError(char)
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return tuple(zip((self._x[start:end] / SCALE).tolist(), (self._y[start:end] / SCALE).tolist(),
+                         self._pen[start:end].astype(bool).tolist()))
+
+    def arrays(self, char_width, char_height):
+        """(codes, vertex counts, x, y, pen) of every glyph in a char_width x char_height cell"""
+        return (self.codes, np.diff(self.offsets).astype(np.int64), self._x / SCALE * char_width,
+                self._y / SCALE * char_height, self._pen.astype(bool))
+
+
+@lru_cache(maxsize=8)
+def open_font(path):
+    """CompiledFont for path, opened once per process"""
+    return CompiledFont(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a single-stroke font for the plotter")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--hershey", metavar="JHF", help="Hershey font (.jhf); default: the built-in table")
+    source.add_argument("--svg", metavar="SVG", help="SVG font with single-stroke glyph paths")
+    parser.add_argument("-o", "--output", required=True, help="Compiled font file to write")
+    parser.add_argument("--first-code", type=int, default=32, help="Code point of a Hershey font's first glyph")
+    parser.add_argument("--no-optimize", action="store_true", help="Keep the strokes as they are")
+    parser.add_argument("--lift-cost", type=float, default=LIFT_COST,
+                        help="Cell widths of line worth drawing twice to save a pen lift")
+    args = parser.parse_args(argv)
+
+    if args.hershey:
+        font = load_hershey(args.hershey, args.first_code)
+    elif args.svg:
+        font = load_svg(args.svg)
+    else:
+        from glyphs import GLYPHS
+        font = table_strokes(GLYPHS)
+    compiled = compile_font(font, optimize=not args.no_optimize, lift_cost=args.lift_cost)
+    write_font(args.output, compiled)
+    before = sum(pen_lifts(strokes) for strokes in font.values())
+    after = sum(pen_lifts(table_strokes({char: path})[char]) for char, path in compiled.items())
+    print(f"{len(compiled)} glyphs, {before} -> {after} pen-down runs, written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Caches for repetitive dictation.
+
+JobCache keeps finished G-code files on disk under the SHA-256 of everything
+that determines them: the text, how it falls on the lines relative to the
+layout cursor, the glyph metrics, speeds, pen commands, emitter and machine
+model.  The cursor itself is not part of the key.  Saying the same thing again
+anywhere on the paper reuses the file, moved to the new cursor, instead of
+laying it out, optimizing and emitting it again, and the names can never
+collide.  Every job gets its own copy, so the least recently used files can
+be deleted once the cache holds more than max_files files or max_bytes bytes
+without pulling a file from under a queued job.
+
+FragmentCache is an in-memory LRU of compiled words: the strokes of a word in
+optimized order, relative to the word's origin, so the same word is laid out
+and optimized once and then moved to wherever the cursor is.
+
+Both count hits, misses and evictions.
+"""
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+
+from strokes import StrokeProgram
+
+logger = logging.getLogger(__name__)
+
+# Part of every job key; bump it when the G-code for the same settings changes
+FORMAT_VERSION = 2
+
+
+class LRUCache:
+    """A dict with a size limit that forgets the least recently used entries"""
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class FragmentCache(LRUCache):
+    """Compiled words, keyed by the word and the glyph metrics"""
+
+    def fragment(self, key, build):
+        """The cached StrokeProgram for key, or build() stored under it"""
+        program = self.get(key)
+        if program is None:
+            program = build()
+            self.put(key, program)
+        return program
+
+
+def place_fragments(fragments, origins, start):
+    """
+    One StrokeProgram from word fragments (relative to their origins) moved
+    to origins, an (n, 2) sequence of positions
+    """
+    fragments = list(fragments)
+    program = StrokeProgram.concatenate(fragments, start)
+    counts = [fragment.vertex_count for fragment in fragments]
+    program.vertices = program.vertices + np.repeat(np.asarray(origins, dtype=float).reshape(-1, 2), counts,
+                                                    axis=0)
+    return program
+
+
+class JobCache:
+    """Finished G-code files in directory, named by the hash of their settings"""
+
+    def __init__(self, directory="gcode_cache", max_files=500, max_bytes=256 * 1024 * 1024):
+        self.directory = directory
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = collections.OrderedDict()  # key -> metadata, least recently used first
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Index the files already in the directory, oldest first"""
+        found = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path) as f:
+                    metadata = json.load(f)
+                found.append((os.path.getmtime(metadata["path"]), name[:-5], metadata))
+            except (OSError, ValueError, KeyError):
+                continue
+        for _, key, metadata in sorted(found, key=lambda entry: entry[0]):
+            self._entries[key] = metadata
+
+    @staticmethod
+    def key(settings):
+        """Hex digest identifying a job; settings is a JSON-serializable dict"""
+        data = json.dumps({"version": FORMAT_VERSION, **settings}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+    def lookup(self, key):
+        """
+        Metadata ({"path", "start", "cursor", "plotting_time", "bytes"}) for
+        key, or None: the G-code file was compiled with the layout cursor at
+        start and left it at cursor
+        """
+        with self._lock:
+            metadata = self._entries.get(key)
+            if metadata is not None and not os.path.exists(metadata["path"]):
+                del self._entries[key]  # Deleted behind our back
+                metadata = None
+            if metadata is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        os.utime(metadata["path"])  # Keeps the order across restarts
+        return metadata
+
+    def store(self, key, gcode_file, **metadata):
+        """
+        Copy a freshly written G-code file into the cache under key and
+        return the copy's path; the job keeps gcode_file.  metadata must be
+        JSON-serializable.
+        """
+        path = os.path.join(self.directory, key + ".gcode")
+        shutil.copyfile(gcode_file, path)
+        metadata.update(path=path, bytes=os.path.getsize(path))
+        with open(os.path.join(self.directory, key + ".json"), "w") as f:
+            json.dump(metadata, f)
+        with self._lock:
+            self._entries[key] = metadata
+            self._entries.move_to_end(key)
+            self._evict()
+        return path
+
+    def _evict(self):
+        total = sum(metadata["bytes"] for metadata in self._entries.values())
+        while len(self._entries) > 1 and (len(self._entries) > self.max_files or total > self.max_bytes):
+            key, metadata = self._entries.popitem(last=False)
+            total -= metadata["bytes"]
+            self.evictions += 1
+            for path in (metadata["path"], os.path.join(self.directory, key + ".json")):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    logger.warning(f"Could not remove cached {path}: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        with self._lock:
+            size = sum(metadata["bytes"] for metadata in self._entries.values())
+            return {"entries": len(self._entries), "bytes": size, "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
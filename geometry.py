@@ -0,0 +1,253 @@
+"""
+Geometry pass over laid-out strokes: fewer, longer moves.
+
+Each stroke is simplified in three steps:
+
+1. points on a straight line between their neighbours are merged away,
+2. Douglas-Peucker drops points closer than tolerance to the simplified line,
+3. runs of three or more points that lie on a circle (within arc_tolerance,
+   chords included) become one circular arc, emitted as G2/G3.
+
+The drawing never moves more than the tolerances away from the original
+polyline.  Laid-out text repeats the same glyph strokes over and over, so
+the result for each stroke shape is cached and only the stroke's position
+changes.
+"""
+import math
+from functools import lru_cache
+
+import numpy as np
+
+from strokes import LINE, CLOCKWISE, COUNTERCLOCKWISE, StrokeProgram
+
+GRBL_ARC_TOLERANCE = 0.002  # GRBL $12, the chord error GRBL cuts arcs into lines with
+MAX_ARC_RADIUS = 1000.0  # Flatter "arcs" are left as lines
+
+
+def arc_sweep(start, end, center, clockwise):
+    """Signed angle (radians) from start to end around center; negative when clockwise"""
+    a0 = math.atan2(start[1] - center[1], start[0] - center[0])
+    a1 = math.atan2(end[1] - center[1], end[0] - center[0])
+    sweep = a1 - a0
+    if clockwise:
+        if sweep >= 0:
+            sweep -= 2 * math.pi
+    elif sweep <= 0:
+        sweep += 2 * math.pi
+    return sweep
+
+
+def arc_length(start, end, center, clockwise):
+    radius = math.hypot(start[0] - center[0], start[1] - center[1])
+    return abs(arc_sweep(start, end, center, clockwise)) * radius
+
+
+def arc_points(start, end, center, clockwise, tolerance=GRBL_ARC_TOLERANCE):
+    """
+    Points along an arc, excluding start and ending exactly at end, spaced
+    the way GRBL's mc_arc splits arcs into segments
+    """
+    radius = math.hypot(start[0] - center[0], start[1] - center[1])
+    sweep = arc_sweep(start, end, center, clockwise)
+    if radius <= tolerance:
+        return [end]
+    segments = int(abs(0.5 * sweep * radius) / math.sqrt(tolerance * (2 * radius - tolerance)))
+    a0 = math.atan2(start[1] - center[1], start[0] - center[0])
+    points = [(center[0] + radius * math.cos(a0 + sweep * k / segments),
+               center[1] + radius * math.sin(a0 + sweep * k / segments)) for k in range(1, segments)]
+    points.append(end)
+    return points
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def merge_collinear(points, tolerance=1e-9):
+    """Indices of the points to keep once straight-through and repeated points are merged"""
+    keep = [0]
+    for i in range(1, len(points) - 1):
+        a, b, c = points[keep[-1]], points[i], points[i + 1]
+        ab = (b[0] - a[0], b[1] - a[1])
+        bc = (c[0] - b[0], c[1] - b[1])
+        if ab == (0, 0):
+            continue  # Repeated point
+        ac = math.hypot(c[0] - a[0], c[1] - a[1])
+        straight = abs(_cross(a, b, c)) <= tolerance * max(ac, 1.0)
+        if straight and ab[0] * bc[0] + ab[1] * bc[1] >= 0:
+            continue
+        keep.append(i)
+    if len(points) > 1:
+        keep.append(len(points) - 1)
+    return keep
+
+
+def _line_distance(point, a, b):
+    length = math.hypot(b[0] - a[0], b[1] - a[1])
+    if length == 0:
+        return math.hypot(point[0] - a[0], point[1] - a[1])
+    # Beyond either end the distance is to the end point
+    t = ((point[0] - a[0]) * (b[0] - a[0]) + (point[1] - a[1]) * (b[1] - a[1])) / (length * length)
+    if t < 0:
+        return math.hypot(point[0] - a[0], point[1] - a[1])
+    if t > 1:
+        return math.hypot(point[0] - b[0], point[1] - b[1])
+    return abs(_cross(a, b, point)) / length
+
+
+def douglas_peucker(points, tolerance):
+    """Indices of the points Douglas-Peucker keeps at tolerance"""
+    count = len(points)
+    if count < 3:
+        return list(range(count))
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    pending = [(0, count - 1)]
+    while pending:
+        first, last = pending.pop()
+        worst, worst_distance = None, tolerance
+        for i in range(first + 1, last):
+            distance = _line_distance(points[i], points[first], points[last])
+            if distance > worst_distance:
+                worst, worst_distance = i, distance
+        if worst is not None:
+            keep[worst] = True
+            pending.append((first, worst))
+            pending.append((worst, last))
+    return [i for i in range(count) if keep[i]]
+
+
+def circle_through(a, b, c):
+    """Center of the circle through three points, or None if they are (nearly) collinear"""
+    d = 2 * _cross(a, b, c)
+    if abs(d) < 1e-12:
+        return None
+    a2 = a[0] ** 2 + a[1] ** 2
+    b2 = b[0] ** 2 + b[1] ** 2
+    c2 = c[0] ** 2 + c[1] ** 2
+    x = (a2 * (b[1] - c[1]) + b2 * (c[1] - a[1]) + c2 * (a[1] - b[1])) / d
+    y = (a2 * (c[0] - b[0]) + b2 * (a[0] - c[0]) + c2 * (b[0] - a[0])) / d
+    return x, y
+
+
+def _fits_arc(run, tolerance):
+    """(center, clockwise) of an arc through run within tolerance, or None"""
+    center = circle_through(run[0], run[len(run) // 2], run[-1])
+    if center is None:
+        return None
+    radius = math.hypot(run[0][0] - center[0], run[0][1] - center[1])
+    if radius > MAX_ARC_RADIUS:
+        return None
+    turn = _cross(run[0], run[1], run[2])
+    clockwise = turn < 0
+    sweep = 0.0
+    for i in range(1, len(run)):
+        if abs(math.hypot(run[i][0] - center[0], run[i][1] - center[1]) - radius) > tolerance:
+            return None
+        if i + 1 < len(run) and _cross(run[i - 1], run[i], run[i + 1]) * turn <= 0:
+            return None  # Bends the other way, or straight
+        # Each chord must stay within tolerance of the arc (its sagitta)
+        half_chord = math.hypot(run[i][0] - run[i - 1][0], run[i][1] - run[i - 1][1]) / 2
+        if half_chord > radius or radius - math.sqrt(radius * radius - half_chord * half_chord) > tolerance:
+            return None
+        step = arc_sweep(run[i - 1], run[i], center, clockwise)
+        if abs(step) > math.pi:
+            return None  # Goes the long way round
+        sweep += step
+    if abs(sweep) >= 2 * math.pi - 1e-6:
+        return None
+    return center, clockwise
+
+
+def fit_arcs(points, tolerance, min_points=3):
+    """
+    Greedily replace runs of points by arcs.  Returns (indices kept,
+    motion code of the move ending at each, arc center or None).
+    """
+    kept, motions, centers = [0], [LINE], [None]
+    i = 0
+    last = len(points) - 1
+    while i < last:
+        best = None
+        j = i + min_points - 1
+        while j <= last:
+            fit = _fits_arc(points[i:j + 1], tolerance)
+            if fit is None:
+                break
+            best = (j, fit)
+            j += 1
+        if best:
+            j, (center, clockwise) = best
+            kept.append(j)
+            motions.append(CLOCKWISE if clockwise else COUNTERCLOCKWISE)
+            centers.append(center)
+            i = j
+        else:
+            i += 1
+            kept.append(i)
+            motions.append(LINE)
+            centers.append(None)
+    return kept, motions, centers
+
+
+@lru_cache(maxsize=4096)
+def _simplify_stroke(points, tolerance, arc_tolerance):
+    """Simplify one stroke given relative to its first point; cached by shape"""
+    kept = merge_collinear(points)
+    if tolerance > 0:
+        kept = [kept[i] for i in douglas_peucker([points[i] for i in kept], tolerance)]
+    if arc_tolerance <= 0:
+        return tuple(kept), (LINE,) * len(kept), (None,) * len(kept)
+    arc_kept, motions, centers = fit_arcs([points[i] for i in kept], arc_tolerance)
+    return tuple(kept[i] for i in arc_kept), tuple(motions), tuple(centers)
+
+
+class GeometryReport:
+    """What the geometry pass saved; callers that time the programs fill in the times"""
+
+    def __init__(self, vertices_before=0, vertices_after=0, arcs=0, time_before=0.0, time_after=0.0):
+        self.vertices_before = vertices_before  # One G-code move per vertex
+        self.vertices_after = vertices_after
+        self.arcs = arcs
+        self.time_before = time_before  # Estimated seconds
+        self.time_after = time_after
+
+    def __iadd__(self, other):
+        self.vertices_before += other.vertices_before
+        self.vertices_after += other.vertices_after
+        self.arcs += other.arcs
+        self.time_before += other.time_before
+        self.time_after += other.time_after
+        return self
+
+
+def simplify_program(program, tolerance=0.05, arc_tolerance=0.5):
+    """
+    Run the geometry pass over a line-only StrokeProgram.  tolerance is the
+    Douglas-Peucker distance and arc_tolerance how far an arc may stray from
+    the polyline it replaces (both in mm; 0 turns the step off).  Returns
+    the new program and a GeometryReport.
+    """
+    indices, motions, centers = [], [], []
+    for start, end in zip(program.stroke_offsets[:-1].tolist(), program.stroke_offsets[1:].tolist()):
+        vertices = program.vertices[start:end].tolist()
+        x0, y0 = vertices[0]
+        relative = tuple((x - x0, y - y0) for x, y in vertices)
+        kept, stroke_motions, stroke_centers = _simplify_stroke(relative, tolerance, arc_tolerance)
+        indices.extend(start + i for i in kept)
+        motions.extend(stroke_motions)
+        centers.extend((x0 + c[0], y0 + c[1]) if c else (np.nan, np.nan) for c in stroke_centers)
+
+    lengths = np.diff(program.stroke_offsets)
+    report = GeometryReport(program.vertex_count, len(indices))
+    if not indices:
+        return program, report
+    motions = np.array(motions, dtype=np.int8)
+    report.arcs = int((motions != LINE).sum())
+    # Each stroke keeps its first point, so only the counts shrink
+    new_lengths = np.bincount(np.repeat(np.arange(len(lengths)), lengths)[indices], minlength=len(lengths))
+    offsets = np.concatenate([[0], np.cumsum(new_lengths)])
+    simplified = StrokeProgram(program.vertices[indices], offsets, program.start,
+                               motions=motions if report.arcs else None,
+                               centers=np.array(centers, dtype=float) if report.arcs else None)
+    return simplified, report
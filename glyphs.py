@@ -0,0 +1,338 @@
+"""
+Single-stroke glyph table used by the text-to-G-code converter.
+
+Every glyph is a list of (x, y, pen_down) points in unit coordinates: x runs
+0..1 across the character cell and y runs 0..1 from baseline to cap height
+(descenders go below 0).  A point with pen_down False is a pen-up move to the
+start of a new stroke; a point with pen_down True draws a line to it.
+"""
+from functools import lru_cache
+
+# Comprehensive font dictionary for all uppercase letters, numbers, and common punctuation
+GLYPHS = {
+    'A': [(0, 0, False), (0, 1, True), (1, 1, True),
+         (1, 0, True), (1, 0.5, False), (0, 0.5, True)],
+
+    'B': [(0, 0, False), (0, 1, True), (0.8, 1, True),
+         (1, 0.8, True), (1, 0.6, True),
+         (0.8, 0.5, True), (0, 0.5, True), (0.8, 0.5, False),
+         (1, 0.4, True), (1, 0.2, True),
+         (0.8, 0, True), (0, 0, True)],
+
+    'C': [(1, 0.8, False), (0.8, 1, True),
+         (0.2, 1, True), (0, 0.8, True),
+         (0, 0.2, True), (0.2, 0, True),
+         (0.8, 0, True), (1, 0.2, True)],
+
+    'D': [(0, 0, False), (0, 1, True), (0.8, 1, True),
+         (1, 0.8, True), (1, 0.2, True),
+         (0.8, 0, True), (0, 0, True)],
+
+    'E': [(1, 0, False), (0, 0, True), (0, 1, True),
+         (1, 1, True), (0, 1, False),
+         (0, 0.5, True), (0.8, 0.5, True)],
+
+    'F': [(0, 0, False), (0, 1, True), (1, 1, True),
+         (0, 1, False), (0, 0.5, True), (0.8, 0.5, True)],
+
+    'G': [(1, 0.8, False), (0.8, 1, True),
+         (0.2, 1, True), (0, 0.8, True),
+         (0, 0.2, True), (0.2, 0, True),
+         (0.8, 0, True), (1, 0.2, True),
+         (1, 0.5, True), (0.5, 0.5, True)],
+
+    'H': [(0, 0, False), (0, 1, True), (0, 0.5, False),
+         (1, 0.5, True), (1, 1, False),
+         (1, 0, True)],
+
+    'I': [(0.2, 0, False), (0.8, 0, True),
+         (0.5, 0, False), (0.5, 1, True),
+         (0.2, 1, False), (0.8, 1, True)],
+
+    'J': [(0.8, 1, False), (0.8, 0.2, True),
+         (0.6, 0, True), (0.2, 0, True),
+         (0, 0.2, True)],
+
+    'K': [(0, 0, False), (0, 1, True), (0, 0.5, False),
+         (1, 1, True), (0, 0.5, False),
+         (1, 0, True)],
+
+    'L': [(0, 1, False), (0, 0, True), (1, 0, True)],
+
+    'M': [(0, 0, False), (0, 1, True), (0.5, 0.6, True),
+         (1, 1, True), (1, 0, True)],
+
+    'N': [(0, 0, False), (0, 1, True), (1, 0, True),
+         (1, 1, True)],
+
+    'O': [(0, 0.2, False), (0, 0.8, True),
+         (0.2, 1, True), (0.8, 1, True),
+         (1, 0.8, True), (1, 0.2, True),
+         (0.8, 0, True), (0.2, 0, True),
+         (0, 0.2, True)],
+
+    'P': [(0, 0, False), (0, 1, True), (0.8, 1, True),
+         (1, 0.8, True), (1, 0.6, True),
+         (0.8, 0.5, True), (0, 0.5, True)],
+
+    'Q': [(0, 0.2, False), (0, 0.8, True),
+         (0.2, 1, True), (0.8, 1, True),
+         (1, 0.8, True), (1, 0.2, True),
+         (0.8, 0, True), (0.2, 0, True),
+         (0, 0.2, True), (0.5, 0.3, False),
+         (1, 0, True)],
+
+    'R': [(0, 0, False), (0, 1, True), (0.8, 1, True),
+         (1, 0.8, True), (1, 0.6, True),
+         (0.8, 0.5, True), (0, 0.5, True),
+         (0.4, 0.5, False), (1, 0, True)],
+
+    'S': [(1, 0.8, False), (0.8, 1, True),
+         (0.2, 1, True), (0, 0.8, True),
+         (0, 0.6, True), (0.2, 0.5, True),
+         (0.8, 0.5, True), (1, 0.4, True),
+         (1, 0.2, True), (0.8, 0, True),
+         (0.2, 0, True), (0, 0.2, True)],
+
+    'T': [(0, 1, False), (1, 1, True),
+         (0.5, 1, False), (0.5, 0, True)],
+
+    'U': [(0, 1, False), (0, 0.2, True),
+         (0.2, 0, True), (0.8, 0, True),
+         (1, 0.2, True), (1, 1, True)],
+
+    'V': [(0, 1, False), (0.5, 0, True), (1, 1, True)],
+
+    'W': [(0, 1, False), (0.2, 0, True),
+         (0.5, 0.4, True), (0.8, 0, True),
+         (1, 1, True)],
+
+    'X': [(0, 1, False), (1, 0, True),
+         (0.5, 0.5, False), (0, 0, True),
+         (1, 1, True)],
+
+    'Y': [(0, 1, False), (0.5, 0.5, True),
+         (1, 1, True), (0.5, 0.5, False),
+         (0.5, 0, True)],
+
+    'Z': [(0, 1, False), (1, 1, True),
+         (0, 0, True), (1, 0, True)],
+
+    # Lowercase letters
+    'a': [(1, 0.3, False), (1, 0, True),
+          (0.2, 0, True), (0, 0.2, True),
+          (0, 0.5, True), (0.2, 0.7, True),
+          (1, 0.7, True)],
+
+    'b': [(0, 0, False), (0, 1, True),
+          (0, 0.4, False), (0.8, 0.4, True),
+          (1, 0.3, True), (1, 0.1, True),
+          (0.8, 0, True), (0, 0, True)],
+
+    'c': [(1, 0.6, False), (0.8, 0.7, True),
+          (0.2, 0.7, True), (0, 0.5, True),
+          (0, 0.2, True), (0.2, 0, True),
+          (0.8, 0, True), (1, 0.1, True)],
+
+    'd': [(1, 0, False), (1, 1, True),
+          (1, 0.4, False), (0.2, 0.4, True),
+          (0, 0.3, True), (0, 0.1, True),
+          (0.2, 0, True), (1, 0, True)],
+
+    'e': [(0, 0.3, False), (1, 0.3, True),
+          (1, 0.5, True), (0.2, 0.7, True),
+          (0, 0.5, True), (0, 0.2, True),
+          (0.2, 0, True), (0.8, 0, True)],
+
+    'f': [(1, 1, False), (0.5, 1, True),
+          (0.3, 0.9, True), (0.3, 0, True),
+          (0.3, 0.5, False), (0, 0.5, True)],
+
+    'g': [(1, 0.7, False), (1, -0.2, True),
+          (0.7, -0.3, True), (0.2, -0.3, True),
+          (0, -0.2, True), (1, -0.2, False),
+          (1, 0.7, True), (0.2, 0.7, True),
+          (0, 0.5, True), (0, 0.2, True),
+          (0.2, 0, True), (1, 0, True)],
+
+    'h': [(0, 0, False), (0, 1, True),
+          (0, 0.5, False), (0.7, 0.5, True),
+          (1, 0.3, True), (1, 0, True)],
+
+    'i': [(0.5, 0.7, False), (0.5, 0, True),
+          (0.5, 0.9, False), (0.5, 1, True)],
+
+    'j': [(0.7, 0.7, False), (0.7, -0.2, True),
+          (0.5, -0.3, True), (0.2, -0.3, True),
+          (0, -0.2, True), (0.7, 0.9, False),
+          (0.7, 1, True)],
+
+    'k': [(0, 0, False), (0, 1, True),
+          (0, 0.3, False), (1, 0.7, True),
+          (0, 0.3, False), (1, 0, True)],
+
+    'l': [(0.3, 1, False), (0.3, 0, True),
+          (0.7, 0, True)],
+
+    'm': [(0, 0, False), (0, 0.7, True),
+          (0.3, 0.7, True), (0.5, 0.5, True),
+          (0.5, 0, True), (0.5, 0.5, False),
+          (0.7, 0.7, True), (1, 0.5, True),
+          (1, 0, True)],
+
+    'n': [(0, 0, False), (0, 0.7, True),
+          (0.7, 0.7, True), (1, 0.5, True),
+          (1, 0, True)],
+
+    'o': [(0, 0.2, False), (0, 0.5, True),
+          (0.2, 0.7, True), (0.8, 0.7, True),
+          (1, 0.5, True), (1, 0.2, True),
+          (0.8, 0, True), (0.2, 0, True),
+          (0, 0.2, True)],
+
+    'p': [(0, -0.3, False), (0, 0.7, True),
+          (0.8, 0.7, True), (1, 0.5, True),
+          (1, 0.2, True), (0.8, 0, True),
+          (0, 0, True)],
+
+    'q': [(1, -0.3, False), (1, 0.7, True),
+          (0.2, 0.7, True), (0, 0.5, True),
+          (0, 0.2, True), (0.2, 0, True),
+          (1, 0, True)],
+
+    'r': [(0, 0, False), (0, 0.7, True),
+          (0.2, 0.7, True), (0.8, 0.5, True),
+          (1, 0.7, True)],
+
+    's': [(1, 0.6, False), (0.8, 0.7, True),
+          (0.2, 0.7, True), (0, 0.6, True),
+          (0.2, 0.4, True), (0.8, 0.3, True),
+          (1, 0.1, True), (0.8, 0, True),
+          (0.2, 0, True), (0, 0.1, True)],
+
+    't': [(0.3, 1, False), (0.3, 0.1, True),
+          (0.5, 0, True), (0.8, 0, True),
+          (0.3, 0.7, False), (0, 0.7, True),
+          (0.7, 0.7, True)],
+
+    'u': [(0, 0.7, False), (0, 0.1, True),
+          (0.2, 0, True), (0.8, 0, True),
+          (1, 0.1, True), (1, 0.7, True)],
+
+    'v': [(0, 0.7, False), (0.5, 0, True),
+          (1, 0.7, True)],
+
+    'w': [(0, 0.7, False), (0.2, 0, True),
+          (0.5, 0.4, True), (0.8, 0, True),
+          (1, 0.7, True)],
+
+    'x': [(0, 0.7, False), (1, 0, True),
+          (0.5, 0.35, False), (0, 0, True),
+          (1, 0.7, True)],
+
+    'y': [(0, 0.7, False), (0, 0.3, True),
+          (0.5, 0, True), (1, 0.3, True),
+          (1, 0.7, True), (1, -0.2, True),
+          (0.8, -0.3, True), (0.2, -0.3, True),
+          (0, -0.2, True)],
+
+    'z': [(0, 0.7, False), (1, 0.7, True),
+          (0, 0, True), (1, 0, True)],
+
+    '0': [(0, 0.2, False), (0, 0.8, True),
+         (0.2, 1, True), (0.8, 1, True),
+         (1, 0.8, True), (1, 0.2, True),
+         (0.8, 0, True), (0.2, 0, True),
+         (0, 0.2, True)],
+
+    '1': [(0.2, 0.8, False), (0.5, 1, True),
+         (0.5, 0, True)],
+
+    '2': [(0, 0.8, False), (0.2, 1, True),
+         (0.8, 1, True), (1, 0.8, True),
+         (1, 0.6, True), (0, 0, True),
+         (1, 0, True)],
+
+    '3': [(0, 0.8, False), (0.2, 1, True),
+         (0.8, 1, True), (1, 0.8, True),
+         (1, 0.6, True), (0.2, 0.5, True),
+         (1, 0.4, True), (1, 0.2, True),
+         (0.8, 0, True), (0.2, 0, True),
+         (0, 0.2, True)],
+
+    '4': [(0.8, 0, False), (0.8, 1, True),
+         (0, 0.4, True), (1, 0.4, True)],
+
+    '5': [(1, 1, False), (0, 1, True),
+         (0, 0.5, True), (0.8, 0.5, True),
+         (1, 0.4, True), (1, 0.1, True),
+         (0.2, 0, True), (0, 0.1, True)],
+
+    '6': [(1, 0.8, False), (0.8, 1, True),
+         (0.2, 1, True), (0, 0.8, True),
+         (0, 0.2, True), (0.2, 0, True),
+         (0.8, 0, True), (1, 0.2, True),
+         (1, 0.4, True), (0.8, 0.5, True),
+         (0, 0.5, True)],
+
+    '7': [(0, 1, False), (1, 1, True),
+         (0.5, 0, True)],
+
+    '8': [(0.2, 0.5, False), (0, 0.7, True),
+         (0, 0.8, True), (0.2, 1, True),
+         (0.8, 1, True), (1, 0.8, True),
+         (1, 0.7, True), (0.8, 0.5, True),
+         (0.2, 0.5, True), (0, 0.3, True),
+         (0, 0.2, True), (0.2, 0, True),
+         (0.8, 0, True), (1, 0.2, True),
+         (1, 0.3, True), (0.8, 0.5, True)],
+
+    '9': [(0, 0.2, False), (0.2, 0, True),
+         (0.8, 0, True), (1, 0.2, True),
+         (1, 0.8, True), (0.8, 1, True),
+         (0.2, 1, True), (0, 0.8, True),
+         (0, 0.6, True), (0.2, 0.5, True),
+         (1, 0.5, True)],
+
+    '.': [(0.4, 0, False), (0.6, 0, True),
+         (0.6, 0.2, True), (0.4, 0.2, True),
+         (0.4, 0, True)],
+
+    ',': [(0.6, 0, False), (0.4, -0.2, True),
+         (0.4, 0, True), (0.6, 0, True),
+         (0.6, 0.2, True), (0.4, 0.2, True),
+         (0.4, 0, True)],
+
+    '!': [(0.5, 1, False), (0.5, 0.2, True),
+         (0.5, 0, False), (0.3, 0, True),
+         (0.3, 0.1, True), (0.7, 0.1, True),
+         (0.7, 0, True), (0.5, 0, True)],
+
+    '?': [(0, 0.8, False), (0.2, 1, True),
+         (0.8, 1, True), (1, 0.8, True),
+         (1, 0.6, True), (0.5, 0.4, True),
+         (0.5, 0.2, True), (0.5, 0, False),
+         (0.3, 0, True), (0.3, 0.1, True),
+         (0.7, 0.1, True), (0.7, 0, True),
+         (0.5, 0, True)],
+
+    ' ': [(0, 0, False)]  # Space
+}
+
+
+@lru_cache(maxsize=32, typed=True)
+def scaled_font(char_width, char_height):
+    """
+    Return the glyph table scaled to a character cell of char_width x char_height.
+
+    The scaled tables are cached per (char_width, char_height), so repeated
+    calls with the same metrics cost a dictionary lookup.  The returned dict is
+    shared between callers and must not be modified.
+    """
+    # Zero offsets stay integer zeros so the emitted coordinates are exactly
+    # what the old inline table produced
+    return {
+        char: tuple((ux and ux * char_width, uy and uy * char_height, pen_down)
+                    for ux, uy, pen_down in path)
+        for char, path in GLYPHS.items()
+    }
@@ -0,0 +1,253 @@
+"""
+Stream G-code straight to a GRBL controller over a serial port.
+
+Uses GRBL's character-counting flow control: every line sent is remembered
+with its byte length until GRBL answers it with "ok" or "error:N", and a new
+line is only written while the bytes in flight fit in GRBL's 128-byte serial
+RX buffer.  That keeps the buffer full (so short segments stream at speed)
+without ever overflowing it.  Real-time commands (status report, feed hold,
+cycle start, soft reset) bypass the buffer and can be sent at any time.
+
+A program pause (M0) stops GRBL once the moves before it are done, and GRBL
+only answers it after cycle start.  stream() sends nothing past the pause
+until then; with on_pause it waits for the plotter to stop there, calls
+on_pause and sends cycle start itself.
+"""
+import collections
+import re
+import threading
+import time
+
+try:
+    import serial
+except ImportError:  # pyserial is only needed when streaming to a machine
+    serial = None
+
+RX_BUFFER_SIZE = 128  # GRBL's serial receive buffer in bytes
+
+# Real-time commands, picked out of the byte stream by GRBL immediately
+STATUS_REPORT = b"?"
+FEED_HOLD = b"!"
+CYCLE_START = b"~"
+SOFT_RESET = b"\x18"
+
+PROGRAM_PAUSES = ("M0", "M00", "M1", "M01")  # GRBL holds their "ok" until cycle start
+
+_COMMENT = re.compile(r"\(.*?\)|;.*")
+
+
+class GrblError(Exception):
+    """Raised when GRBL reports an alarm or stops answering"""
+
+
+def clean_line(line):
+    """Strip comments and surrounding whitespace from a G-code line"""
+    return _COMMENT.sub("", line).strip()
+
+
+class GrblStreamer:
+    def __init__(self, port, baudrate=115200, rx_buffer_size=RX_BUFFER_SIZE):
+        self.port = port
+        self.baudrate = baudrate
+        self.rx_buffer_size = rx_buffer_size
+        self.serial = None
+        self.last_status = None  # Last "<...>" status report
+        self.alarm = None  # Last "ALARM:N" message, cleared by a soft reset
+        self.errors = []  # (line, "error:N") for every rejected line
+        self.lines_acknowledged = 0
+        self._pending = collections.deque()  # (line, bytes) sent but not yet answered
+        self._buffered = 0  # Bytes currently sitting in GRBL's RX buffer
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._status_event = threading.Event()
+        self._banner_event = threading.Event()
+        self._reader = None
+        self._running = False
+
+    @property
+    def is_connected(self):
+        return self._running
+
+    def connect(self, boot_timeout=2.5):
+        """
+        Open the serial port and wait for GRBL's startup banner.  Most boards
+        reset when the port opens; if no banner shows up within boot_timeout
+        seconds a soft reset is sent to get one.
+        """
+        if serial is None:
+            raise GrblError("pyserial is required to stream to GRBL (pip install pyserial)")
+        self.serial = serial.Serial(self.port, self.baudrate, timeout=0.05)
+        self._running = True
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+        if not self._banner_event.wait(boot_timeout):
+            self.soft_reset()
+        return self
+
+    def close(self):
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+        if self._reader:
+            self._reader.join(timeout=1)
+        if self.serial:
+            self.serial.close()
+            self.serial = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _write(self, data):
+        with self._write_lock:
+            self.serial.write(data)
+
+    def _read_loop(self):
+        buffer = b""
+        while self._running:
+            try:
+                data = self.serial.read(self.serial.in_waiting or 1)
+            except (OSError, serial.SerialException):
+                break
+            if not data:
+                continue
+            buffer += data
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                self._handle_response(line.decode("ascii", "replace").strip())
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+
+    def _handle_response(self, response):
+        if not response:
+            return
+        if response == "ok" or response.startswith("error:"):
+            with self._condition:
+                line = None
+                if self._pending:
+                    line, size = self._pending.popleft()
+                    self._buffered -= size
+                if response != "ok":
+                    self.errors.append((line, response))
+                self.lines_acknowledged += 1
+                self._condition.notify_all()
+        elif response.startswith("<"):
+            self.last_status = response
+            self._status_event.set()
+        elif response.startswith("Grbl "):
+            # GRBL (re)started: anything still in flight was discarded
+            with self._condition:
+                self._pending.clear()
+                self._buffered = 0
+                self.alarm = None
+                self._condition.notify_all()
+            self._banner_event.set()
+        elif response.startswith("ALARM:"):
+            with self._condition:
+                self.alarm = response
+                self._condition.notify_all()
+
+    def _wait(self, predicate):
+        """Wait on the flow-control condition; bail out on alarm or disconnect"""
+        with self._condition:
+            while not predicate():
+                if self.alarm:
+                    raise GrblError(f"GRBL reported {self.alarm}")
+                if not self._running:
+                    raise GrblError("Serial connection to GRBL closed")
+                self._condition.wait(0.5)
+
+    def send_line(self, line):
+        """
+        Send one G-code line as soon as it fits in GRBL's RX buffer.  Returns
+        without waiting for the answer; use wait_for_acknowledgements for that.
+        """
+        data = (line + "\n").encode("ascii")
+        if len(data) > self.rx_buffer_size:
+            raise GrblError(f"Line longer than GRBL's RX buffer: {line}")
+        self._wait(lambda: self._buffered + len(data) <= self.rx_buffer_size)
+        with self._condition:
+            self._pending.append((line, len(data)))
+            self._buffered += len(data)
+        self._write(data)
+
+    def wait_for_acknowledgements(self):
+        """Block until GRBL has answered every line sent so far"""
+        self._wait(lambda: not self._pending)
+
+    def stream(self, lines, stop_on_error=False, on_pause=None):
+        """
+        Stream G-code lines with character-counting flow control and wait for
+        the last one to be acknowledged.  Returns the (line, error) pairs GRBL
+        rejected during this call.  At a program pause, on_pause(line) is
+        called once the plotter has stopped there, and the stream resumes
+        with cycle start when it returns; without on_pause the stream waits
+        for cycle start from elsewhere (the controller's resume button).
+        """
+        first_error = len(self.errors)
+        for line in lines:
+            line = clean_line(line)
+            if not line:
+                continue
+            if line.upper() in PROGRAM_PAUSES:
+                self.program_pause(line, on_pause)
+            else:
+                self.send_line(line)
+            if stop_on_error and len(self.errors) > first_error:
+                break
+        self.wait_for_acknowledgements()
+        return self.errors[first_error:]
+
+    def stream_file(self, path, stop_on_error=False, on_pause=None):
+        with open(path) as f:
+            return self.stream(f, stop_on_error=stop_on_error, on_pause=on_pause)
+
+    def program_pause(self, line, on_pause=None):
+        """Send a program pause and return once GRBL has resumed past it"""
+        self.send_line(line)
+        if on_pause is not None:
+            self.wait_for_state("Hold")
+            on_pause(line)
+            self.cycle_start()
+        self.wait_for_acknowledgements()
+
+    def status(self, timeout=1.0):
+        """Request a real-time status report and return it (or None on timeout)"""
+        self._status_event.clear()
+        self._write(STATUS_REPORT)
+        if self._status_event.wait(timeout):
+            return self.last_status
+        return None
+
+    def wait_until_idle(self, poll_interval=0.2):
+        """Wait until every acknowledged line has also finished moving"""
+        self.wait_for_acknowledgements()
+        return self.wait_for_state("Idle", poll_interval)
+
+    def wait_for_state(self, state, poll_interval=0.2):
+        """Poll the status until GRBL reports state (such as "Idle" or "Hold") and return the report"""
+        while True:
+            if not self._running:
+                raise GrblError("Serial connection to GRBL closed")
+            report = self.status()
+            if report and report[1:].startswith(state):
+                return report
+            if self.alarm:
+                raise GrblError(f"GRBL reported {self.alarm}")
+            time.sleep(poll_interval)
+
+    def feed_hold(self):
+        self._write(FEED_HOLD)
+
+    def cycle_start(self):
+        self._write(CYCLE_START)
+
+    def soft_reset(self, timeout=5.0):
+        """Reset GRBL, dropping everything queued, and wait for it to restart"""
+        self._banner_event.clear()
+        self._write(SOFT_RESET)
+        if not self._banner_event.wait(timeout):
+            raise GrblError("GRBL did not restart after soft reset")
@@ -0,0 +1,145 @@
+"""
+Stage latency instrumentation.
+
+Every stage a batch goes through (recognize, batch, queue, compile, send,
+plot, ...) is timed with time.monotonic() and recorded against the batch id.
+Recent durations per stage are kept in fixed-size windows, so p50/p95/p99
+are always available, and every span can also be appended to a JSON-lines
+file for later analysis.  Recording a span is a deque append and, with a
+log file, one short write, which is cheap enough to leave on.
+
+A run's percentiles can be saved as a baseline together with the settings
+they were measured with; later runs compare against it and report the
+stages that got slower, and which settings changed since.
+"""
+import collections
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile (q in 0-100) of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * q // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class Instrumentation:
+    def __init__(self, path=None, window=500):
+        self.path = path  # JSON-lines span log, if any
+        self.window = window  # Durations kept per stage for the percentiles
+        self._durations = collections.defaultdict(lambda: collections.deque(maxlen=window))
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1) if path else None
+
+    def record(self, stage, seconds, batch_id=None, **fields):
+        """Record that stage took seconds for batch_id; extra fields go to the log line"""
+        with self._lock:
+            self._durations[stage].append(seconds)
+            if self._file:
+                entry = {"time": time.time(), "stage": stage, "batch": batch_id, "seconds": round(seconds, 6)}
+                entry.update(fields)
+                self._file.write(json.dumps(entry) + "\n")
+
+    def record_batch(self, sample, batch_id=None):
+        """Log a flushed batching.BatchSample and append it to the span log"""
+        logger.info(f"Batch {batch_id}: {sample.words} words ({sample.backlog} jobs in flight, "
+                    f"threshold {sample.threshold}, {sample.reason})")
+        with self._lock:
+            if self._file:
+                entry = {"time": time.time(), "stage": "batch_flush", "batch": batch_id, "words": sample.words,
+                         "backlog": sample.backlog, "threshold": sample.threshold, "reason": sample.reason}
+                self._file.write(json.dumps(entry) + "\n")
+
+    @contextmanager
+    def span(self, stage, batch_id=None, **fields):
+        """Time the body of a with block as stage"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, time.monotonic() - started, batch_id, **fields)
+
+    def percentiles(self):
+        """{stage: {"count", "p50", "p95", "p99"}} over the recent window"""
+        with self._lock:
+            windows = {stage: sorted(durations) for stage, durations in self._durations.items()}
+        return {
+            stage: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95),
+                    "p99": percentile(values, 99)}
+            for stage, values in windows.items() if values
+        }
+
+    def log_summary(self):
+        for stage, stats in sorted(self.percentiles().items()):
+            logger.info(f"{stage:<15} n={stats['count']:<5d} p50={stats['p50']:.3f}s p95={stats['p95']:.3f}s "
+                        f"p99={stats['p99']:.3f}s")
+
+    def save_baseline(self, path, config=None):
+        """Store the current percentiles and the settings they were measured with"""
+        with open(path, "w") as f:
+            json.dump({"config": config or {}, "stages": self.percentiles()}, f, indent=2, sort_keys=True)
+
+    def check_regressions(self, path, config=None, tolerance=1.25, min_samples=5):
+        """
+        Compare p95 per stage with a saved baseline.  Returns messages for
+        stages more than tolerance times slower (with at least min_samples
+        measurements), plus the settings that differ from the baseline's.
+        """
+        try:
+            with open(path) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read latency baseline {path}: {e}")
+            return []
+        messages = []
+        for stage, stats in sorted(self.percentiles().items()):
+            before = baseline.get("stages", {}).get(stage)
+            if not before or not before.get("p95") or stats["count"] < min_samples:
+                continue
+            if stats["p95"] > before["p95"] * tolerance:
+                messages.append(f"{stage} p95 {before['p95']:.3f}s -> {stats['p95']:.3f}s")
+        if messages:
+            old_config = baseline.get("config", {})
+            changed = sorted(key for key in set(old_config) | set(config or {})
+                             if old_config.get(key) != (config or {}).get(key))
+            if changed:
+                messages.append("settings changed since the baseline: " + ", ".join(changed))
+        return messages
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per log record, for machine-readable logs"""
+
+    def format(self, record):
+        entry = {
+            "time": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+def configure_logging(json_lines=False, level=logging.INFO):
+    """Log to the console, as plain messages or as JSON lines"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter("%(message)s"))
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level)
@@ -0,0 +1,440 @@
+"""
+Vectorized text layout.
+
+Turns a whole batch of text into NumPy arrays of absolute (x, y, pen_down)
+vertices in one go: characters are mapped to glyph indices, each character's
+position comes from the glyph set's advance table, and the glyph vertices are
+gathered from one flat table.
+
+Lines are broken by one of the rules in WRAPS:
+
+  * "char" wraps at whichever character would pass the right edge, with
+    integer arithmetic on character indices; the rule and the float
+    arithmetic are those of the old character-by-character loop, so the
+    coordinates are identical;
+  * "greedy" wraps between words, putting as many words on a line as fit;
+  * "balanced" wraps between words for minimum raggedness: the sum of the
+    squared space left on every line but the last of a paragraph is as
+    small as it can be.
+
+Word widths come from the advance table in one vectorized pass, and both
+word rules look at each word a bounded number of times (a line holds a
+bounded number of words), so layout stays linear in the length of the text.
+A blank line in the text starts a new paragraph; other line breaks are
+spaces.  A word longer than a whole line is split between characters.
+
+With a PageGeometry that has a bottom, a line that would fall below it goes
+to the top of the next page instead; every row knows its page, and
+TextLayout.pages() splits the vertices by page, so the pipeline can stop for
+a paper change or send the next page somewhere else.
+"""
+import math
+import re
+from functools import lru_cache
+
+import numpy as np
+
+from font_compiler import open_font
+from glyphs import scaled_font
+
+
+class GlyphArrays:
+    """A scaled glyph table stored as flat vertex arrays"""
+
+    def __init__(self, font):
+        chars = list(font)
+        points = [point for char in chars for point in font[char]]
+        self._index(np.array([ord(char) for char in chars], dtype=np.int64),
+                    np.array([len(font[char]) for char in chars], dtype=np.int64),
+                    np.array([point[0] for point in points], dtype=float),
+                    np.array([point[1] for point in points], dtype=float),
+                    np.array([point[2] for point in points], dtype=bool))
+
+    @classmethod
+    def from_arrays(cls, codes, counts, x, y, pen):
+        """A table from flat arrays, as font_compiler.CompiledFont.arrays returns them"""
+        glyphs = cls.__new__(cls)
+        glyphs._index(np.asarray(codes, dtype=np.int64), counts, x, y, pen)
+        return glyphs
+
+    def _index(self, codes, counts, x, y, pen):
+        self.index = {chr(code): i for i, code in enumerate(codes.tolist())}
+        self.counts = counts
+        self.offsets = np.cumsum(self.counts) - self.counts
+        self.x = x
+        self.y = y
+        self.pen = pen
+        self.widths = np.ones(len(codes))  # Advance of each glyph in character cells
+        self._advances = {}
+
+        # Code point -> glyph; characters without a glyph are drawn as a space
+        self.space = self.index[' ']
+        self.lookup = np.full(max(256, int(codes.max()) + 1), self.space, dtype=np.int64)
+        self.lookup[codes] = np.arange(len(codes))
+
+    def glyph_indices(self, codes):
+        inside = codes < len(self.lookup)
+        return np.where(inside, self.lookup[np.where(inside, codes, 0)], self.space)
+
+    def advances(self, advance):
+        """Advance width of every glyph for a cell advance of advance mm, computed once per advance"""
+        table = self._advances.get(advance)
+        if table is None:
+            table = self._advances[advance] = self.widths * advance
+        return table
+
+
+class PageGeometry:
+    """
+    Where text goes on a sheet: lines run from x = left to right and their
+    baselines from y = top down in steps of line_spacing, no lower than
+    bottom.  With bottom None the text runs on down the paper.
+    """
+
+    def __init__(self, left, right, top, bottom=None, line_spacing=15):
+        if line_spacing <= 0:
+            raise ValueError("Line spacing must be positive")
+        self.left = left
+        self.right = right
+        self.top = top
+        self.bottom = bottom
+        self.line_spacing = line_spacing
+
+    @property
+    def lines(self):
+        """Lines on a page (None without a bottom)"""
+        if self.bottom is None:
+            return None
+        return max(1, int((self.top - self.bottom) // self.line_spacing) + 1)
+
+    def line_of(self, y):
+        """Line of the page whose baseline is at (or nearest to) y"""
+        line = round((self.top - y) / self.line_spacing)
+        return min(max(line, 0), self.lines - 1) if self.lines else max(line, 0)
+
+
+@lru_cache(maxsize=32, typed=True)
+def glyph_arrays(char_width, char_height, font=None):
+    """
+    GlyphArrays for a char_width x char_height cell, cached like scaled_font;
+    font is the path of a compiled font file, or None for glyphs.GLYPHS
+    """
+    if font is not None:
+        return GlyphArrays.from_arrays(*open_font(font).arrays(char_width, char_height))
+    return GlyphArrays(scaled_font(char_width, char_height))
+
+
+class TextLayout:
+    """Laid-out vertices plus where each line on the paper starts"""
+
+    def __init__(self, x, y, pen, row_bounds, cursor_x, cursor_y, codes=None, char_x=None, char_y=None,
+                 char_rows=None, char_bounds=None, row_pages=None, cursor_page=0):
+        self.x = x
+        self.y = y
+        self.pen = pen
+        self.row_bounds = row_bounds  # Vertex index where each row starts, plus the end
+        self.row_pages = row_pages if row_pages is not None else np.full(len(row_bounds) - 1, cursor_page)
+        self.cursor_x = cursor_x  # Where the next character goes
+        self.cursor_y = cursor_y
+        self.cursor_page = cursor_page
+        # Per character: code point, origin, row and first vertex (plus the end)
+        self.codes = codes
+        self.char_x = char_x
+        self.char_y = char_y
+        self.char_rows = char_rows
+        self.char_bounds = char_bounds
+
+    def rows(self):
+        """Yield (x, y, pen) arrays for each line on the paper"""
+        for start, end in zip(self.row_bounds[:-1].tolist(), self.row_bounds[1:].tolist()):
+            yield self.x[start:end], self.y[start:end], self.pen[start:end]
+
+    def pages(self):
+        """Yield (page, x, y, pen) for the vertices on each page"""
+        if not len(self.row_pages):
+            return  # Only whitespace
+        starts = np.concatenate([[0], np.flatnonzero(self.row_pages[1:] != self.row_pages[:-1]) + 1])
+        ends = np.append(starts[1:], len(self.row_pages))
+        for first, last in zip(starts.tolist(), ends.tolist()):
+            start, end = int(self.row_bounds[first]), int(self.row_bounds[last])
+            yield int(self.row_pages[first]), self.x[start:end], self.y[start:end], self.pen[start:end]
+
+    def words(self):
+        """
+        Yield (row, word, x, y, first_vertex, end_vertex) for every run of
+        non-space characters on a line; a word wrapped over a line end comes
+        out as two
+        """
+        if self.codes is None or not len(self.codes):
+            return
+        letter = self.codes != ord(' ')
+        new_row = np.concatenate([[True], self.char_rows[1:] != self.char_rows[:-1]])
+        row_end = np.concatenate([new_row[1:], [True]])
+        starts = np.flatnonzero(letter & (new_row | ~np.concatenate([[False], letter[:-1]])))
+        ends = np.flatnonzero(letter & (row_end | ~np.concatenate([letter[1:], [False]]))) + 1
+        text = self.codes.astype('<u4').tobytes().decode('utf-32-le')
+        rows, char_x, char_y, bounds = (self.char_rows.tolist(), self.char_x.tolist(), self.char_y.tolist(),
+                                        self.char_bounds.tolist())
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            yield rows[start], text[start:end], char_x[start], char_y[start], bounds[start], bounds[end]
+
+
+def _line_positions(x, advance, max_line_width, first_is_free):
+    """
+    Positions of the characters that fit on a line starting at x, summed one
+    advance at a time exactly like the per-character loop.  After a wrap the
+    first character is placed without checking the width.
+    """
+    positions = []
+    if first_is_free:
+        positions.append(x)
+        x += advance
+    while x + advance <= max_line_width:
+        positions.append(x)
+        x += advance
+    return positions
+
+
+def _char_lines(count, cursor_x, page, advance):
+    """(x, line) of count characters under the "char" rule"""
+    first = _line_positions(cursor_x, advance, page.right, first_is_free=False)
+    fresh = _line_positions(page.left, advance, page.right, first_is_free=True)
+    positions = np.array(first + fresh, dtype=float)
+    index = np.arange(count)
+    wrapped = index - len(first)
+    on_first = wrapped < 0
+    line = np.where(on_first, 0, 1 + wrapped // len(fresh))
+    return positions[np.where(on_first, index, len(first) + wrapped % len(fresh))], line
+
+
+def _words(codes, advances):
+    """
+    Runs of non-whitespace in codes: (starts, ends, widths, gaps, paragraph,
+    sums), where gaps is the width of the whitespace before each word,
+    paragraph is True for a word after a blank line and sums are the
+    advances summed up to each character
+    """
+    space = np.isin(codes, _WHITESPACE)
+    edges = np.diff(np.concatenate([[1], space, [1]]).astype(np.int8))
+    starts = np.flatnonzero(edges == -1)
+    ends = np.flatnonzero(edges == 1)
+    sums = np.concatenate([[0.0], np.cumsum(advances)])
+    previous_ends = np.concatenate([[0], ends[:-1]])
+    newlines = np.concatenate([[0], np.cumsum(codes == ord('\n'))])
+    paragraph = newlines[starts] - newlines[previous_ends] >= 2
+    return starts, ends, sums[ends] - sums[starts], sums[starts] - sums[previous_ends], paragraph, sums
+
+
+def _greedy_breaks(paragraph):
+    """Words that must start a line: those after a blank line (the rest fill lines as they come)"""
+    return set(np.flatnonzero(paragraph).tolist())
+
+
+def _balanced_breaks(widths, gaps, paragraph, first_room, room):
+    """
+    Words that start a line for minimum raggedness.  first_room is the
+    space left on the cursor's line and room that of a whole line.  Each
+    paragraph is broken by dynamic programming over its words; a line ending
+    at word j is only tried from the words that fit with it, so the work per
+    word is bounded by the words on a line.
+    """
+    breaks = _greedy_breaks(paragraph)
+    count = len(widths)
+    if count and 0 not in breaks and gaps[0] + widths[0] > first_room:
+        breaks.add(0)
+    on_cursor_line = 0 not in breaks
+    sums = np.concatenate([[0.0], np.cumsum(gaps + widths)]).tolist()
+    gaps = gaps.tolist()
+    bounds = sorted(breaks | {0, count})
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        words = end - start
+        best = [0.0] + [math.inf] * words  # Least cost of setting the first j words of the paragraph
+        back = [0] * (words + 1)
+        for j in range(1, words + 1):
+            for i in range(j - 1, -1, -1):
+                width = sums[start + j] - sums[start + i]
+                if start + i == 0 and on_cursor_line:
+                    capacity = first_room
+                else:
+                    width -= gaps[start + i]
+                    capacity = room
+                if width > capacity and i < j - 1:
+                    break
+                # The last line of a paragraph may be as short as it likes
+                cost = best[i] + (0.0 if j == words else max(capacity - width, 0.0) ** 2)
+                if cost < best[j]:
+                    best[j], back[j] = cost, i
+        j = words
+        while j > 0:
+            j = back[j]
+            if j:
+                breaks.add(start + j)
+    return breaks
+
+
+def _place_words(starts, ends, widths, gaps, breaks, sums, advances, cursor_x, page):
+    """
+    Pieces (first, end, line, x) of the characters that are drawn: each word
+    with the whitespace before it, or without it when the word starts a
+    line.  A word starts a line when it is in breaks or does not fit; a word
+    longer than a line is split between characters.
+    """
+    pieces = []
+    line, x = 0, cursor_x
+    previous_end = 0
+    for i, (start, end, width, gap) in enumerate(zip(starts.tolist(), ends.tolist(), widths.tolist(),
+                                                     gaps.tolist())):
+        fresh = i in breaks or (x > page.left and x + gap + width > page.right)
+        if fresh:
+            line, x = line + 1, page.left
+        first = start if fresh else previous_end
+        if x + sums[end] - sums[first] > page.right:
+            line_start, line_x = first, x
+            for char in range(first, end):
+                if x + advances[char] > page.right and char > line_start:
+                    pieces.append((line_start, char, line, line_x))
+                    line, x = line + 1, page.left
+                    line_start, line_x = char, x
+                x += advances[char]
+            pieces.append((line_start, end, line, line_x))
+        else:
+            pieces.append((first, end, line, x))
+            x += sums[end] - sums[first]
+        previous_end = end
+    return pieces
+
+
+def _word_lines(codes, glyphs, cursor_x, page, advance, wrap, new_word):
+    """
+    (codes, x, line) of the characters drawn under a word rule, and the
+    advance of the last one; whitespace comes out as spaces
+    """
+    if new_word and cursor_x > page.left and len(codes) and codes[0] not in _WHITESPACE:
+        codes = np.concatenate([[ord(' ')], codes]).astype(np.uint32)
+    advances = glyphs.advances(advance)[glyphs.glyph_indices(codes)]
+    starts, ends, widths, gaps, paragraph, sums = _words(codes, advances)
+    if not len(starts):
+        return codes[:0], None, None, None
+    if wrap == "balanced":
+        breaks = _balanced_breaks(widths, gaps, paragraph, page.right - cursor_x, page.right - page.left)
+    else:
+        breaks = _greedy_breaks(paragraph)
+    pieces = _place_words(starts, ends, widths, gaps, breaks, sums.tolist(), advances.tolist(), cursor_x, page)
+    firsts, piece_ends, lines, xs = (np.array(column) for column in zip(*pieces))
+    lengths = piece_ends - firsts
+    offsets = np.cumsum(lengths) - lengths
+    kept = np.repeat(firsts - offsets, lengths) + np.arange(lengths.sum())
+    char_x = np.repeat(xs.astype(float), lengths) + (sums[kept] - np.repeat(sums[firsts], lengths))
+    codes = np.where(np.isin(codes, _WHITESPACE), ord(' '), codes).astype(np.uint32)
+    return codes[kept], char_x, np.repeat(lines, lengths), float(advances[kept[-1]])
+
+
+# Line breaking rules, for settings and the command line
+WRAPS = ("char", "greedy", "balanced")
+_WHITESPACE = np.array([ord(' '), ord('\t'), ord('\n'), ord('\r')], dtype=np.uint32)
+
+
+def layout_text(text, glyphs, cursor_x, cursor_y, page, advance, wrap="char", cursor_page=0, new_word=False):
+    """
+    Lay out text starting at (cursor_x, cursor_y) on page number cursor_page,
+    page being a PageGeometry and advance the width of a character cell.
+    wrap is one of WRAPS.  Under "char" a character that would pass the
+    right edge starts a new line and line breaks in the text do not move the
+    cursor.  Under the word rules new_word keeps the text apart from what is
+    already on the line even if it does not start with a space, as for the
+    next batch of dictation.
+    """
+    if advance <= 0:
+        raise ValueError("Character advance must be positive")
+    if wrap not in WRAPS:
+        raise ValueError(f"Unknown wrap rule {wrap!r}; expected one of {', '.join(WRAPS)}")
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    if wrap == "char":
+        codes = codes[codes != ord('\n')]
+        if len(codes):
+            char_x, line = _char_lines(len(codes), cursor_x, page, advance)
+            last_advance = advance
+    else:
+        codes, char_x, line, last_advance = _word_lines(codes, glyphs, cursor_x, page, advance, wrap, new_word)
+    count = len(codes)
+    if not count:
+        empty = np.zeros(0)
+        return TextLayout(empty, empty, np.zeros(0, dtype=bool), np.zeros(1, dtype=np.int64),
+                          cursor_x, cursor_y, cursor_page=cursor_page)
+
+    # Baselines down from the cursor's line, and back to the top on the next page
+    if page.lines is None:
+        line_y = np.cumsum(np.concatenate([[cursor_y], np.full(line[-1], -page.line_spacing, dtype=float)]))
+        row_pages = np.full(line[-1] + 1, cursor_page)
+    else:
+        on_page = page.line_of(cursor_y) + np.arange(line[-1] + 1)
+        row_pages = cursor_page + on_page // page.lines
+        line_y = page.top - (on_page % page.lines) * float(page.line_spacing)
+    char_y = line_y[line]
+
+    # Gather every character's glyph vertices from the flat table
+    index = np.arange(count)
+    glyph = glyphs.glyph_indices(codes)
+    counts = glyphs.counts[glyph]
+    char_of_vertex = np.repeat(index, counts)
+    first_vertex = np.cumsum(counts) - counts
+    table_index = (glyphs.offsets[glyph] - first_vertex)[char_of_vertex] + np.arange(counts.sum())
+    x = char_x[char_of_vertex] + glyphs.x[table_index]
+    y = char_y[char_of_vertex] + glyphs.y[table_index]
+    pen = glyphs.pen[table_index]
+
+    row_bounds = np.searchsorted(line[char_of_vertex], np.arange(line[-1] + 2))
+    return TextLayout(x, y, pen, row_bounds, float(char_x[-1]) + last_advance, float(char_y[-1]), codes, char_x,
+                      char_y, line, np.append(first_vertex, len(x)), row_pages, int(row_pages[-1]))
+
+
+_RUN_AND_WORD = re.compile(r"[ \n]*[^ \n]*")
+
+
+def _block_end(text, start, end):
+    """
+    Where to end a block of text[start:end]: before the last run of
+    whitespace in it, so words stay whole and the whitespace (and any blank
+    line) opens the next block together with the word after it; at end if
+    there is none.  If the block would be whitespace only, it runs on to the
+    end of the word after the whitespace instead.
+    """
+    cut = max(text.rfind(' ', start + 1, end), text.rfind('\n', start + 1, end))
+    if cut <= start:
+        return end
+    while cut > start and text[cut - 1] in ' \n':
+        cut -= 1
+    if cut > start:
+        return cut
+    return _RUN_AND_WORD.match(text, start).end()
+
+
+def text_blocks(text, block_size=8192):
+    """
+    Split a string or an iterable of strings into blocks of about
+    block_size characters, between words where there is whitespace to split at
+    """
+    if isinstance(text, str):
+        start = 0
+        while start < len(text):
+            end = start + block_size
+            if end < len(text):
+                end = _block_end(text, start, end)
+            yield text[start:end]
+            start = end
+        return
+    pending = []
+    size = 0
+    for chunk in text:
+        pending.append(chunk)
+        size += len(chunk)
+        if size >= block_size:
+            joined = ''.join(pending)
+            end = _block_end(joined, 0, len(joined))
+            if end == len(joined) and len(joined.split()) <= 1:
+                continue  # Whitespace and at most one word, which may go on in the next chunk
+            yield joined[:end]
+            pending = [joined[end:]]
+            size = len(pending[0])
+    if size:
+        yield ''.join(pending)
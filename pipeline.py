@@ -0,0 +1,96 @@
+"""
+Blocking hand-off between the stages of the speech-to-plot pipeline.
+
+Each stage runs in its own thread and sleeps on a condition variable until
+work arrives, so nothing polls.  Queues are bounded: when a later stage falls
+behind, put() blocks and the backlog pushes back on the stage feeding it
+instead of piling up in memory.  close() lets consumers drain what is left
+and then stop, which is how the pipeline shuts down cleanly.
+"""
+import collections
+import threading
+import time
+
+
+class Job:
+    """A batch of text on its way from speech to paper"""
+
+    def __init__(self, batch_id, text, speech_end=None):
+        self.batch_id = batch_id
+        self.text = text
+        self.speech_end = speech_end  # time.monotonic() the last utterance was captured
+        self.queued = time.monotonic()  # When the batch entered the pipeline
+        self.compiled = None  # When compiling finished
+        self.gcode_file = None
+        self.plotting_time = None  # Estimated seconds
+        self.preamble = None  # Continuous session: lines that set up a fresh connection for this segment
+        self.page_breaks = []  # Pages whose sheet each stop (M0) in gcode_file starts, in order
+        self.resume_from = 0  # Lines of gcode_file an earlier run had already sent (see spool.py)
+
+
+class QueueClosed(Exception):
+    """Raised by put() on a closed queue and by get() once a closed queue is empty"""
+
+
+class BoundedQueue:
+    def __init__(self, maxsize=4):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self._items = collections.deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self.blocked_puts = 0  # How often a producer had to wait for room
+
+    def __len__(self):
+        with self._condition:
+            return len(self._items)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def put(self, item, timeout=None):
+        """
+        Add an item, waiting while the queue is full.  Returns False if the
+        queue is still full after timeout seconds.
+        """
+        with self._condition:
+            if len(self._items) >= self.maxsize and not self._closed:
+                self.blocked_puts += 1
+                if not self._condition.wait_for(lambda: len(self._items) < self.maxsize or self._closed,
+                                                timeout):
+                    return False
+            if self._closed:
+                raise QueueClosed("put() on a closed queue")
+            self._items.append(item)
+            self._condition.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        """
+        Take the oldest item, waiting until one arrives.  Raises QueueClosed
+        once the queue is closed and empty, or TimeoutError after timeout.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._items or self._closed, timeout):
+                raise TimeoutError("No item within timeout")
+            if not self._items:
+                raise QueueClosed("Queue closed")
+            item = self._items.popleft()
+            self._condition.notify_all()
+            return item
+
+    def close(self):
+        """Stop accepting items; items already queued can still be taken"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def __iter__(self):
+        """Yield items until the queue is closed and drained"""
+        while True:
+            try:
+                yield self.get()
+            except QueueClosed:
+                return
@@ -0,0 +1,344 @@
+"""
+Acceleration-aware plot time estimator for GRBL.
+
+The program is parsed once into NumPy arrays (one entry per XY move) and timed
+the way GRBL's planner drives the machine: every move follows a trapezoidal
+velocity profile with constant acceleration, corner speeds are limited by the
+junction deviation setting, and the machine comes to a stop (plus a servo
+dwell) around every pen command.
+
+Both look-ahead passes of the planner are min-plus recurrences on squared
+speeds, so they are solved with cumulative minimums instead of Python loops.
+"""
+import re
+
+import numpy as np
+
+from geometry import arc_points
+
+_WORD = re.compile(r"([A-Z])\s*([-+]?\d*\.?\d+)")
+_PAREN_COMMENT = re.compile(r"\(.*?\)")
+
+
+class ParsedProgram:
+    """XY moves of a G-code program as parallel arrays"""
+
+    def __init__(self, start, points, feeds, stops, dwell_time, line_numbers):
+        self.start = start  # (x, y) the machine is at before the first move
+        self.points = points  # (n, 2) end point of every move
+        self.feeds = feeds  # (n,) requested speed in mm/min
+        self.stops = stops  # (n,) True if the machine must be stopped before the move
+        self.dwell_time = dwell_time  # Seconds spent on pen commands and G4 dwells
+        self.line_numbers = line_numbers  # (n,) program line each move came from
+
+    def __len__(self):
+        return len(self.feeds)
+
+
+class PlotEstimate:
+    def __init__(self, segment_times, segment_lengths, dwell_time, line_numbers):
+        self.segment_times = segment_times  # Seconds per move, excluding dwells
+        self.segment_lengths = segment_lengths
+        self.line_numbers = line_numbers
+        self.motion_time = float(segment_times.sum())
+        self.dwell_time = float(dwell_time)
+        self.total_time = self.motion_time + self.dwell_time
+
+    def __repr__(self):
+        return (f"PlotEstimate(total_time={self.total_time:.2f}s, moves={len(self.segment_times)}, "
+                f"dwell_time={self.dwell_time:.2f}s)")
+
+
+class _ProgramParser:
+    """Modal G-code state plus the moves parsed so far"""
+
+    def __init__(self, estimator, start):
+        self.max_rate = estimator.max_rate
+        self.servo_dwell = estimator.servo_dwell
+        self.pen_commands = estimator.pen_commands
+        self.x, self.y = start
+        self.points, self.feeds, self.stops, self.line_numbers = [], [], [], []
+        self.dwell_time = 0.0
+        self.motion = 0
+        self.feed = estimator.max_rate
+        self.relative = False
+        self.stop_next = False
+        self.line_number = -1
+
+    def feed_line(self, line):
+        self.line_number += 1
+        comment = line.find(';')
+        if comment >= 0:
+            line = line[:comment]
+        if '(' in line:
+            line = _PAREN_COMMENT.sub('', line)
+        words = _WORD.findall(line.upper())
+        if not words:
+            return
+
+        new_x = new_y = None
+        offset_i = offset_j = 0.0
+        dwell = None
+        for letter, value in words:
+            if letter == 'G':
+                code = float(value)
+                if code in (0, 1, 2, 3):
+                    self.motion = int(code)
+                elif code == 4:
+                    dwell = 0.0
+                elif code == 90:
+                    self.relative = False
+                elif code == 91:
+                    self.relative = True
+            elif letter == 'X':
+                new_x = float(value)
+            elif letter == 'Y':
+                new_y = float(value)
+            elif letter == 'I':
+                offset_i = float(value)
+            elif letter == 'J':
+                offset_j = float(value)
+            elif letter == 'F':
+                self.feed = float(value)
+            elif letter == 'P' and dwell is not None:
+                dwell = float(value)
+            elif letter == 'M' and int(float(value)) in self.pen_commands:
+                # GRBL finishes all motion before changing the spindle/servo
+                self.dwell_time += self.servo_dwell
+                self.stop_next = True
+
+        if dwell is not None:
+            self.dwell_time += dwell
+            self.stop_next = True
+            return
+        if new_x is None and new_y is None:
+            return
+        start = (self.x, self.y)
+        if self.relative:
+            self.x += new_x or 0.0
+            self.y += new_y or 0.0
+        else:
+            self.x = self.x if new_x is None else new_x
+            self.y = self.y if new_y is None else new_y
+        if self.motion in (2, 3):
+            # GRBL draws arcs as short chords; time those
+            points = arc_points(start, (self.x, self.y), (start[0] + offset_i, start[1] + offset_j),
+                                self.motion == 2)
+        else:
+            points = [(self.x, self.y)]
+        feed = self.max_rate if self.motion == 0 else min(self.feed, self.max_rate)
+        for point in points:
+            self.points.append(point)
+            self.feeds.append(feed)
+            self.stops.append(self.stop_next)
+            self.line_numbers.append(self.line_number)
+            self.stop_next = False
+
+
+def _moving_moves(start, points, stops):
+    """
+    Drop zero-length moves.  Returns the deltas and lengths of all moves, the
+    mask of moves that go somewhere, and their stop flags: a stop requested
+    before a zero-length move still applies to the next real move.
+    """
+    deltas = np.diff(np.vstack([np.asarray(start, dtype=float).reshape(1, 2), points]), axis=0)
+    lengths = np.hypot(deltas[:, 0], deltas[:, 1])
+    moving = lengths > 0
+    pending = np.cumsum(np.asarray(stops, dtype=bool))[moving]
+    stop = np.diff(np.concatenate([[0], pending])) > 0
+    return deltas, lengths, moving, stop
+
+
+class PlotTimeEstimator:
+    """
+    Estimate plot time from GRBL-style machine settings.  Defaults match the
+    GRBL settings the plotter ships with: $110/$111 max rate (mm/min),
+    $120/$121 acceleration (mm/s^2) and $11 junction deviation (mm).
+    servo_dwell is the time each M03/M05 pen move takes.
+    """
+
+    def __init__(self, acceleration=10.0, max_rate=500.0, junction_deviation=0.01, servo_dwell=0.5,
+                 pen_commands=("M03", "M3", "M05", "M5")):
+        self.acceleration = acceleration
+        self.max_rate = max_rate
+        self.junction_deviation = junction_deviation
+        self.servo_dwell = servo_dwell
+        self.pen_commands = {int(command[1:]) for command in pen_commands}
+
+    def parse(self, gcode, start=(0.0, 0.0)):
+        """
+        Parse G-code (a string or an iterable of lines) into a ParsedProgram.
+        Handles G0-G3 moves, G90/G91, modal F words, G4 dwells and pen commands.
+        """
+        if isinstance(gcode, str):
+            gcode = gcode.split('\n')
+        parser = _ProgramParser(self, start)
+        for line in gcode:
+            parser.feed_line(line)
+        return ParsedProgram(
+            np.asarray(start, dtype=float),
+            np.asarray(parser.points, dtype=float).reshape(-1, 2),
+            np.asarray(parser.feeds, dtype=float),
+            np.asarray(parser.stops, dtype=bool),
+            parser.dwell_time,
+            np.asarray(parser.line_numbers, dtype=np.int64),
+        )
+
+    def estimate(self, gcode, start=(0.0, 0.0)):
+        """Estimate the run time of a G-code program (string, lines or ParsedProgram)"""
+        program = gcode if isinstance(gcode, ParsedProgram) else self.parse(gcode, start)
+        return self.estimate_moves(program.start, program.points, program.feeds, program.stops,
+                                   program.dwell_time, program.line_numbers)
+
+    def estimate_strokes(self, program, drawing_speed, start=(0.0, 0.0)):
+        """
+        Estimate a StrokeProgram directly, without formatting or parsing
+        G-code.  Times the program an emitter would produce for it: lift the
+        pen, rapid to program.start, then draw with G1 at drawing_speed and
+        travel with G0.
+        """
+        points, feeds, stops, pen_commands = program.moves(self.max_rate, min(drawing_speed, self.max_rate))
+        return self.estimate_moves(start,
+                                   np.vstack([np.asarray(program.start).reshape(1, 2), points]),
+                                   np.concatenate([[self.max_rate], feeds]),
+                                   np.concatenate([[True], stops]),
+                                   (pen_commands + 1) * self.servo_dwell)
+
+    def streaming(self, start=(0.0, 0.0)):
+        """Return a StreamingEstimate to feed a program one line at a time"""
+        return StreamingEstimate(self, start)
+
+    def estimate_moves(self, start, points, feeds, stops, dwell_time=0.0, line_numbers=None):
+        """
+        Time a sequence of XY moves.  points are the move end points, feeds the
+        requested speeds (mm/min) and stops marks moves the machine must start
+        from rest (after a pen command or dwell).
+        """
+        deltas, lengths, moving, stop = _moving_moves(start, points, stops)
+        segment_times = np.zeros(len(lengths))
+        if line_numbers is None:
+            line_numbers = np.arange(len(lengths))
+        if moving.any():
+            length = lengths[moving]
+            segment_times[moving], _ = self._plan(length, deltas[moving] / length[:, None],
+                                                  np.asarray(feeds, dtype=float)[moving], stop)
+        return PlotEstimate(segment_times, lengths, dwell_time, line_numbers)
+
+    def _plan(self, length, units, feeds, stop, entry_speed_sq=0.0):
+        """
+        Plan moves of nonzero length the way GRBL does.  Returns the time of
+        every move and the squared speed at each of the n + 1 junctions, from
+        entry_speed_sq at the start to rest at the end.
+        """
+        # GRBL scales rate and acceleration so that no single axis exceeds its limit
+        axis_share = np.abs(units).max(axis=1)
+        nominal = np.minimum(feeds / 60.0, self.max_rate / 60.0 / axis_share)
+        accel = self.acceleration / axis_share
+        nominal_sq = nominal ** 2
+
+        # Junction speed limits (squared) between consecutive moves
+        count = len(length)
+        entry_max = np.zeros(count + 1)
+        if count > 1:
+            cos_theta = -np.einsum('ij,ij->i', units[:-1], units[1:])
+            cos_theta = np.clip(cos_theta, -1.0, 1.0)
+            sin_half = np.sqrt(0.5 * (1.0 - cos_theta))
+            junction = (np.minimum(accel[:-1], accel[1:]) * self.junction_deviation * sin_half
+                        / np.maximum(1.0 - sin_half, 1e-12))
+            # Reversals stop the machine; straight-through junctions are only
+            # limited by the moves themselves
+            junction = np.where(cos_theta > 0.999999, 0.0, junction)
+            junction = np.where(cos_theta < -0.999999, np.inf, junction)
+            entry_max[1:-1] = np.minimum(junction, np.minimum(nominal_sq[:-1], nominal_sq[1:]))
+        entry_max[:-1][stop] = 0.0  # Start from rest after pen commands
+        if not stop[0]:
+            entry_max[0] = min(entry_speed_sq, nominal_sq[0])
+        entry_max[-1] = 0.0  # Program ends at rest
+
+        # Look-ahead: v[i]^2 <= v[i+1]^2 + 2*a*d (backward) and
+        # v[i+1]^2 <= v[i]^2 + 2*a*d (forward), solved as running minimums
+        reach = 2.0 * accel * length
+        offsets = np.concatenate([[0.0], np.cumsum(reach)])
+        backward = np.minimum.accumulate((entry_max + offsets)[::-1])[::-1] - offsets
+        speeds_sq = np.clip(np.minimum.accumulate(backward - offsets) + offsets, 0.0, None)
+
+        v0_sq, v1_sq = speeds_sq[:-1], speeds_sq[1:]
+        v0, v1 = np.sqrt(v0_sq), np.sqrt(v1_sq)
+        accel_distance = (nominal_sq - v0_sq) / (2.0 * accel)
+        decel_distance = (nominal_sq - v1_sq) / (2.0 * accel)
+        cruise = length - accel_distance - decel_distance
+
+        # Trapezoid where the move reaches its nominal speed, triangle where it doesn't
+        trapezoid = (nominal - v0) / accel + (nominal - v1) / accel + np.maximum(cruise, 0.0) / nominal
+        peak = np.sqrt(np.maximum(accel * length + 0.5 * (v0_sq + v1_sq), 0.0))
+        peak = np.maximum(peak, np.maximum(v0, v1))
+        triangle = (peak - v0) / accel + (peak - v1) / accel
+        return np.where(cruise >= 0.0, trapezoid, triangle), speeds_sq
+
+
+class StreamingEstimate:
+    """
+    Incremental PlotTimeEstimator.estimate for programs produced line by line.
+
+    Moves are planned in chunks of chunk_moves.  The last lookahead moves of a
+    chunk are planned again with the next one (far more than the machine
+    needs to brake), so the total matches a whole-program estimate while
+    memory stays bounded by the chunk size.
+    """
+
+    def __init__(self, estimator, start=(0.0, 0.0), chunk_moves=4096, lookahead=64):
+        self.estimator = estimator
+        self.chunk_moves = chunk_moves
+        self.lookahead = lookahead
+        self.motion_time = 0.0
+        self.moves = 0
+        self._parser = _ProgramParser(estimator, start)
+        self._position = np.asarray(start, dtype=float)
+        self._entry_speed_sq = 0.0
+
+    @property
+    def total_time(self):
+        return self.motion_time + self._parser.dwell_time
+
+    def feed(self, line):
+        self._parser.feed_line(line)
+        if len(self._parser.points) >= self.chunk_moves:
+            self._plan_chunk(final=False)
+
+    def feed_lines(self, lines):
+        for line in lines:
+            self.feed(line)
+
+    def finish(self):
+        """Plan the remaining moves and return the total time in seconds"""
+        self._plan_chunk(final=True)
+        return self.total_time
+
+    def _plan_chunk(self, final):
+        parser = self._parser
+        if not parser.points:
+            return
+        points = np.asarray(parser.points, dtype=float)
+        deltas, lengths, moving, stop = _moving_moves(self._position, points, parser.stops)
+        # A stop requested before trailing zero-length moves applies to
+        # whatever move comes next
+        trailing = np.flatnonzero(moving)
+        tail = parser.stops[trailing[-1] + 1:] if len(trailing) else parser.stops
+        if any(tail):
+            parser.stop_next = True
+
+        points, feeds, length = points[moving], np.asarray(parser.feeds, dtype=float)[moving], lengths[moving]
+        keep = len(length) if final else max(len(length) - self.lookahead, 0)
+        if keep:
+            times, speeds_sq = self.estimator._plan(length, deltas[moving] / length[:, None], feeds, stop,
+                                                    self._entry_speed_sq)
+            self.motion_time += float(times[:keep].sum())
+            self.moves += keep
+            self._entry_speed_sq = float(speeds_sq[keep])
+            self._position = points[keep - 1]
+
+        # Moves that were only planned as look-ahead go back in the queue
+        parser.points = [tuple(point) for point in points[keep:].tolist()]
+        parser.feeds = feeds[keep:].tolist()
+        parser.stops = stop[keep:].tolist()
+        parser.line_numbers = []
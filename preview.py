@@ -0,0 +1,251 @@
+"""
+Raster previews of plot jobs, for checking a job before it is sent.
+
+Moves are collected as NumPy arrays of line segments (pen-down ink and
+pen-up travel) from StrokePrograms or from G-code, and drawn in one go: every
+segment is sampled once per pixel along its longer axis, and all samples of
+all segments are written into the image with a single fancy-indexing
+assignment.  A full page renders in a few milliseconds.
+
+Moves that leave the paper (page_width x page_height mm, origin at the
+bottom left, as for the SVG emitter) are flagged and drawn in red on a margin
+around the page.
+
+    python preview.py job.gcode -o job.png
+"""
+import re
+import struct
+import zlib
+
+import numpy as np
+
+from geometry import arc_points
+
+# Colours of the rendered image, indexed by the values in the canvas
+MARGIN, PAPER, TRAVEL, INK, OUT_OF_BOUNDS = range(5)
+PALETTE = np.array([
+    (215, 215, 215),
+    (255, 255, 255),
+    (120, 170, 255),
+    (0, 0, 0),
+    (230, 0, 0),
+], dtype=np.uint8)
+
+_WORD = re.compile(r"([A-Z])\s*([-+]?\d*\.?\d+)")
+_PAREN_COMMENT = re.compile(r"\(.*?\)")
+
+
+class Preview:
+    """
+    Line segments of a job on a page of page_width x page_height mm.  Add
+    StrokePrograms or G-code, then render() or check ok / out_of_bounds.
+    """
+
+    def __init__(self, page_width=210, page_height=297, scale=4.0, margin=10.0):
+        self.page_width = page_width
+        self.page_height = page_height
+        self.scale = scale  # Pixels per mm
+        self.margin = margin  # mm of surroundings drawn around the page
+        self._segments = []  # (n, 4) arrays of x0, y0, x1, y1
+        self._ink = []  # (n,) True for pen-down segments
+
+    def _add(self, starts, ends, ink):
+        if len(starts):
+            self._segments.append(np.hstack([starts, ends]))
+            self._ink.append(np.broadcast_to(np.asarray(ink, dtype=bool), len(starts)))
+
+    def add_program(self, program):
+        """Add a StrokeProgram's strokes and the travel moves between them"""
+        program = program.flattened()
+        if not len(program):
+            return
+        previous = np.vstack([np.asarray(program.start).reshape(1, 2), program.stroke_ends()[:-1]])
+        starts = program.stroke_starts()
+        moved = np.any(starts != previous, axis=1)
+        self._add(previous[moved], starts[moved], False)
+        # Consecutive vertices within a stroke
+        inside = np.ones(len(program.vertices) - 1, dtype=bool)
+        inside[program.stroke_offsets[1:-1] - 1] = False
+        self._add(program.vertices[:-1][inside], program.vertices[1:][inside], True)
+
+    def add_gcode(self, lines, start=(0.0, 0.0), pen_down=5, pen_up=3):
+        """
+        Add G-code (a string or an iterable of lines).  M pen_down lowers the
+        pen and M pen_up raises it, as in this project's M05/M03; G2/G3 arcs
+        are cut into chords the way GRBL draws them.
+        """
+        if isinstance(lines, str):
+            lines = lines.splitlines()
+        x, y = start
+        motion, relative, down = 0, False, False
+        starts, ends, ink = [], [], []
+        for line in lines:
+            comment = line.find(';')
+            if comment >= 0:
+                line = line[:comment]
+            if '(' in line:
+                line = _PAREN_COMMENT.sub('', line)
+            new_x = new_y = None
+            offset_i = offset_j = 0.0
+            for letter, value in _WORD.findall(line.upper()):
+                if letter == 'G':
+                    code = float(value)
+                    if code in (0, 1, 2, 3):
+                        motion = int(code)
+                    elif code == 90:
+                        relative = False
+                    elif code == 91:
+                        relative = True
+                elif letter == 'X':
+                    new_x = float(value)
+                elif letter == 'Y':
+                    new_y = float(value)
+                elif letter == 'I':
+                    offset_i = float(value)
+                elif letter == 'J':
+                    offset_j = float(value)
+                elif letter == 'M':
+                    code = int(float(value))
+                    if code == pen_down:
+                        down = True
+                    elif code == pen_up:
+                        down = False
+            if new_x is None and new_y is None:
+                continue
+            previous = (x, y)
+            if relative:
+                x += new_x or 0.0
+                y += new_y or 0.0
+            else:
+                x = x if new_x is None else new_x
+                y = y if new_y is None else new_y
+            if motion in (2, 3):
+                points = arc_points(previous, (x, y), (previous[0] + offset_i, previous[1] + offset_j),
+                                    motion == 2)
+            else:
+                points = [(x, y)]
+            for point in points:
+                starts.append(previous)
+                ends.append(point)
+                ink.append(down)
+                previous = point
+        self._add(np.array(starts, dtype=float).reshape(-1, 2), np.array(ends, dtype=float).reshape(-1, 2),
+                  ink)
+
+    def segments(self):
+        """(n, 4) array of x0, y0, x1, y1 and the (n,) pen-down mask"""
+        if not self._segments:
+            return np.zeros((0, 4)), np.zeros(0, dtype=bool)
+        return np.vstack(self._segments), np.concatenate(self._ink)
+
+    def out_of_bounds(self):
+        """Mask of segments with an end off the paper"""
+        segments, _ = self.segments()
+        x, y = segments[:, 0::2], segments[:, 1::2]
+        outside = (x < 0) | (x > self.page_width) | (y < 0) | (y > self.page_height)
+        return outside.any(axis=1)
+
+    @property
+    def ok(self):
+        return not self.out_of_bounds().any()
+
+    def bounds(self):
+        """(min_x, min_y, max_x, max_y) of all segments, or None if empty"""
+        segments, _ = self.segments()
+        if not len(segments):
+            return None
+        x, y = segments[:, 0::2], segments[:, 1::2]
+        return float(x.min()), float(y.min()), float(x.max()), float(y.max())
+
+    def problems(self):
+        """Descriptions of what is wrong with the job; empty if it fits the page"""
+        outside = self.out_of_bounds()
+        if not outside.any():
+            return []
+        _, ink = self.segments()
+        min_x, min_y, max_x, max_y = self.bounds()
+        return [f"{int((outside & ink).sum())} drawing and {int((outside & ~ink).sum())} travel moves leave "
+                f"the {self.page_width}x{self.page_height} mm page (x {min_x:.1f} to {max_x:.1f}, "
+                f"y {min_y:.1f} to {max_y:.1f})"]
+
+    def canvas(self):
+        """
+        The page as an (height, width) uint8 array of PALETTE indices; one
+        byte a pixel keeps filling and drawing cheap
+        """
+        scale, margin = self.scale, self.margin
+        width = int(np.ceil((self.page_width + 2 * margin) * scale))
+        height = int(np.ceil((self.page_height + 2 * margin) * scale))
+        image = np.full((height, width), MARGIN, dtype=np.uint8)
+        page = slice(int(margin * scale), int((margin + self.page_height) * scale))
+        image[page, int(margin * scale):int((margin + self.page_width) * scale)] = PAPER
+
+        segments, ink = self.segments()
+        if not len(segments):
+            return image
+        # Pixel coordinates, y pointing down
+        px = (segments[:, 0::2] + margin) * scale
+        py = (self.page_height + margin - segments[:, 1::2]) * scale
+        colours = np.where(ink, INK, TRAVEL).astype(np.uint8)
+        colours[self.out_of_bounds()] = OUT_OF_BOUNDS
+
+        # Travel first so ink is drawn over it
+        order = np.argsort(ink, kind="stable")
+        px, py, colours = px[order], py[order], colours[order]
+        samples = np.ceil(np.maximum(np.abs(px[:, 1] - px[:, 0]), np.abs(py[:, 1] - py[:, 0]))).astype(np.int64) + 1
+        segment = np.repeat(np.arange(len(samples)), samples)
+        first = np.cumsum(samples) - samples
+        t = (np.arange(len(segment)) - first[segment]) / np.maximum(samples - 1, 1)[segment]
+        columns = np.rint(px[segment, 0] + t * (px[segment, 1] - px[segment, 0])).astype(np.int64)
+        rows = np.rint(py[segment, 0] + t * (py[segment, 1] - py[segment, 0])).astype(np.int64)
+        visible = (columns >= 0) & (columns < width) & (rows >= 0) & (rows < height)
+        # With repeated indices the last write wins, so later segments (ink) stay on top
+        image.reshape(-1)[rows[visible] * width + columns[visible]] = colours[segment[visible]]
+        return image
+
+    def render(self):
+        """RGB image of the page as an (height, width, 3) uint8 array"""
+        return PALETTE.take(self.canvas(), axis=0)
+
+    def save(self, path):
+        """Write render() as a PNG file"""
+        with open(path, "wb") as f:
+            f.write(png_bytes(self.render()))
+
+
+def png_bytes(image):
+    """Encode an (height, width, 3) uint8 array as PNG"""
+    height, width, _ = image.shape
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, width * 3)])
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) + chunk(b"IEND", b""))
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render a G-code file to PNG and check it fits the page")
+    parser.add_argument("gcode", help="G-code file")
+    parser.add_argument("-o", "--output", help="PNG file to write (default: next to the G-code)")
+    parser.add_argument("--page", type=float, nargs=2, default=(210, 297), metavar=("WIDTH", "HEIGHT"),
+                        help="Paper size in mm")
+    parser.add_argument("--scale", type=float, default=4.0, help="Pixels per mm")
+    args = parser.parse_args(argv)
+
+    preview = Preview(*args.page, scale=args.scale)
+    with open(args.gcode) as f:
+        preview.add_gcode(f)
+    output = args.output or args.gcode.rsplit(".", 1)[0] + ".png"
+    preview.save(output)
+    print(f"Preview saved to {output}")
+    for problem in preview.problems():
+        print(problem)
+    return 0 if preview.ok else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,340 @@
+"""
+Concurrent speech capture and recognition.
+
+A capture thread keeps listening while earlier utterances are being
+recognized: each utterance gets a sequence number and goes to a pool of
+recognizer workers, and results come back in sequence order however long
+each recognition took.  Audio sources and recognizers are pluggable:
+
+    MicrophoneSource      live audio (speech_recognition.Microphone)
+    WavReplaySource       replays WAV files, for offline runs and load tests
+
+    GoogleRecognizer      Google Web Speech API (needs network)
+    SphinxRecognizer      CMU PocketSphinx, offline
+    VoskRecognizer        Vosk/Kaldi model directory, offline
+    TranscriptRecognizer  stub that reads the text next to each replayed WAV
+
+Recognizers raise speech_recognition's UnknownValueError and RequestError,
+as the Google recognizer always has.  speech_recognition (and PyAudio with
+it) is imported by the classes that use it, when they are used, so code that
+only compiles text does not load the audio stack.
+
+The microphone's ambient-noise calibration is kept per device in a JSON file
+(see load_calibration): a warm start reuses the saved energy threshold
+instead of listening to the room first, and the recognizer keeps adapting
+the threshold while it waits for speech, which is saved again as it changes.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from pipeline import BoundedQueue, QueueClosed
+
+logger = logging.getLogger(__name__)
+
+
+class Utterance:
+    """Recognition result for one captured utterance"""
+
+    def __init__(self, sequence, text=None, error=None, silence=False, latency=0.0, captured=None):
+        self.sequence = sequence
+        self.captured = captured  # time.monotonic() when the utterance ended
+        self.text = text
+        self.error = error  # sr.UnknownValueError, sr.RequestError or other exception
+        self.silence = silence  # Nothing was said before the listen timeout
+        self.latency = latency  # Seconds spent recognizing
+
+
+def load_calibration(path, device):
+    """Energy threshold saved for device in the JSON file at path, or None"""
+    try:
+        with open(path) as f:
+            return float(json.load(f)[device]["energy_threshold"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def save_calibration(path, device, energy_threshold):
+    """Store device's energy threshold in the JSON file at path, keeping other devices'"""
+    try:
+        with open(path) as f:
+            calibrations = json.load(f)
+    except (OSError, ValueError):
+        calibrations = {}
+    calibrations[device] = {"energy_threshold": energy_threshold, "saved": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    temporary = path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump(calibrations, f, indent=2)
+    os.replace(temporary, path)
+
+
+class MicrophoneSource:
+    """
+    Live audio.  With calibration_file, the energy threshold is loaded from
+    and saved to that file per microphone, and the blocking calibration only
+    runs when nothing is saved yet or recalibrate is set.
+    """
+
+    def __init__(self, recognizer=None, device_index=None, listen_timeout=5, calibration=2,
+                 calibration_file=None, recalibrate=False):
+        import speech_recognition as sr
+
+        self.recognizer = recognizer or sr.Recognizer()
+        self.device_index = device_index
+        self.listen_timeout = listen_timeout
+        self.calibration = calibration  # Seconds of ambient noise to calibrate on
+        self.calibration_file = calibration_file
+        self.recalibrate = recalibrate
+        self._saved_threshold = None
+
+    def device_name(self):
+        """Key of this microphone in the calibration file"""
+        if self.device_index is None:
+            return "default"
+        import speech_recognition as sr
+
+        names = sr.Microphone.list_microphone_names()
+        if self.device_index < len(names):
+            return f"{self.device_index}: {names[self.device_index]}"
+        return str(self.device_index)
+
+    def _calibrate(self, source, device):
+        threshold = None
+        if self.calibration_file and not self.recalibrate:
+            threshold = load_calibration(self.calibration_file, device)
+        if threshold is None:
+            self.recognizer.adjust_for_ambient_noise(source, duration=self.calibration)
+            logger.info(f"Calibrated {device}: energy threshold {self.recognizer.energy_threshold:.0f}")
+        else:
+            self.recognizer.energy_threshold = threshold
+            self._saved_threshold = threshold
+            logger.info(f"Using the saved energy threshold {threshold:.0f} for {device}")
+        # listen() goes on adjusting the threshold to the noise while it waits
+        # for speech, so the calibration follows the room without blocking
+        self.recognizer.dynamic_energy_threshold = True
+
+    def _save_calibration(self, device):
+        """Save the current threshold once it has drifted from the saved one"""
+        threshold = self.recognizer.energy_threshold
+        if not self.calibration_file or (self._saved_threshold is not None
+                                         and abs(threshold - self._saved_threshold) <= 0.05 * self._saved_threshold):
+            return
+        try:
+            save_calibration(self.calibration_file, device, threshold)
+            self._saved_threshold = threshold
+        except OSError as e:
+            logger.warning(f"Could not save the microphone calibration: {e}")
+
+    def utterances(self, running):
+        """Yield AudioData per utterance, or None after listen_timeout of silence"""
+        import speech_recognition as sr
+
+        with sr.Microphone(device_index=self.device_index) as source:
+            device = self.device_name()
+            self._calibrate(source, device)
+            self._save_calibration(device)
+            logger.info("Listening...")
+            try:
+                while running():
+                    try:
+                        yield self.recognizer.listen(source, timeout=self.listen_timeout)
+                    except sr.WaitTimeoutError:
+                        self._save_calibration(device)
+                        yield None
+            finally:
+                self._save_calibration(device)
+
+
+class WavReplaySource:
+    """
+    Replays WAV (or AIFF/FLAC) files as utterances, optionally at the pace
+    they were recorded, followed by a silence.  Each AudioData gets a
+    source_path attribute naming its file.
+    """
+
+    def __init__(self, paths, realtime=False):
+        self.paths = list(paths)
+        self.realtime = realtime
+
+    def utterances(self, running):
+        import speech_recognition as sr
+
+        recognizer = sr.Recognizer()
+        for path in self.paths:
+            if not running():
+                return
+            with sr.AudioFile(path) as source:
+                audio = recognizer.record(source)
+            audio.source_path = path
+            if self.realtime:
+                time.sleep(len(audio.frame_data) / (audio.sample_rate * audio.sample_width))
+            yield audio
+        yield None
+
+
+class GoogleRecognizer:
+    def __init__(self, recognizer=None, language="en-US"):
+        import speech_recognition as sr
+
+        self.recognizer = recognizer or sr.Recognizer()
+        self.language = language
+
+    def recognize(self, audio):
+        return self.recognizer.recognize_google(audio, language=self.language)
+
+
+class SphinxRecognizer:
+    def __init__(self, recognizer=None, language="en-US"):
+        import speech_recognition as sr
+
+        self.recognizer = recognizer or sr.Recognizer()
+        self.language = language
+
+    def recognize(self, audio):
+        return self.recognizer.recognize_sphinx(audio, language=self.language)
+
+
+class VoskRecognizer:
+    """Offline recognition with a Vosk model directory (pip install vosk)"""
+
+    def __init__(self, model_path, sample_rate=16000):
+        import speech_recognition as sr
+
+        try:
+            import vosk
+        except ImportError:
+            raise sr.RequestError("Vosk is not installed (pip install vosk)")
+        if not os.path.isdir(model_path):
+            raise sr.RequestError(f"Vosk model not found: {model_path}")
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self.model = vosk.Model(model_path)  # Shared by all workers; loading it is slow
+        self.sample_rate = sample_rate
+
+    def recognize(self, audio):
+        # A KaldiRecognizer holds decoding state, so each utterance gets its own
+        recognizer = self._vosk.KaldiRecognizer(self.model, self.sample_rate)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=self.sample_rate, convert_width=2))
+        text = json.loads(recognizer.FinalResult()).get("text", "")
+        if not text:
+            import speech_recognition as sr
+
+            raise sr.UnknownValueError()
+        return text
+
+
+class TranscriptRecognizer:
+    """
+    Stub for WavReplaySource audio: returns the contents of the .txt file
+    next to each WAV file after latency seconds, to stand in for a
+    recognition service in load tests
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def recognize(self, audio):
+        import speech_recognition as sr
+
+        path = getattr(audio, "source_path", None)
+        if self.latency:
+            time.sleep(self.latency)
+        if path is None:
+            raise sr.UnknownValueError()
+        try:
+            with open(os.path.splitext(path)[0] + ".txt") as f:
+                text = f.read().strip()
+        except OSError as e:
+            raise sr.RequestError(f"No transcript for {path}: {e}")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+
+# Recognizers by name, for the command line
+RECOGNIZERS = {
+    "google": GoogleRecognizer,
+    "sphinx": SphinxRecognizer,
+    "vosk": VoskRecognizer,
+    "transcript": TranscriptRecognizer,
+}
+
+
+class SpeechCapture:
+    """
+    Capture utterances from source on one thread and recognize them on a
+    pool of workers.  Iterate over the capture to get Utterances in the order
+    they were spoken.  At most max_pending utterances are captured ahead of
+    the consumer; past that the capture thread waits.
+    """
+
+    def __init__(self, source, recognizer, workers=4, max_pending=8):
+        self.source = source
+        self.recognizer = recognizer
+        self.workers = workers
+        self._pending = BoundedQueue(maxsize=max_pending)  # Futures in capture order
+        self._executor = None
+        self._thread = None
+        self._running = False
+        self.error = None  # Exception that stopped the capture thread, if any
+
+    def start(self):
+        self._running = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="recognizer")
+        self._thread = threading.Thread(target=self._capture, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop capturing; utterances already captured are dropped"""
+        self._running = False
+        self._pending.close()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def _recognize(self, sequence, audio, captured):
+        started = time.monotonic()
+        try:
+            text = self.recognizer.recognize(audio).strip()
+            return Utterance(sequence, text, latency=time.monotonic() - started, captured=captured)
+        except Exception as e:
+            return Utterance(sequence, error=e, latency=time.monotonic() - started, captured=captured)
+
+    def _capture(self):
+        sequence = 0
+        try:
+            for audio in self.source.utterances(lambda: self._running):
+                captured = time.monotonic()
+                if audio is None:
+                    future = Future()
+                    future.set_result(Utterance(sequence, silence=True, captured=captured))
+                else:
+                    future = self._executor.submit(self._recognize, sequence, audio, captured)
+                self._pending.put(future)  # Waits while the consumer is behind
+                sequence += 1
+        except QueueClosed:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            self._pending.close()
+
+    def __iter__(self):
+        """Yield Utterances in capture order until the source ends or stop()"""
+        for future in self._pending:
+            if future.cancelled():
+                continue
+            yield future.result()
+        if self._executor:
+            self._executor.shutdown(wait=False)
+        if self.error:
+            raise self.error
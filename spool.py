@@ -0,0 +1,364 @@
+"""
+Durable job spool, so a crash or power loss loses neither the queued speech
+nor the place a plot had reached.
+
+Everything goes to an append-only journal of JSON lines in the spool
+directory:
+
+    {"type": "batch", "batch": 3, "text": "..."}             text entered the pipeline
+    {"type": "compiled", "batch": 3, "file": ..., "cursor": [x, y, page], ...}
+    {"type": "checkpoint", "batch": 3, "line": 120, "pen_down": true, "position": [x, y]}
+    {"type": "done", "batch": 3}                               plotted (or given up on)
+
+Compiled jobs are written into the spool directory instead of loose files in
+the working directory.  Appending a record is a buffered write; a background
+thread fsyncs the journal at most every sync_interval seconds, so many
+records share one fsync and none of the pipeline's stages waits for the disk.
+
+On the next start recover() reads the journal back (a record torn by the
+crash is ignored), compacts it to the state record and the unfinished
+batches, and removes the job files nothing refers to any more.  Compiled jobs
+resume from their last checkpoint.  GRBL acknowledges a line as soon as it is
+in the planner, up to UNDRAWN_LINES moves before it is drawn, so a resumed
+job starts that many lines before the checkpoint; a pen retracing a few
+strokes leaves no mark.  The lines before that point are replayed through
+ProgramState to get the pen state, position and modal settings the resumed
+program has to restore first.
+"""
+import collections
+import json
+import logging
+import os
+import re
+import threading
+
+from grbl_streamer import PROGRAM_PAUSES, clean_line
+from pipeline import Job
+
+logger = logging.getLogger(__name__)
+
+JOURNAL = "journal.jsonl"
+UNDRAWN_LINES = 16  # GRBL's planner holds 15 moves besides the one being drawn
+
+_WORD = re.compile(r"([A-Z])\s*([-+]?\d*\.?\d+)")
+
+
+class Journal:
+    """Append-only JSON-lines file, fsynced in batches by a background thread"""
+
+    def __init__(self, path, sync_interval=0.2):
+        self.path = path
+        self.sync_interval = sync_interval
+        self._file = open(path, "a", encoding="utf-8")
+        self._condition = threading.Condition()
+        self._written = 0  # Records appended
+        self._synced = 0  # Records known to be on disk
+        self._closed = False
+        self._thread = threading.Thread(target=self._sync_loop, name="journal", daemon=True)
+        self._thread.start()
+
+    def append(self, record, sync=False):
+        """Append a record; with sync, return only once it is on disk"""
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._condition:
+            if self._closed:
+                raise ValueError("append() on a closed journal")
+            self._file.write(line)
+            self._written += 1
+            number = self._written
+            self._condition.notify_all()
+            if sync:
+                self._condition.wait_for(lambda: self._synced >= number or self._closed)
+
+    def _sync(self):
+        with self._condition:
+            self._file.flush()
+            number = self._written
+        os.fsync(self._file.fileno())
+        with self._condition:
+            self._synced = max(self._synced, number)
+            self._condition.notify_all()
+
+    def _sync_loop(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._written > self._synced or self._closed)
+                if self._closed:
+                    return
+            try:
+                self._sync()
+            except (OSError, ValueError) as e:
+                logger.error(f"Could not sync {self.path}: {e}")
+            # Records appended meanwhile wait for the next round
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed, self.sync_interval)
+
+    def close(self):
+        """Sync whatever is left and close the file"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._sync()
+        self._file.close()
+
+
+def read_journal(path):
+    """The records of a journal, skipping a last line torn by a crash"""
+    records = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"{path}:{number}: unreadable journal record skipped")
+    except FileNotFoundError:
+        pass
+    return records
+
+
+class ProgramState:
+    """
+    Modal state of a G-code program after the lines fed to it: position,
+    absolute or relative moves, motion mode, feed and pen, as this project's
+    emitters write them
+    """
+
+    def __init__(self, pen_up_cmd="M03 S90", pen_down_cmd="M05"):
+        self.pen_up_cmd = pen_up_cmd
+        self.pen_down_cmd = pen_down_cmd
+        self.position = (0.0, 0.0)
+        self.relative = False
+        self.motion = 0
+        self.feed = None
+        self.pen_down = False
+
+    def feed_line(self, line):
+        line = clean_line(line)
+        if line == self.pen_down_cmd:
+            self.pen_down = True
+            return
+        if line == self.pen_up_cmd:
+            self.pen_down = False
+            return
+        x = y = None
+        for letter, value in _WORD.findall(line.upper()):
+            if letter == 'G':
+                code = float(value)
+                if code in (0, 1, 2, 3):
+                    self.motion = int(code)
+                elif code == 90:
+                    self.relative = False
+                elif code == 91:
+                    self.relative = True
+            elif letter == 'X':
+                x = float(value)
+            elif letter == 'Y':
+                y = float(value)
+            elif letter == 'F':
+                self.feed = value
+        if self.relative:
+            self.position = (self.position[0] + (x or 0.0), self.position[1] + (y or 0.0))
+        else:
+            self.position = (self.position[0] if x is None else x, self.position[1] if y is None else y)
+
+    def header(self):
+        """Lines that bring a freshly started GRBL into this state"""
+        x, y = (round(value, 4) for value in self.position)
+        lines = ["G21", "G90", self.pen_up_cmd, f"G0 X{x} Y{y}"]
+        if self.feed is not None:
+            lines.append(f"F{self.feed}")
+        if self.relative:
+            lines.append("G91")
+        if self.pen_down:
+            lines.append(self.pen_down_cmd)
+        return lines
+
+    def continue_with(self, line):
+        """line, with the motion mode written out if it relies on the modal one"""
+        line = clean_line(line)
+        if line[:1] in ("X", "Y", "I", "J", "F"):
+            return f"G{self.motion} {line}"
+        return line
+
+
+class Recovery:
+    """What the last run left unfinished"""
+
+    def __init__(self):
+        self.cursor = None  # Layout (x, y, page) after the last compiled batch
+        self.next_batch = 1
+        self.batches = []  # Jobs journaled but never compiled, in order
+        self.jobs = []  # Compiled Jobs not yet plotted, in order, with resume_from set from their checkpoints
+
+
+class Spool:
+    """
+    The journal and job files in directory.  Opening a spool recovers what
+    the previous run left (see recovered) before anything new is journaled.
+    """
+
+    def __init__(self, directory, sync_interval=0.2, pen_up_cmd="M03 S90", pen_down_cmd="M05"):
+        self.directory = directory
+        self.pen_up_cmd = pen_up_cmd
+        self.pen_down_cmd = pen_down_cmd
+        os.makedirs(os.path.join(directory, "jobs"), exist_ok=True)
+        self.recovered = self._recover(read_journal(os.path.join(directory, JOURNAL)))
+        self.journal = Journal(os.path.join(directory, JOURNAL), sync_interval)
+
+    def close(self):
+        self.journal.close()
+
+    def job_path(self, batch_id):
+        return os.path.join(self.directory, "jobs", f"batch_{batch_id:06d}.gcode")
+
+    def _recover(self, records):
+        recovery = Recovery()
+        batches = collections.OrderedDict()  # batch -> text
+        compiled = {}
+        checkpoints = {}
+        done = set()
+        for record in records:
+            kind, batch = record.get("type"), record.get("batch")
+            if kind == "state":
+                recovery.cursor = record["cursor"]
+                recovery.next_batch = record["next_batch"]
+            elif kind == "batch":
+                batches[batch] = record["text"]
+            elif kind == "compiled":
+                compiled[batch] = record
+                recovery.cursor = record["cursor"]
+            elif kind == "checkpoint":
+                checkpoints[batch] = record
+            elif kind == "done":
+                done.add(batch)
+            if batch is not None:
+                recovery.next_batch = max(recovery.next_batch, batch + 1)
+
+        for batch, text in batches.items():
+            if batch in done:
+                continue
+            job = Job(batch, text)
+            record = compiled.get(batch)
+            if record is None:
+                recovery.batches.append(job)
+                continue
+            if not os.path.exists(record["file"]):
+                logger.warning(f"Batch {batch}: {record['file']} is gone; the batch is dropped")
+                continue
+            job.gcode_file, job.plotting_time = record["file"], record["plotting_time"]
+            job.preamble = record.get("preamble")
+            job.page_breaks = record.get("page_breaks", [])
+            job.resume_from = checkpoints.get(batch, {}).get("line", 0)
+            recovery.jobs.append(job)
+        self._compact(recovery, compiled, checkpoints)
+        if recovery.jobs or recovery.batches:
+            logger.info(f"Spool: {len(recovery.jobs)} compiled and {len(recovery.batches)} uncompiled batches "
+                        f"left by the last run")
+        return recovery
+
+    def _compact(self, recovery, compiled, checkpoints):
+        """Rewrite the journal with only what is still needed, and delete unused job files"""
+        records = [{"type": "state", "cursor": recovery.cursor, "next_batch": recovery.next_batch}]
+        keep = set()
+        for job in recovery.jobs:
+            records.append({"type": "batch", "batch": job.batch_id, "text": job.text})
+            records.append(compiled[job.batch_id])
+            if job.batch_id in checkpoints:
+                records.append(checkpoints[job.batch_id])
+            keep.add(os.path.abspath(job.gcode_file))
+        for job in recovery.batches:
+            records.append({"type": "batch", "batch": job.batch_id, "text": job.text})
+        path = os.path.join(self.directory, JOURNAL)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        jobs = os.path.join(self.directory, "jobs")
+        for name in os.listdir(jobs):
+            if os.path.abspath(os.path.join(jobs, name)) not in keep:
+                try:
+                    os.remove(os.path.join(jobs, name))
+                except OSError as e:
+                    logger.warning(f"Could not remove spooled {name}: {e}")
+
+    def record_batch(self, job):
+        self.journal.append({"type": "batch", "batch": job.batch_id, "text": job.text})
+
+    def record_compiled(self, job, cursor):
+        """job has been compiled to job.gcode_file; cursor is the layout (x, y, page) after it"""
+        record = {"type": "compiled", "batch": job.batch_id, "file": job.gcode_file,
+                  "plotting_time": job.plotting_time, "cursor": list(cursor), "page_breaks": job.page_breaks}
+        if job.preamble:
+            record["preamble"] = job.preamble
+        self.journal.append(record)
+
+    def record_done(self, job, error=None):
+        record = {"type": "done", "batch": job.batch_id}
+        if error:
+            record["error"] = str(error)
+        self.journal.append(record)
+
+    def stream_lines(self, job, streamer, every=50):
+        """
+        Yield the lines of job.gcode_file to send to GRBL through streamer,
+        from where job.resume_from says the last run stopped, and journal a
+        checkpoint every every lines GRBL acknowledges.  Meant as the lines
+        argument of GrblStreamer.stream, which sends one line per line yielded.
+        A page break GRBL had acknowledged was passed (the paper changed), so
+        it is not sent again, and job.page_breaks loses the pages passed.
+        """
+        start = max(job.resume_from - UNDRAWN_LINES, 0)
+        replayed = ProgramState(self.pen_up_cmd, self.pen_down_cmd)
+        acknowledged = ProgramState(self.pen_up_cmd, self.pen_down_cmd)
+        for line in job.preamble or ():
+            replayed.feed_line(line)
+            acknowledged.feed_line(line)
+        sent = collections.deque()  # (file lines done once this one is acknowledged, line)
+        base = streamer.lines_acknowledged
+        checkpointed = start
+
+        def send(line, done):
+            nonlocal base, checkpointed
+            sent.append((done, line))
+            # Catch up with the acknowledgements that came in meanwhile
+            answered = streamer.lines_acknowledged - base
+            base += answered
+            progress = None
+            for _ in range(min(answered, len(sent) - 1)):
+                progress, answered_line = sent.popleft()
+                acknowledged.feed_line(answered_line)
+            if progress is not None and progress - checkpointed >= every:
+                self.journal.append({"type": "checkpoint", "batch": job.batch_id, "line": progress,
+                                     "pen_down": acknowledged.pen_down,
+                                     "position": [round(value, 4) for value in acknowledged.position]})
+                checkpointed = progress
+            return line
+
+        passed = 0  # Page breaks before the resume point
+        with open(job.gcode_file) as f:
+            first = True
+            for number, line in enumerate(f):
+                paused = clean_line(line).upper() in PROGRAM_PAUSES
+                if number < job.resume_from and paused:
+                    passed += 1
+                    continue
+                if number < start:
+                    replayed.feed_line(line)
+                    continue
+                if passed:
+                    job.page_breaks, passed = job.page_breaks[passed:], 0
+                if not clean_line(line):
+                    continue
+                if first and start:
+                    logger.info(f"Batch {job.batch_id}: resuming at line {start + 1} of {job.gcode_file}")
+                    for header_line in replayed.header():
+                        yield send(header_line, start)
+                    line = replayed.continue_with(line)
+                first = False
+                yield send(clean_line(line), number + 1)
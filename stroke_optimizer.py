@@ -0,0 +1,99 @@
+"""
+Pen-up travel optimizer for laid-out text.
+
+The strokes of a StrokeProgram (normally one line of text) are reordered
+(nearest neighbour followed by 2-opt) and reversed where that shortens the
+pen-up moves between them.  The 2-opt pass stops after max_passes or once
+time_budget seconds have been spent, whichever comes first; the result is
+never worse than the nearest-neighbour tour.
+"""
+import math
+import time
+
+from strokes import StrokeProgram
+
+
+# The distances in these loops are written out, with the same math as
+# SpeechToGCodeProcessor.calculate_plotting_time, because a function call per
+# distance was most of the optimizer's time
+
+
+def _nearest_neighbour(strokes, position):
+    sqrt = math.sqrt
+    remaining = list(strokes)
+    ordered = []
+    while remaining:
+        x, y = position
+        best_index, best_reversed, best_distance = 0, False, float('inf')
+        for index, stroke in enumerate(remaining):
+            (start_x, start_y), (end_x, end_y) = stroke[0], stroke[-1]
+            to_start = sqrt((start_x - x)**2 + (start_y - y)**2)
+            to_end = sqrt((end_x - x)**2 + (end_y - y)**2)
+            if to_start < best_distance:
+                best_index, best_reversed, best_distance = index, False, to_start
+            if to_end < best_distance:
+                best_index, best_reversed, best_distance = index, True, to_end
+        stroke = remaining.pop(best_index)
+        if best_reversed:
+            stroke = stroke[::-1]
+        ordered.append(stroke)
+        position = stroke[-1]
+    return ordered
+
+
+def _two_opt(strokes, position, deadline, max_passes):
+    """
+    Improve an open stroke tour by reversing runs of strokes.  Reversing the
+    run i..j also reverses the direction of every stroke in it, so only the
+    two pen-up moves at the ends of the run change length.
+    """
+    sqrt = math.sqrt
+    count = len(strokes)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(count - 1):
+            before_x, before_y = strokes[i - 1][-1] if i > 0 else position
+            for j in range(i + 1, count):
+                (first_x, first_y), (last_x, last_y) = strokes[i][0], strokes[j][-1]
+                old = sqrt((first_x - before_x)**2 + (first_y - before_y)**2)
+                new = sqrt((last_x - before_x)**2 + (last_y - before_y)**2)
+                if j + 1 < count:
+                    next_x, next_y = strokes[j + 1][0]
+                    old += sqrt((next_x - last_x)**2 + (next_y - last_y)**2)
+                    new += sqrt((next_x - first_x)**2 + (next_y - first_y)**2)
+                if new < old - 1e-9:
+                    strokes[i:j + 1] = [stroke[::-1] for stroke in reversed(strokes[i:j + 1])]
+                    improved = True
+            if time.perf_counter() > deadline:
+                return strokes
+        if not improved:
+            break
+    return strokes
+
+
+def _order(strokes, position, time_budget, max_passes):
+    deadline = time.perf_counter() + time_budget
+    if len(strokes) > 1:
+        strokes = _nearest_neighbour(strokes, position)
+        strokes = _two_opt(strokes, position, deadline, max_passes)
+    return strokes
+
+
+def optimize_program(program, time_budget=0.05, max_passes=10):
+    """
+    Reorder and reverse the strokes of a StrokeProgram (normally one line of
+    text) to minimize pen-up travel from program.start.  Returns a new
+    StrokeProgram with the same strokes.
+    """
+    # The search only needs each stroke's endpoints, and plain tuples are much
+    # faster to index than array rows.  The middle of (start, index, ~index,
+    # end) reads (~index, index) once the tuple is reversed, which records
+    # the direction even for closed strokes.
+    strokes = [(tuple(start), index, ~index, tuple(end))
+               for index, (start, end) in enumerate(zip(program.stroke_starts().tolist(),
+                                                        program.stroke_ends().tolist()))]
+    pieces = []
+    for _, index, _, _ in _order(strokes, program.start, time_budget, max_passes):
+        pieces.append(program.stroke(index) if index >= 0 else program.stroke(~index)[::-1])
+    return StrokeProgram.from_strokes(pieces, program.start)
+
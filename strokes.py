@@ -0,0 +1,209 @@
+"""
+Compact stroke representation shared by layout, optimization, estimation and
+emission.
+
+A StrokeProgram is a set of pen-down polylines kept in two flat arrays: all
+vertices in one (n, 2) float array and the index where each stroke starts in
+stroke_offsets (with the total vertex count appended).  Pen-up travel is
+implied between the end of one stroke and the start of the next, starting
+from program.start.  No per-point Python objects are involved, so later stages
+work on the arrays directly instead of re-parsing G-code text.
+
+Pen-down moves are straight lines unless the program carries motions: then
+the move ending at a vertex may be a circular arc (G2/G3) around the
+matching entry of centers.
+"""
+import numpy as np
+
+# Motion codes, numbered like the G-code that draws them
+LINE = 1
+CLOCKWISE = 2
+COUNTERCLOCKWISE = 3
+
+
+class StrokeProgram:
+    def __init__(self, vertices, stroke_offsets, start=(0.0, 0.0), motions=None, centers=None):
+        self.vertices = np.asarray(vertices, dtype=float).reshape(-1, 2)
+        self.stroke_offsets = np.asarray(stroke_offsets, dtype=np.int64)
+        self.start = (float(start[0]), float(start[1]))  # Pen position before the first stroke
+        self.motions = motions  # None, or (n,) motion code of the move ending at each vertex
+        self.centers = centers  # None, or (n, 2) arc centers (NaN for lines)
+
+    @classmethod
+    def empty(cls, start=(0.0, 0.0)):
+        return cls(np.zeros((0, 2)), np.zeros(1, dtype=np.int64), start)
+
+    @classmethod
+    def from_points(cls, x, y, pen, start=(0.0, 0.0)):
+        """
+        Build a program from laid-out (x, y, pen_down) vertex arrays.  Every
+        pen-up vertex starts a stroke; pen-up moves that draw nothing (such as
+        spaces) are dropped.
+        """
+        pen = np.asarray(pen, dtype=bool)
+        count = len(pen)
+        starts = np.flatnonzero(~pen)
+        if count and pen[0]:
+            starts = np.concatenate([[0], starts])  # Drawing from wherever the pen already is
+        ends = np.concatenate([starts[1:], [count]])
+        keep = ends - starts > 1
+        starts, ends = starts[keep], ends[keep]
+
+        lengths = ends - starts
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        index = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        vertices = np.column_stack([np.asarray(x, dtype=float)[index], np.asarray(y, dtype=float)[index]])
+        return cls(vertices, offsets, start)
+
+    @classmethod
+    def from_strokes(cls, strokes, start=(0.0, 0.0)):
+        """Build a program from a sequence of (k, 2) vertex arrays"""
+        strokes = [np.asarray(stroke, dtype=float).reshape(-1, 2) for stroke in strokes]
+        if not strokes:
+            return cls.empty(start)
+        lengths = [len(stroke) for stroke in strokes]
+        return cls(np.vstack(strokes), np.concatenate([[0], np.cumsum(lengths)]), start)
+
+    @classmethod
+    def concatenate(cls, programs, start=None):
+        programs = list(programs)
+        if start is None:
+            start = programs[0].start if programs else (0.0, 0.0)
+        if not programs:
+            return cls.empty(start)
+        offsets = [programs[0].stroke_offsets]
+        total = programs[0].stroke_offsets[-1]
+        for program in programs[1:]:
+            offsets.append(program.stroke_offsets[1:] + total)
+            total += program.stroke_offsets[-1]
+        motions = centers = None
+        if any(program.has_arcs for program in programs):
+            motions = np.concatenate([program.motion_codes() for program in programs])
+            centers = np.vstack([program.arc_centers() for program in programs])
+        return cls(np.vstack([program.vertices for program in programs]), np.concatenate(offsets), start,
+                   motions, centers)
+
+    def __len__(self):
+        return len(self.stroke_offsets) - 1
+
+    @property
+    def vertex_count(self):
+        return len(self.vertices)
+
+    @property
+    def has_arcs(self):
+        return self.motions is not None
+
+    def motion_codes(self):
+        if self.motions is None:
+            return np.full(len(self.vertices), LINE, dtype=np.int8)
+        return self.motions
+
+    def arc_centers(self):
+        if self.centers is None:
+            return np.full((len(self.vertices), 2), np.nan)
+        return self.centers
+
+    def flattened(self, tolerance=None):
+        """
+        Line-only copy of the program, with every arc cut into chords the way
+        GRBL does (tolerance defaults to GRBL's $12 arc tolerance)
+        """
+        if not self.has_arcs:
+            return self
+        from geometry import GRBL_ARC_TOLERANCE, arc_points  # geometry imports this module
+        tolerance = tolerance or GRBL_ARC_TOLERANCE
+        strokes = []
+        for start, end in zip(self.stroke_offsets[:-1].tolist(), self.stroke_offsets[1:].tolist()):
+            vertices = self.vertices[start:end].tolist()
+            stroke = [tuple(vertices[0])]
+            for i in range(1, len(vertices)):
+                motion = self.motions[start + i]
+                if motion == LINE:
+                    stroke.append(tuple(vertices[i]))
+                else:
+                    stroke.extend(arc_points(stroke[-1], tuple(vertices[i]), tuple(self.centers[start + i]),
+                                             motion == CLOCKWISE, tolerance))
+            strokes.append(stroke)
+        return StrokeProgram.from_strokes(strokes, self.start)
+
+    @property
+    def end(self):
+        """Pen position after the last stroke"""
+        if not len(self.vertices):
+            return self.start
+        return (float(self.vertices[-1, 0]), float(self.vertices[-1, 1]))
+
+    def stroke(self, index):
+        return self.vertices[self.stroke_offsets[index]:self.stroke_offsets[index + 1]]
+
+    def strokes(self):
+        for start, end in zip(self.stroke_offsets[:-1].tolist(), self.stroke_offsets[1:].tolist()):
+            yield self.vertices[start:end]
+
+    def stroke_starts(self):
+        return self.vertices[self.stroke_offsets[:-1]]
+
+    def stroke_ends(self):
+        return self.vertices[self.stroke_offsets[1:] - 1]
+
+    def travel_vectors(self):
+        """Pen-up moves before each stroke, as (len(self), 2) deltas"""
+        if not len(self):
+            return np.zeros((0, 2))
+        previous = np.concatenate([np.reshape(self.start, (1, 2)), self.stroke_ends()[:-1]])
+        return self.stroke_starts() - previous
+
+    def travel_length(self):
+        """Total pen-up travel in mm"""
+        deltas = self.travel_vectors()
+        return float(np.sqrt((deltas ** 2).sum(axis=1)).sum())
+
+    def lifts(self, tolerance=1e-9):
+        """
+        Mask of strokes that need a pen-up move first.  A stroke that starts
+        exactly where the pen already is (the end of the previous stroke, or
+        start for the first one) is drawn without a travel move.
+        """
+        deltas = self.travel_vectors()
+        return np.sqrt((deltas ** 2).sum(axis=1)) > tolerance
+
+    def _kept(self):
+        keep = np.ones(len(self.vertices), dtype=bool)
+        keep[self.stroke_offsets[:-1][~self.lifts()]] = False
+        return keep
+
+    def to_points(self):
+        """
+        Back to (x, y, pen_down) vertex arrays.  Strokes that continue where
+        the pen already is lose their pen-up vertex.
+        """
+        pen = np.ones(len(self.vertices), dtype=bool)
+        pen[self.stroke_offsets[:-1]] = False
+        keep = self._kept()
+        return self.vertices[keep, 0], self.vertices[keep, 1], pen[keep]
+
+    def point_motions(self):
+        """
+        Motion codes and arc centers matching to_points: LINE for pen-down
+        lines, CLOCKWISE/COUNTERCLOCKWISE for arcs and 0 for pen-up moves
+        """
+        motions = self.motion_codes().copy()
+        motions[self.stroke_offsets[:-1]] = 0
+        keep = self._kept()
+        return motions[keep], self.arc_centers()[keep]
+
+    def moves(self, travel_feed, draw_feed):
+        """
+        Machine moves for the program: end points, feeds (mm/min), whether
+        the machine must stop before each move (pen commands) and the number
+        of pen commands, in the form PlotTimeEstimator.estimate_moves takes.
+        """
+        x, y, pen = self.flattened().to_points()
+        feeds = np.where(pen, draw_feed, travel_feed).astype(float)
+        # Pen goes down before the first drawing move after a travel move,
+        # and up before a travel move that follows drawing
+        previous = np.concatenate([[False], pen[:-1]])
+        stops = pen != previous
+        pen_commands = int(stops.sum()) + int(bool(len(pen)) and pen[-1])
+        return np.column_stack([x, y]), feeds, stops, pen_commands
@@ -0,0 +1,77 @@
+import threading
+
+import pytest
+
+import finalpro
+from batching import WordBatcher
+
+
+class ScriptSource:
+    """Utterances for SpeechCapture: each string is the audio of one, None is a silence"""
+
+    def __init__(self, script):
+        self.script = script
+
+    def utterances(self, running):
+        yield from self.script
+
+
+class EchoRecognizer:
+    def recognize(self, audio):
+        return audio
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    monkeypatch.setitem(finalpro.RECOGNIZERS, "echo", EchoRecognizer)
+    processor = finalpro.SpeechToGCodeProcessor()
+    processor.recognizer_backend = "echo"
+    processor.recognition_workers = 1
+    return processor
+
+
+def transcribe(processor, *script):
+    processor.audio_source = lambda: ScriptSource(script)
+    processor.real_time_transcription()
+
+
+def batches(processor):
+    processor.text_queue.close()
+    return [job.text for job in processor.text_queue]
+
+
+def test_batch_goes_out_at_the_size_the_backlog_calls_for():
+    batcher = WordBatcher(min_words=5, words_per_job=20, max_words=80)
+    assert batcher.add("one two three four") is None
+    assert batcher.add("five six") == "one two three four five six"
+    assert len(batcher) == 0
+    # Two jobs downstream: the batch grows to 40 words, and never past max_words
+    assert batcher.add("word " * 39, backlog=2) is None
+    assert batcher.add("last", backlog=2).split()[-1] == "last"
+    assert batcher.threshold(10) == 80
+    assert [(sample.words, sample.backlog, sample.reason) for sample in batcher.samples] == [
+        (6, 0, "threshold"), (40, 2, "threshold")]
+
+
+def test_silence_flushes_a_short_batch_when_nothing_is_in_flight(processor):
+    transcribe(processor, "hello there", None, "general kenobi")
+    assert batches(processor) == ["hello there"]
+    assert len(processor.batcher) == 2
+    assert processor.batcher.samples[-1].reason == "silence"
+
+
+def test_silence_holds_the_words_while_jobs_are_in_flight(processor):
+    processor.jobs_in_flight = 1
+    transcribe(processor, "hello there", None, "general kenobi", None)
+    assert batches(processor) == []
+    assert len(processor.batcher) == 4
+
+
+def test_shutdown_flushes_the_words_still_held(processor):
+    processor.jobs_in_flight = 1
+    transcribe(processor, "hello there", None)
+    processing = threading.Thread(target=lambda: None)
+    processing.start()
+    processor.shutdown(processing)
+    assert batches(processor) == ["hello there"]
+    assert processor.batcher.samples[-1].reason == "shutdown"
@@ -0,0 +1,24 @@
+import math
+
+import pytest
+
+import document_mode
+import finalpro
+
+TEXT = "\n\n".join(" ".join(f"word{i}" for i in range(paragraph * 50, paragraph * 50 + 120)) for paragraph in range(4))
+
+
+@pytest.mark.parametrize("options", [[], ["--emitter", "compact", "--simplify"]], ids=["grbl", "compact-simplify"])
+def test_parallel_compile_is_byte_identical_to_text_to_gcode(tmp_path, options):
+    source, output = tmp_path / "document.txt", tmp_path / "document.gcode"
+    source.write_text(TEXT, encoding="utf-8")
+    argv = [str(source), "-o", str(output), "--workers", "2", "--page-lines", "5", "--verify"] + options
+    assert document_mode.main(argv) == 0
+
+    serial = finalpro.SpeechToGCodeProcessor()
+    serial.emitter = "compact" if options else "grbl"
+    serial.simplify_geometry = bool(options)
+    serial.optimize_travel = True  # document_mode optimizes unless --no-optimize
+    serial.anchor_lines = True
+    serial.optimize_time_budget = math.inf
+    assert output.read_bytes() == (serial.text_to_gcode(TEXT) + "\n").encode("ascii")
@@ -0,0 +1,71 @@
+import re
+
+import numpy as np
+import pytest
+
+import finalpro
+from preview import Preview
+
+TEXT = "good morning everyone, how are you doing today? quo vadis 0123456789"
+
+
+def compile_text(emitter, options=None, simplify=False):
+    processor = finalpro.SpeechToGCodeProcessor()
+    processor.emitter = emitter
+    processor.emitter_options = {emitter: options or {}}
+    processor.simplify_geometry = simplify
+    # An odd size, so coordinates don't fall on the font's 0.5 mm grid
+    return processor.text_to_gcode(TEXT, char_width=4.37, char_height=7.13)
+
+
+def segments(gcode):
+    preview = Preview()
+    preview.add_gcode(gcode)
+    return preview.segments()
+
+
+def arcs(gcode):
+    """(start, end, center) of every G2/G3 move, following G90/G91 and modal motion"""
+    x = y = 0.0
+    motion, relative, found = 0, False, []
+    for line in gcode.splitlines():
+        words = {letter: float(value) for letter, value in re.findall(r"([A-Z])(-?[\d.]+)", line)}
+        if words.get("G") in (0, 1, 2, 3):
+            motion = int(words["G"])
+        elif words.get("G") in (90, 91):
+            relative = words["G"] == 91
+        if "X" not in words and "Y" not in words:
+            continue
+        start = (x, y)
+        if relative:
+            x, y = x + words.get("X", 0.0), y + words.get("Y", 0.0)
+        else:
+            x, y = words.get("X", x), words.get("Y", y)
+        if motion in (2, 3):
+            found.append((start, (x, y), (start[0] + words.get("I", 0.0), start[1] + words.get("J", 0.0))))
+    return found
+
+
+@pytest.mark.parametrize("simplify", [False, True], ids=["lines", "arcs"])
+@pytest.mark.parametrize("relative", [False, True], ids=["absolute", "G91"])
+def test_compact_output_draws_the_grbl_moves(relative, simplify):
+    expected, expected_ink = segments(compile_text("grbl", simplify=simplify))
+    found, ink = segments(compile_text("compact", {"relative": relative}, simplify))
+    assert np.array_equal(ink, expected_ink)
+    assert np.allclose(found, expected, atol=2e-3)
+
+
+@pytest.mark.parametrize("relative", [False, True], ids=["absolute", "G91"])
+@pytest.mark.parametrize("precision", [1, 2])
+def test_low_precision_arcs_pass_grbl_radius_check(precision, relative):
+    gcode = compile_text("compact", {"precision": precision, "relative": relative}, simplify=True)
+    found = arcs(gcode)
+    assert found
+    for start, end, center in found:
+        assert start != end  # GRBL would draw a full circle
+        radius = np.hypot(end[0] - center[0], end[1] - center[1])
+        error = abs(np.hypot(start[0] - center[0], start[1] - center[1]) - radius)
+        assert error <= 0.005 or error <= 0.001 * radius  # Else GRBL stops with error:33
+    expected, _ = segments(compile_text("grbl", simplify=True))
+    drawn, _ = segments(gcode)
+    assert np.allclose(drawn[-1], expected[-1], atol=10.0 ** -precision)
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import pytest
+
+import finalpro
+from fleet import ERROR, FleetScheduler, SimulatedDevice
+from pipeline import Job
+
+WORDS = " ".join(f"lorem{i}" for i in range(800))
+
+
+@pytest.fixture
+def processor(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Compiled jobs are written to the working directory
+    processor = finalpro.SpeechToGCodeProcessor()
+    processor.paper_changes = []
+    processor.on_page_break = processor.paper_changes.append
+    return processor
+
+
+def submit(fleet, processor, count, size=150):
+    for batch_id in range(1, count + 1):
+        processor.jobs_in_flight += 1
+        fleet.submit(Job(batch_id, WORDS[(batch_id - 1) * size:batch_id * size].strip()))
+    fleet.close()
+
+
+def first_move(job):
+    with open(job.gcode_file) as f:
+        return next(line.split(";")[0].strip() for line in f if line.startswith("G0"))
+
+
+def test_failed_device_jobs_move_to_healthy_device(processor):
+    failing = SimulatedDevice("failing", speedup=1e9, fail_after=1)
+    healthy = SimulatedDevice("healthy", speedup=1e9)
+    fleet = FleetScheduler(processor, [failing, healthy]).start()
+    submit(fleet, processor, 6)
+    assert failing.state == ERROR
+    assert healthy.state != ERROR
+    plotted = [job.batch_id for job in failing.history + healthy.history]
+    assert sorted(plotted) == list(range(1, 7))
+    assert processor.jobs_in_flight == 0
+
+
+def test_requeued_jobs_go_first_and_in_order(processor):
+    failing = SimulatedDevice("failing", speedup=1e9, fail_after=0)
+    healthy = SimulatedDevice("healthy", speedup=1e9)
+    fleet = FleetScheduler(processor, [failing, healthy]).start()
+    submit(fleet, processor, 6)
+    assert failing.history == []
+    assert [job.batch_id for job in healthy.history] == list(range(1, 7))
+    # Recompiled for the healthy device, which starts at the top of its own sheet
+    assert first_move(healthy.history[0]) == f"G0 X{processor.start_x} Y{processor.start_y} F500"
+
+
+def test_full_page_starts_a_new_sheet(processor):
+    device = SimulatedDevice("plotter", speedup=1e9)
+    fleet = FleetScheduler(processor, [device]).start()
+    submit(fleet, processor, 10)
+    assert processor.paper_changes == [1, 2, 3]
+    assert device.pages == 4
+    assert [job.page_breaks for job in device.history if job.page_breaks] == [[1], [2], [3]]
+    # A batch that turns the page starts where the last one stopped and
+    # breaks the page there; none restarts at the top of the old sheet
+    top = f"Y{processor.start_y} "
+    assert [job.batch_id for job in device.history if top in first_move(job)] == [1]
+
+
+def test_devices_keep_plotting_while_a_batch_compiles(processor):
+    device = SimulatedDevice("plotter", speedup=1e9)
+    fleet = FleetScheduler(processor, [device]).start()
+    compiling, release = threading.Event(), threading.Event()
+    compile_job = processor.compile_job
+
+    def slow_compile_job(job):
+        if job.batch_id == 2:
+            compiling.set()
+            release.wait(5)
+        return compile_job(job)
+
+    processor.compile_job = slow_compile_job
+    submitter = threading.Thread(target=submit, args=(fleet, processor, 3))
+    submitter.start()
+    assert compiling.wait(5)
+    # Batch 1 plots and status() answers while batch 2 is still compiling
+    deadline = time.monotonic() + 5
+    while device.plotted < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert fleet.status()[0]["plotted"] == 1
+    release.set()
+    submitter.join(5)
+    assert [job.batch_id for job in device.history] == [1, 2, 3]
+
+
+def test_dry_run_does_not_wait_for_paper_changes(processor, monkeypatch):
+    processor.on_page_break = None  # As on the command line: paper_change() would prompt
+    prompts = []
+    monkeypatch.setattr("builtins.input", prompts.append)
+    device = SimulatedDevice("simulated1", speedup=1e9, pause=False)
+    fleet = FleetScheduler(processor, [device]).start()
+    submit(fleet, processor, 10)
+    assert [job.page_breaks for job in device.history if job.page_breaks] == [[1], [2], [3]]
+    assert prompts == []
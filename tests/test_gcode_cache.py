@@ -0,0 +1,65 @@
+import os
+
+import numpy as np
+import pytest
+
+import finalpro
+from gcode_cache import JobCache
+from pipeline import Job
+from preview import Preview
+
+PHRASE = "thank you very much"
+
+
+def make_processor(emitter, options, cache=None):
+    processor = finalpro.SpeechToGCodeProcessor()
+    processor.emitter = emitter
+    processor.emitter_options = options
+    processor.job_cache = cache
+    return processor
+
+
+def ink(path):
+    preview = Preview()
+    with open(path) as f:
+        preview.add_gcode(f.read().splitlines())
+    segments, drawn = preview.segments()
+    return segments[drawn]
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # Compiled jobs are written to the working directory
+
+
+@pytest.mark.parametrize("emitter, options", [
+    ("grbl", {}),
+    ("compact", {"compact": {"relative": True}}),
+    ("compact", {"compact": {"precision": 2}}),
+], ids=["grbl", "compact-relative", "compact-precision-2"])
+def test_repeated_phrase_hits_anywhere_and_matches_a_fresh_compile(emitter, options):
+    cached = make_processor(emitter, options, JobCache("cache"))
+    fresh = make_processor(emitter, options)
+    for batch_id in range(1, 21):
+        hit, miss = Job(batch_id, PHRASE), Job(batch_id, PHRASE)
+        cached.compile_job(hit)
+        fresh.compile_job(miss)
+        assert (cached.current_x, cached.current_y, cached.current_page) == pytest.approx(
+            (fresh.current_x, fresh.current_y, fresh.current_page))
+        assert np.allclose(ink(hit.gcode_file), ink(miss.gcode_file), atol=1e-3)
+        assert hit.plotting_time == pytest.approx(miss.plotting_time, rel=1e-3)
+    # The cursor is not part of the key: the same phrase further along a line
+    # or at the start of a later line is a hit (phrases that wrap mid-line are
+    # not cached)
+    assert cached.job_cache.hits >= 5
+    assert cached.job_cache.stats()["entries"] == 2
+
+
+def test_eviction_leaves_queued_jobs_their_files():
+    processor = make_processor("grbl", {}, JobCache("cache", max_files=1))
+    jobs = [Job(batch_id, f"word{batch_id}") for batch_id in range(1, 6)]
+    for job in jobs:
+        processor.compile_job(job)
+    assert processor.job_cache.evictions == 4
+    assert all(os.path.exists(job.gcode_file) for job in jobs)
+    assert len({job.gcode_file for job in jobs}) == len(jobs)
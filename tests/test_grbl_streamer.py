@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+pytest.importorskip("serial")
+if not hasattr(os, "openpty"):
+    pytest.skip("FakeGrbl needs a pseudo-terminal", allow_module_level=True)
+
+from fake_grbl import FakeGrbl
+from grbl_streamer import RX_BUFFER_SIZE, GrblStreamer
+
+
+@pytest.fixture
+def grbl():
+    with FakeGrbl(block_time=0.001) as fake:
+        yield fake
+
+
+@pytest.fixture
+def streamer(grbl):
+    with GrblStreamer(grbl.port).connect(boot_timeout=0.1) as streamer:
+        yield streamer
+
+
+def test_stream_never_overflows_rx_buffer(grbl, streamer):
+    lines = [f"G1 X{i % 180}.125 Y{(i * 7) % 260}.375 F500 ; stroke {i}" for i in range(400)]
+    assert streamer.stream(lines) == []
+    assert grbl.received == [line.split(";")[0].strip() for line in lines]
+    assert not grbl.overflowed
+    assert 0 < grbl.max_rx_used <= RX_BUFFER_SIZE
+    assert streamer.lines_acknowledged == len(lines)
+
+
+def test_stream_reports_rejected_lines(grbl, streamer):
+    errors = streamer.stream(["G1 X1 F500", "G1 X=2", "G1 X3"])
+    assert errors == [("G1 X=2", "error:1")]
+    assert grbl.received[-1] == "G1 X3"
+    assert streamer.stream(["G1 X4"]) == []
+
+
+def test_stop_on_error_stops_streaming(grbl, streamer):
+    lines = ["G1 X=1"] + [f"G1 X{i}" for i in range(200)]
+    errors = streamer.stream(lines, stop_on_error=True)
+    assert [error for _, error in errors] == ["error:1"]
+    assert len(grbl.received) < len(lines)
+
+
+def test_program_pause_held_until_cycle_start(grbl, streamer):
+    pauses = []
+
+    def on_pause(line):
+        pauses.append((line, streamer.status()))
+        # Nothing after the pause has been sent yet
+        assert grbl.received[-1] == "M0"
+
+    assert streamer.stream(["G1 X10 F500", "M0 ; change the paper", "G1 X20"], on_pause=on_pause) == []
+    assert [line for line, _ in pauses] == ["M0"]
+    assert pauses[0][1].startswith("<Hold")
+    assert grbl.received == ["G1 X10 F500", "M0", "G1 X20"]
+    assert streamer.wait_until_idle().startswith("<Idle")
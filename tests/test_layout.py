@@ -0,0 +1,98 @@
+import numpy as np
+import pytest
+
+import finalpro
+import layout
+from layout import WRAPS, PageGeometry, glyph_arrays, layout_text, text_blocks
+
+ADVANCE = 6.0
+GLYPHS = glyph_arrays(5, 10)
+LOREM = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+         "et dolore magna aliqua ut enim ad minim veniam quis nostrud exercitation ullamco laboris")
+
+
+def lines(text, wrap, page=None, cursor=(10.0, 100.0)):
+    """Text of every line on the paper, as (page, y, text)"""
+    page = page or PageGeometry(10, 70, 100, None, 15)  # Ten characters to a line
+    result = layout_text(text, GLYPHS, cursor[0], cursor[1], page, ADVANCE, wrap)
+    rows = {}
+    for row, word, _, y, _, _ in result.words():
+        rows.setdefault(row, [int(result.row_pages[row]), y, []])[2].append(word)
+    return [(sheet, y, " ".join(words)) for sheet, y, words in rows.values()]
+
+
+def test_char_wrap_breaks_anywhere():
+    assert [text for _, _, text in lines("abcdefghij" * 3 + "abc", "char")] == ["abcdefghij"] * 3 + ["abc"]
+
+
+def test_greedy_wrap_keeps_words_whole():
+    assert [text for _, _, text in lines("aaa bbb ccc ddd eee", "greedy")] == ["aaa bbb", "ccc ddd", "eee"]
+
+
+def test_word_longer_than_a_line_is_split():
+    assert [text for _, _, text in lines("ab abcdefghijklm", "greedy")] == ["ab", "abcdefghij", "klm"]
+
+
+@pytest.mark.parametrize("wrap", ["greedy", "balanced"])
+def test_blank_line_starts_a_paragraph(wrap):
+    assert [text for _, _, text in lines("aa\n\nbb\ncc", wrap)] == ["aa", "bb cc"]
+
+
+def test_balanced_wrap_evens_out_lines():
+    page = PageGeometry(10, 46, 100, None, 15)  # Six characters to a line
+    assert [text for _, _, text in lines("aaa bb cc ddddd", "greedy", page)] == ["aaa bb", "cc", "ddddd"]
+    assert [text for _, _, text in lines("aaa bb cc ddddd", "balanced", page)] == ["aaa", "bb cc", "ddddd"]
+
+
+@pytest.mark.parametrize("wrap", ["greedy", "balanced"])
+def test_word_wraps_keep_the_text(wrap):
+    page = PageGeometry(10, 130, 100, None, 15)
+    found = lines(LOREM, wrap, page)
+    assert " ".join(text for _, _, text in found) == LOREM
+    assert all(len(text) <= 20 for _, _, text in found)
+
+
+@pytest.mark.parametrize("wrap", WRAPS)
+def test_lines_below_bottom_margin_go_to_next_page(wrap):
+    page = PageGeometry(10, 70, 100, 70, 15)  # Three lines to a page: 100, 85 and 70
+    found = lines("aaaaaaaaa " * 7, wrap, page)
+    assert [(sheet, y) for sheet, y, _ in found] == [(0, 100), (0, 85), (0, 70), (1, 100), (1, 85), (1, 70),
+                                                     (2, 100)]
+    result = layout_text("aaaaaaaaa " * 7, GLYPHS, 10.0, 100.0, page, ADVANCE, wrap)
+    assert result.y.min() >= 70
+    assert result.cursor_page == 2
+
+
+@pytest.mark.parametrize("optimize", [False, True], ids=["font-order", "optimized"])
+@pytest.mark.parametrize("wrap", WRAPS)
+def test_whitespace_only_text_draws_nothing(wrap, optimize):
+    processor = finalpro.SpeechToGCodeProcessor()
+    processor.wrap = wrap
+    processor.text_to_gcode("   \n\n  ", optimize=optimize)
+    processor.text_to_gcode("", optimize=optimize)
+    assert processor.current_y == processor.start_y
+
+
+@pytest.mark.parametrize("wrap", WRAPS)
+@pytest.mark.parametrize("text", ["a" + " " * 20000 + "b", ("word " + " " * 9000) * 3 + "\n\n" * 5000 + "end",
+                                  LOREM * 60], ids=["spaces", "runs", "lorem"])
+def test_blocks_lay_out_like_one_block(wrap, text, monkeypatch):
+    def compile_text(block_size):
+        monkeypatch.setattr(finalpro, "text_blocks", lambda text, _: text_blocks(text, block_size))
+        processor = finalpro.SpeechToGCodeProcessor()
+        processor.wrap = wrap
+        gcode = processor.text_to_gcode(text)
+        return gcode, (processor.current_x, processor.current_y, processor.current_page)
+
+    assert compile_text(8192) == compile_text(10 ** 9)
+
+
+def test_text_blocks_keep_whitespace_with_the_next_word():
+    text = "a" + " " * 20000 + "b" + " c" * 10000
+    blocks = list(text_blocks(text))
+    assert "".join(blocks) == text
+    assert all(block.strip() for block in blocks)
+    chunks = ["a" + " " * 9000, " " * 9000 + "b", " c"]
+    blocks = list(text_blocks(iter(chunks)))
+    assert "".join(blocks) == "".join(chunks)
+    assert all(block.strip() for block in blocks)
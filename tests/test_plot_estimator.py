@@ -0,0 +1,58 @@
+import pytest
+
+from plot_estimator import PlotTimeEstimator
+
+
+@pytest.fixture
+def estimator():
+    return PlotTimeEstimator(acceleration=10.0, max_rate=1000.0, servo_dwell=0.5)
+
+
+def test_trapezoid(estimator):
+    # 10 mm/s reached after 1 s and 5 mm, 90 mm cruise at 10 mm/s, 1 s to stop
+    estimate = estimator.estimate("G1 X100 F600")
+    assert estimate.total_time == pytest.approx(1.0 + 9.0 + 1.0)
+
+
+def test_feed_capped_at_max_rate(estimator):
+    estimator.max_rate = 300.0
+    # 5 mm/s reached after 0.5 s and 1.25 mm
+    assert estimator.estimate("G1 X100 F600").total_time == pytest.approx(0.5 + 97.5 / 5.0 + 0.5)
+
+
+def test_triangle(estimator):
+    # Too short for 10 mm/s: the peak is sqrt(a * length) halfway along
+    estimate = estimator.estimate("G1 X4 F600")
+    assert estimate.total_time == pytest.approx(2 * 40 ** 0.5 / 10.0)
+
+
+def test_diagonal_move_scales_acceleration(estimator):
+    # The Y axis carries 0.8 of the move, so the move may accelerate at 10 / 0.8 mm/s^2
+    estimate = estimator.estimate("G1 X30 Y40 F600")
+    assert estimate.total_time == pytest.approx(0.8 + 4.2 + 0.8)
+
+
+def test_rapid_capped_at_max_rate(estimator):
+    # G0 runs at max_rate, here 1000 mm/min, whatever F says
+    speed = 1000.0 / 60.0
+    ramp = speed / 10.0
+    estimate = estimator.estimate("G0 X100 F5000")
+    assert estimate.total_time == pytest.approx(2 * ramp + (100 - speed * ramp) / speed)
+
+
+def test_straight_junction_keeps_speed(estimator):
+    split = estimator.estimate("G1 X50 F600\nG1 X100")
+    assert split.total_time == pytest.approx(estimator.estimate("G1 X100 F600").total_time)
+
+
+def test_pen_commands_stop_and_dwell(estimator):
+    estimate = estimator.estimate("G1 X50 F600\nM05\nG1 X100\nM03 S90")
+    assert estimate.dwell_time == pytest.approx(1.0)
+    # Each half starts and ends at rest: 1 s up, 4 s cruising, 1 s down
+    assert estimate.motion_time == pytest.approx(2 * (1.0 + 4.0 + 1.0))
+
+
+def test_relative_and_start(estimator):
+    estimate = estimator.estimate("G91\nG1 X100 F600", start=(20.0, 20.0))
+    assert estimate.total_time == pytest.approx(11.0)
+    assert estimate.segment_lengths.tolist() == [100.0]
@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import finalpro
+from pipeline import Job
+from preview import Preview
+from spool import UNDRAWN_LINES, ProgramState, Spool
+
+TEXT = " ".join(f"lorem{i}" for i in range(40))
+
+
+class FakeStreamer:
+    """Acknowledges every line lag lines after it was sent, as GRBL's buffers do"""
+
+    def __init__(self, lag=5):
+        self.lag = lag
+        self.sent = []
+        self.lines_acknowledged = 0
+
+    def stream(self, lines, stop_after=None):
+        for line in lines:
+            self.sent.append(line)
+            self.lines_acknowledged = max(len(self.sent) - self.lag, 0)
+            if len(self.sent) == stop_after:
+                return  # Killed: the rest is never sent or acknowledged
+
+
+def ink(lines):
+    preview = Preview()
+    preview.add_gcode(lines)
+    segments, drawn = preview.segments()
+    return segments[drawn]
+
+
+def final_position(lines):
+    state = ProgramState()
+    for line in lines:
+        state.feed_line(line)
+    return state.position
+
+
+@pytest.mark.parametrize("emitter, options", [
+    ("grbl", {}),
+    ("compact", {"compact": {"relative": False}}),
+    ("compact", {"compact": {"relative": True}}),
+], ids=["grbl", "compact-absolute", "compact-G91"])
+def test_killed_job_resumes_where_it_stopped(tmp_path, emitter, options):
+    processor = finalpro.SpeechToGCodeProcessor()
+    processor.emitter = emitter
+    processor.emitter_options = options
+    processor.spool = Spool(str(tmp_path / "spool"))
+    job = Job(1, TEXT)
+    processor.spool.record_batch(job)
+    processor.compile_job(job)
+    with open(job.gcode_file) as f:
+        program = f.read().splitlines()
+    killed = FakeStreamer()
+    killed.stream(processor.spool.stream_lines(job, killed, every=10), stop_after=len(program) // 2)
+    processor.spool.close()
+
+    spool = Spool(str(tmp_path / "spool"))
+    [resumed] = spool.recovered.jobs
+    assert len(program) // 2 - killed.lag - 10 <= resumed.resume_from <= len(program) // 2 - killed.lag
+    streamer = FakeStreamer()
+    streamer.stream(spool.stream_lines(resumed, streamer))
+    spool.close()
+
+    assert final_position(streamer.sent) == pytest.approx(final_position(program), abs=1e-6)
+    # Only the lines GRBL may not have drawn yet are drawn again: the
+    # resumed stream draws exactly what the program draws from there on
+    start = resumed.resume_from - UNDRAWN_LINES
+    drawn = ink(program)
+    assert 0 < len(ink(program[:start])) < len(drawn)
+    assert np.allclose(ink(streamer.sent), drawn[len(ink(program[:start])):], atol=1e-6)